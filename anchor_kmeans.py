@@ -0,0 +1,206 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Find the smallest anchor set of X-Det which keeps the recall of the ground truth boxes.
+
+Example:
+    python anchor_kmeans.py --data_dir=../PASCAL/VOC_TF/VOC0712TF/ --dataset_name=pascalvoc_0712 --target_recall=0.95
+
+The ground truth boxes are streamed from the record files of --dataset_name and --dataset_split_name.
+A box is recalled if its best anchor has IoU >= --iou_threshold with it, the anchor being centered on
+the cell of the feature map (stride --feature_stride) nearest to the center of the box.
+
+Anchors are a grid of scales x ratios like AnchorCreator. For each grid size the scales and ratios
+are fitted by k-means with 1 - IoU as the distance: every box is assigned to its best anchor, then
+each scale (ratio) is updated to the geometric mean of the scales (ratios) of the boxes assigned to
+it. The smallest grid reaching --target_recall is printed as the flags of the X-Det detectors and
+written into --output_file. The boxes are measured before augmentation.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import importlib
+import itertools
+import json
+import os
+
+import numpy as np
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+import detector_main
+dataset_factory = cli.lazy_import('dataset.dataset_factory')
+from detectors import xdet_resnet
+
+cli.flags.DEFINE_float(
+    'target_recall', 0.95,
+    'The fraction of the ground truth boxes whose best anchor must reach --iou_threshold.')
+cli.flags.DEFINE_float(
+    'iou_threshold', None,
+    'The IoU at which a box counts as recalled, default to --match_threshold.')
+cli.flags.DEFINE_integer(
+    'feature_stride', 8,
+    'The stride in pixels of the anchor layer on the image of --train_image_size, 16 for xdet_v3_resnet.')
+cli.flags.DEFINE_integer(
+    'max_scales', 8,
+    'The largest number of scales to try.')
+cli.flags.DEFINE_integer(
+    'max_ratios', 6,
+    'The largest number of ratios to try.')
+cli.flags.DEFINE_integer(
+    'kmeans_iters', 30,
+    'The maximum number of k-means iterations of each grid.')
+cli.flags.DEFINE_string(
+    'output_file', None,
+    'Write the chosen anchors and the recall of every grid into this json file.')
+
+FLAGS = cli.flags.FLAGS
+
+# boxes are processed in chunks to bound the memory of the boxes x anchors IoU matrix
+_CHUNK_SIZE = 65536
+
+def get_file_pattern(dataset_name, split_name, data_dir):
+    if dataset_name in dataset_factory.datasets_map:
+        dataset_module = dataset_factory.datasets_map[dataset_name]
+    else:
+        dataset_module = importlib.import_module('dataset.' + dataset_name)
+    return os.path.join(data_dir, dataset_module.FILE_PATTERN % split_name)
+
+def read_boxes(file_pattern):
+    '''Return N x 4 boxes of all records, [center_y, center_x, height, width] relative to the image.'''
+    boxes = []
+    filenames = sorted(tf.gfile.Glob(file_pattern))
+    if not filenames:
+        raise ValueError('No record file matches {}.'.format(file_pattern))
+    for filename in filenames:
+        for record in tf.python_io.tf_record_iterator(filename):
+            feature = tf.train.Example.FromString(record).features.feature
+            ymin, xmin, ymax, xmax = [np.array(feature['image/object/bbox/' + name].float_list.value, dtype=np.float32) for name in ('ymin', 'xmin', 'ymax', 'xmax')]
+            boxes.append(np.stack([(ymin + ymax) / 2., (xmin + xmax) / 2., ymax - ymin, xmax - xmin], axis=-1))
+        tf.logging.info('%s: %d boxes so far.', filename, sum(len(b) for b in boxes))
+    boxes = np.concatenate(boxes, axis=0) if boxes else np.zeros([0, 4], dtype=np.float32)
+    # skip degenerated boxes
+    return boxes[np.logical_and(boxes[:, 2] > 0., boxes[:, 3] > 0.)]
+
+def grid_anchors(scales, ratios, extra_scales=()):
+    '''K x 2 [height, width] of the anchors, in the same order as AnchorCreator.'''
+    anchors = [(scale, scale) for scale in extra_scales]
+    anchors += [(scale / np.sqrt(ratio), scale * np.sqrt(ratio)) for scale in scales for ratio in ratios]
+    return np.array(anchors, dtype=np.float32)
+
+def best_anchor_iou(boxes, anchors, cell_size):
+    '''IoU of each box and each anchor centered on the nearest cell, N x K.'''
+    offset_y = np.abs(boxes[:, 0] - (np.floor(boxes[:, 0] / cell_size) + 0.5) * cell_size)[:, None]
+    offset_x = np.abs(boxes[:, 1] - (np.floor(boxes[:, 1] / cell_size) + 0.5) * cell_size)[:, None]
+    box_h, box_w = boxes[:, 2:3], boxes[:, 3:4]
+    anchor_h, anchor_w = anchors[None, :, 0], anchors[None, :, 1]
+    # overlap of two segments whose centers are offset apart
+    def overlap(offset, box_size, anchor_size):
+        return np.maximum(np.minimum(offset + box_size / 2., anchor_size / 2.) - np.maximum(offset - box_size / 2., -anchor_size / 2.), 0.)
+    inter = overlap(offset_y, box_h, anchor_h) * overlap(offset_x, box_w, anchor_w)
+    return inter / (box_h * box_w + anchor_h * anchor_w - inter)
+
+def assign(boxes, anchors, cell_size):
+    '''Return the index and the IoU of the best anchor of each box.'''
+    best_index = np.zeros([len(boxes)], dtype=np.int64)
+    best_iou = np.zeros([len(boxes)], dtype=np.float32)
+    for start in range(0, len(boxes), _CHUNK_SIZE):
+        iou = best_anchor_iou(boxes[start:start + _CHUNK_SIZE], anchors, cell_size)
+        best_index[start:start + _CHUNK_SIZE] = np.argmax(iou, axis=1)
+        best_iou[start:start + _CHUNK_SIZE] = np.max(iou, axis=1)
+    return best_index, best_iou
+
+def fit_grid(boxes, num_scales, num_ratios, cell_size, num_iters):
+    '''k-means of a scales x ratios grid with 1 - IoU distance, return (scales, ratios, best IoU of each box).'''
+    log_scales = 0.5 * np.log(boxes[:, 2] * boxes[:, 3])
+    log_ratios = np.log(boxes[:, 3] / boxes[:, 2])
+    # initialize with the quantiles, at the centers of equally populated bins
+    quantiles = lambda values, num : np.percentile(values, (np.arange(num) + 0.5) * 100. / num)
+    scales = np.exp(quantiles(log_scales, num_scales))
+    ratios = np.exp(quantiles(log_ratios, num_ratios))
+
+    for _ in range(num_iters):
+        best_index, best_iou = assign(boxes, grid_anchors(scales, ratios), cell_size)
+        scale_index, ratio_index = best_index // num_ratios, best_index % num_ratios
+        new_scales, new_ratios = scales.copy(), ratios.copy()
+        # empty clusters keep their centers
+        for i in range(num_scales):
+            if np.any(scale_index == i):
+                new_scales[i] = np.exp(np.mean(log_scales[scale_index == i]))
+        for i in range(num_ratios):
+            if np.any(ratio_index == i):
+                new_ratios[i] = np.exp(np.mean(log_ratios[ratio_index == i]))
+        if np.allclose(new_scales, scales) and np.allclose(new_ratios, ratios):
+            break
+        scales, ratios = new_scales, new_ratios
+
+    _, best_iou = assign(boxes, grid_anchors(scales, ratios), cell_size)
+    return np.sort(scales), np.sort(ratios), best_iou
+
+def search(boxes, target_recall, iou_threshold, cell_size):
+    '''Fit the grids from the fewest anchors up, stop at the first number of anchors reaching target_recall.'''
+    grids = sorted(itertools.product(range(1, FLAGS.max_scales + 1), range(1, FLAGS.max_ratios + 1)), key=lambda grid : (grid[0] * grid[1], grid))
+    results = []
+    best = None
+    for num_anchors, same_size in itertools.groupby(grids, key=lambda grid : grid[0] * grid[1]):
+        for num_scales, num_ratios in same_size:
+            scales, ratios, best_iou = fit_grid(boxes, num_scales, num_ratios, cell_size, FLAGS.kmeans_iters)
+            result = {'num_anchors': num_anchors,
+                    'anchor_scales': [round(float(_), 4) for _ in scales],
+                    'anchor_ratios': [round(float(_), 4) for _ in ratios],
+                    'recall': float(np.mean(best_iou >= iou_threshold)),
+                    'mean_iou': float(np.mean(best_iou))}
+            tf.logging.info('%d scales x %d ratios: recall %.4f, mean best IoU %.4f', num_scales, num_ratios, result['recall'], result['mean_iou'])
+            results.append(result)
+            if result['recall'] >= target_recall and (best is None or result['recall'] > best['recall']):
+                best = result
+        if best is not None:
+            break
+    return best, results
+
+def main(_):
+    iou_threshold = FLAGS.iou_threshold if FLAGS.iou_threshold is not None else FLAGS.match_threshold
+    cell_size = FLAGS.feature_stride / FLAGS.train_image_size
+
+    boxes = read_boxes(get_file_pattern(FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.data_dir))
+    tf.logging.info('Read %d boxes.', len(boxes))
+
+    # the anchors in use, from the flags of the X-Det detectors
+    current_anchors = grid_anchors(xdet_resnet.parse_anchor_list(FLAGS.anchor_scales),
+                                    xdet_resnet.parse_anchor_list(FLAGS.anchor_ratios),
+                                    xdet_resnet.parse_anchor_list(FLAGS.extra_anchor_scales))
+    _, current_iou = assign(boxes, current_anchors, cell_size)
+    current = {'num_anchors': len(current_anchors),
+                'recall': float(np.mean(current_iou >= iou_threshold)),
+                'mean_iou': float(np.mean(current_iou))}
+    tf.logging.info('Current %d anchors: recall %.4f, mean best IoU %.4f', current['num_anchors'], current['recall'], current['mean_iou'])
+
+    best, results = search(boxes, FLAGS.target_recall, iou_threshold, cell_size)
+    if FLAGS.output_file:
+        with tf.gfile.GFile(FLAGS.output_file, 'w') as f:
+            json.dump({'iou_threshold': iou_threshold, 'target_recall': FLAGS.target_recall,
+                        'current': current, 'best': best, 'grids': results}, f, indent=2)
+    if best is None:
+        raise ValueError('No grid up to {} scales x {} ratios reaches recall {}, raise --max_scales or --max_ratios.'.format(
+                        FLAGS.max_scales, FLAGS.max_ratios, FLAGS.target_recall))
+
+    print('{} anchors (was {}) with recall {:.4f} (was {:.4f}) at IoU {}:'.format(
+            best['num_anchors'], current['num_anchors'], best['recall'], current['recall'], iou_threshold))
+    print('--anchor_scales={} --anchor_ratios={} --extra_anchor_scales='.format(
+            ','.join(str(_) for _ in best['anchor_scales']), ','.join(str(_) for _ in best['anchor_ratios'])))
+
+if __name__ == '__main__':
+  cli.run(main)
@@ -32,6 +32,7 @@
 #include "tensorflow/core/framework/shape_inference.h"
 
 #include <cmath>
+#include <vector>
 
 using namespace tensorflow;
 
@@ -178,11 +179,10 @@ REGISTER_OP("PsRoiAlignGrad")
 //   }
 // };
 
-// // calculate gradients from input side
-// // the result of this kernel is same as the above kernel which is calculate gradients from the output side
-// // the different is that this kernel don't need synchronous gradients of the same input cell
-// // but the drawback of this kernel is that more threads scheduling may be occurred due to the larger input feature map size compared with output feature map
-// // you can choose any one to use depends on the relative overhead between the scheduling and atomic sync operation
+// calculate gradients from the input side without any atomic operation:
+// each bin of the grid only pools its own bank of channals, so each worker takes one bank of one image,
+// scatters the gradients of all ROIs into a local 'HWC' buffer of this bank which is small enough to stay in cache,
+// and then copy the buffer back into the 'NCHW' output
 template <typename T>
 struct PSROIAlignGradFunctor<CPUDevice, T> {
   void operator()(OpKernelContext* context, const CPUDevice& d, typename TTypes<T>::ConstFlat inputs, typename TTypes<T>::ConstFlat rois, const int32_t grid_dim_width, const int32_t grid_dim_height, typename TTypes<T>::ConstFlat pooled_features_grad, typename TTypes<int32_t>::ConstFlat pooled_index, typename TTypes<T>::Flat grad_output, KDimSize dim_info) {
@@ -195,129 +195,88 @@ struct PSROIAlignGradFunctor<CPUDevice, T> {
 
     std::tie(batch_size, num_channals, map_height, map_width, num_rois, using_max_pool) = dim_info;
 
-    grad_output = grad_output.setZero();
+    const int32_t grid_size = grid_dim_width * grid_dim_height;
+    const int32_t bank_size = num_channals / grid_size;
+    const int64_t map_size = static_cast<int64_t>(map_height) * map_width;
 
-    auto pooling_grad_routine = [&rois, &pooled_features_grad, &pooled_index, &grad_output, grid_dim_width, grid_dim_height, batch_size, num_channals, map_height, map_width, num_rois, using_max_pool](int64_t start, int64_t limit){
-      const int32_t grid_size = grid_dim_width * grid_dim_height;
-      const int32_t bank_size = num_channals/grid_size;
+    auto pooling_grad_routine = [&rois, &pooled_features_grad, &pooled_index, &grad_output, grid_dim_width, grid_dim_height, grid_size, bank_size, num_channals, map_height, map_width, map_size, num_rois, using_max_pool](int64_t start, int64_t limit){
+      std::vector<T> bank_grad(map_size * bank_size);
+      std::vector<T> scaled_grad(bank_size);
+      std::vector<BilinearCoord> rows_to_pool;
+      std::vector<BilinearCoord> cols_to_pool;
       for (int64_t worker_index = start; worker_index < limit; ++worker_index){
-        const int32_t cur_image_index = worker_index / (num_channals * map_height * map_width);
-        const int32_t cur_channal_index = (worker_index % (num_channals * map_height * map_width)) / (map_height * map_width);
-        const int32_t offset_on_map = worker_index % (map_height * map_width);
-        const int32_t col_on_map = offset_on_map % map_width;
-        const int32_t row_on_map = offset_on_map / map_width;
-
-        T * grad_to_fill = reinterpret_cast<T*>(grad_output.data() + worker_index);
-
-        for(int roi_index = 0;roi_index < num_rois;++roi_index){
-          const T * roi_to_pool = rois.data() + (cur_image_index * num_rois + roi_index) * 4;
-
-          T roi_ymin = static_cast<T>(0);
-          T roi_xmin = static_cast<T>(0);
-          T roi_ymax = static_cast<T>(0);
-          T roi_xmax = static_cast<T>(0);
+        const int32_t image_index = worker_index / grid_size;
+        const int32_t position_index = worker_index % grid_size;
+        const int32_t row_index = position_index / grid_dim_width;
+        const int32_t col_index = position_index % grid_dim_width;
+        std::fill(bank_grad.begin(), bank_grad.end(), static_cast<T>(0));
+
+        for (int32_t roi_index = 0; roi_index < num_rois; ++roi_index) {
+          PSROIAlignGrid grid;
           // fix ROI
-          if(roi_to_pool[2] < std::numeric_limits<T>::min() || roi_to_pool[3] < std::numeric_limits<T>::min()) continue;
-          std::tie(roi_ymin, roi_xmin, roi_ymax, roi_xmax) = [roi_to_pool, map_height, map_width](){
-            T roi_y_center = static_cast<T>(roi_to_pool[0] * map_height);
-            T roi_x_center = static_cast<T>(roi_to_pool[1] * map_width);
-            T roi_h = std::max(roi_to_pool[2] * map_height, static_cast<T>(1));
-            T roi_w = std::max(roi_to_pool[3] * map_width, static_cast<T>(1));
-
-            T roi_ymin = std::max(roi_y_center - static_cast<T>(roi_h / 2.), static_cast<T>(0));
-            T roi_xmin = std::max(roi_x_center - static_cast<T>(roi_w / 2.), static_cast<T>(0));
-            T roi_ymax = std::min(roi_y_center + static_cast<T>(roi_h / 2.), static_cast<T>(map_height) - std::numeric_limits<T>::min());
-            T roi_xmax = std::min(roi_x_center + static_cast<T>(roi_w / 2.), static_cast<T>(map_width) - std::numeric_limits<T>::min());
-            return std::make_tuple(roi_ymin, roi_xmin, roi_ymax, roi_xmax);
-          }();
-          // T roi_center_y = roi_to_pool[0];
-          // T roi_center_x = roi_to_pool[1];
-          T roi_h = roi_ymax - roi_ymin;
-          T roi_w = roi_xmax - roi_xmin;
-          float pool_bin_width = static_cast<float>(roi_w) / grid_dim_width;
-          float pool_bin_height = static_cast<float>(roi_h) / grid_dim_height;
-          int32_t num_elem_width = static_cast<int32_t>(pool_bin_width) + 1;
-          int32_t num_elem_height = static_cast<int32_t>(pool_bin_height) + 1;
-
-          // std::cout << "pool_bin_width: " << pool_bin_width << " pool_bin_height: " << pool_bin_height << " num_elem_width: " << num_elem_width << " num_elem_height: " << num_elem_height << std::endl;
-
-          // std::cout << "worker_index: " << worker_index << " roi_index: " << roi_index
-          // << " roi_ymin: " << roi_ymin << " roi_xmin: " << roi_xmin << " roi_ymax: " << roi_ymax << " roi_xmax: " << roi_xmax << " cur_image_index: " << cur_image_index << " position_index: " << (position_index % grid_size) << " channal_pos_remainder: " << channal_pos_remainder << std::endl;
-          float step_width_each_bin = pool_bin_width / num_elem_width;
-          float step_height_each_bin = pool_bin_height / num_elem_height;
-
-          const T pooled_features_grad_in = *(pooled_features_grad.data() + cur_image_index * (num_rois * num_channals) + roi_index * num_channals + cur_channal_index);
-          const int32_t pooled_max_index = *(pooled_index.data() + cur_image_index * (num_rois * num_channals) + roi_index * num_channals + cur_channal_index);
-
-          const int32_t row_index = (cur_channal_index / bank_size) / grid_dim_width;
-          const int32_t col_index = (cur_channal_index / bank_size) % grid_dim_width;
-
-          float pool_width_start = roi_xmin + pool_bin_width * col_index;
-          float pool_height_start = roi_ymin + pool_bin_height * row_index;
+          if(!grid.init(rois.data() + (image_index * num_rois + roi_index) * 4, map_height, map_width, grid_dim_width, grid_dim_height)) continue;
+          const int32_t num_elem_height = grid.num_elem_height;
+          const int32_t num_elem_width = grid.num_elem_width;
+          rows_to_pool.resize(num_elem_height);
+          cols_to_pool.resize(num_elem_width);
+          make_bilinear_coords(grid.roi_ymin + grid.pool_bin_height * row_index, grid.step_height_each_bin, num_elem_height, map_height, rows_to_pool.data());
+          make_bilinear_coords(grid.roi_xmin + grid.pool_bin_width * col_index, grid.step_width_each_bin, num_elem_width, map_width, cols_to_pool.data());
+
+          const int64_t pooled_offset = ((static_cast<int64_t>(image_index) * num_rois + roi_index) * grid_size + position_index) * bank_size;
+          const T * pooled_features_grad_in = pooled_features_grad.data() + pooled_offset;
 
           if(using_max_pool){
-            const int32_t h_ind = pooled_max_index / num_elem_width;
-            const int32_t w_ind = pooled_max_index % num_elem_width;
-
-            float col_to_pool = pool_width_start + step_width_each_bin * w_ind + step_width_each_bin / 2.;
-            float row_to_pool = pool_height_start + step_height_each_bin * h_ind + step_height_each_bin / 2.;
-            //std::cout << "col_to_pool: " << col_to_pool << " row_to_pool: " << row_to_pool << std::endl;
-            int32_t int_col_to_pool = static_cast<int32_t>(col_to_pool);
-            int32_t int_row_to_pool = static_cast<int32_t>(row_to_pool);
-            float float_col_to_pool = col_to_pool - int_col_to_pool;
-            float float_row_to_pool = row_to_pool - int_row_to_pool;
-
-            // not 'if else' here for there may be collapsing in pooling operation when the ROI is small enough
-            if(col_on_map == int_col_to_pool && row_on_map == int_row_to_pool){
-              *grad_to_fill += static_cast<T>((1. - float_col_to_pool) * (1. - float_row_to_pool) * pooled_features_grad_in);
-            }
-            if(col_on_map == int_col_to_pool && row_on_map == std::min(int_row_to_pool + 1, map_height - 1)){
-              *grad_to_fill += static_cast<T>((1. - float_col_to_pool) * float_row_to_pool * pooled_features_grad_in);
-            }
-            if(col_on_map == std::min(int_col_to_pool + 1, map_width - 1) && row_on_map == int_row_to_pool){
-              *grad_to_fill += static_cast<T>(float_col_to_pool * (1. - float_row_to_pool) * pooled_features_grad_in);
-            }
-            if(col_on_map == std::min(int_col_to_pool + 1, map_width - 1) && row_on_map == std::min(int_row_to_pool + 1, map_height - 1)){
-              *grad_to_fill += static_cast<T>(float_col_to_pool * float_row_to_pool * pooled_features_grad_in);
+            // only the max sample of each channal gets the gradient, so the samples differ from channal to channal
+            const int32_t * pooled_max_index = pooled_index.data() + pooled_offset;
+            for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) {
+              const BilinearCoord & row = rows_to_pool[pooled_max_index[bank_index] / num_elem_width];
+              const BilinearCoord & col = cols_to_pool[pooled_max_index[bank_index] % num_elem_width];
+              const T grad_in = pooled_features_grad_in[bank_index];
+              // not 'if else' here for there may be collapsing in pooling operation when the ROI is small enough
+              bank_grad[(row.low * map_width + col.low) * bank_size + bank_index] += static_cast<T>((1. - col.frac) * (1. - row.frac) * grad_in);
+              bank_grad[(row.high * map_width + col.low) * bank_size + bank_index] += static_cast<T>((1. - col.frac) * row.frac * grad_in);
+              bank_grad[(row.low * map_width + col.high) * bank_size + bank_index] += static_cast<T>(col.frac * (1. - row.frac) * grad_in);
+              bank_grad[(row.high * map_width + col.high) * bank_size + bank_index] += static_cast<T>(col.frac * row.frac * grad_in);
             }
           }else{
-            T acc_back_grad = static_cast<T>(0);
+            const T num_elem = static_cast<T>(num_elem_height * num_elem_width);
+            for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) scaled_grad[bank_index] = pooled_features_grad_in[bank_index] / num_elem;
             for (int32_t h_ind = 0; h_ind < num_elem_height; ++h_ind) {
+              const BilinearCoord & row = rows_to_pool[h_ind];
               for (int32_t w_ind = 0; w_ind < num_elem_width; ++w_ind) {
-                float col_to_pool = pool_width_start + step_width_each_bin * w_ind + step_width_each_bin / 2.;
-                float row_to_pool = pool_height_start + step_height_each_bin * h_ind + step_height_each_bin / 2.;
-                //std::cout << "col_to_pool: " << col_to_pool << " row_to_pool: " << row_to_pool << std::endl;
-                int32_t int_col_to_pool = static_cast<int32_t>(col_to_pool);
-                int32_t int_row_to_pool = static_cast<int32_t>(row_to_pool);
-                float float_col_to_pool = col_to_pool - int_col_to_pool;
-                float float_row_to_pool = row_to_pool - int_row_to_pool;
-
-                if(col_on_map == int_col_to_pool && row_on_map == int_row_to_pool){
-                  acc_back_grad += static_cast<T>((1. - float_col_to_pool) * (1. - float_row_to_pool) * pooled_features_grad_in);
-                }
-                if(col_on_map == int_col_to_pool && row_on_map == std::min(int_row_to_pool + 1, map_height - 1)){
-                  acc_back_grad += static_cast<T>((1. - float_col_to_pool) * float_row_to_pool * pooled_features_grad_in);
-                }
-                if(col_on_map == std::min(int_col_to_pool + 1, map_width - 1) && row_on_map == int_row_to_pool){
-                  acc_back_grad += static_cast<T>(float_col_to_pool * (1. - float_row_to_pool) * pooled_features_grad_in);
-                }
-                if(col_on_map == std::min(int_col_to_pool + 1, map_width - 1) && row_on_map == std::min(int_row_to_pool + 1, map_height - 1)){
-                  acc_back_grad += static_cast<T>(float_col_to_pool * float_row_to_pool * pooled_features_grad_in);
-                }
+                const BilinearCoord & col = cols_to_pool[w_ind];
+                T * top_left = bank_grad.data() + (row.low * map_width + col.low) * bank_size;
+                T * bottom_left = bank_grad.data() + (row.high * map_width + col.low) * bank_size;
+                T * top_right = bank_grad.data() + (row.low * map_width + col.high) * bank_size;
+                T * bottom_right = bank_grad.data() + (row.high * map_width + col.high) * bank_size;
+                const T top_left_weight = static_cast<T>((1. - col.frac) * (1. - row.frac));
+                const T bottom_left_weight = static_cast<T>((1. - col.frac) * row.frac);
+                const T top_right_weight = static_cast<T>(col.frac * (1. - row.frac));
+                const T bottom_right_weight = static_cast<T>(col.frac * row.frac);
+                // the four corners may be the same cell, so they are accumulated one by one
+                for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) top_left[bank_index] += top_left_weight * scaled_grad[bank_index];
+                for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) bottom_left[bank_index] += bottom_left_weight * scaled_grad[bank_index];
+                for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) top_right[bank_index] += top_right_weight * scaled_grad[bank_index];
+                for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) bottom_right[bank_index] += bottom_right_weight * scaled_grad[bank_index];
               }
             }
-            *grad_to_fill += acc_back_grad / static_cast<T>(num_elem_width * num_elem_height);
           }
         }
 
+        T * grad_to_fill = grad_output.data() + (static_cast<int64_t>(image_index) * num_channals + position_index * bank_size) * map_size;
+        for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) {
+          for (int64_t offset_on_map = 0; offset_on_map < map_size; ++offset_on_map) {
+            grad_to_fill[bank_index * map_size + offset_on_map] = bank_grad[offset_on_map * bank_size + bank_index];
+          }
+        }
       }
     };
 
     const DeviceBase::CpuWorkerThreads& worker_threads = *(context->device()->tensorflow_cpu_worker_threads());
-    // one worker for one position in each ROI
-    const int64_t shard_cost = num_rois * 4;
+    // one worker for one bank in each image
+    const int64_t shard_cost = (num_rois * 4 * 8 + map_size * 2) * bank_size;
     Shard(worker_threads.num_threads, worker_threads.workers,
-          grad_output.size(), shard_cost, pooling_grad_routine);
+          batch_size * grid_size, shard_cost, pooling_grad_routine);
   }
 };
 
@@ -355,6 +314,8 @@ class PSROIAlignGradOp : public OpKernel {
     const int num_rois = rois_in.dim_size(1);
 
     const int32_t grid_size = grid_dim_width_in * grid_dim_height_in;
+    // the functors only write grid_size * bank_size channels, the others would be left uninitialized
+    OP_REQUIRES(context, grid_size > 0 && num_channals % grid_size == 0, errors::InvalidArgument("the number of channals ", num_channals, " must be a multiple of grid_dim_width * grid_dim_height = ", grid_size));
     auto bank_size = static_cast<int>(num_channals / grid_size);
 
     OP_REQUIRES(context, pooled_features_grad.shape() == TensorShape({batch_size, num_rois, grid_size, bank_size}), errors::InvalidArgument("both pooled_index and pooled_features_grad must have the shape 'batch_size x num_rois x grid_size x bank_size'"));
@@ -19,6 +19,8 @@
 // LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 // OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 // SOFTWARE.
+#define EIGEN_USE_THREADS
+
 #include "ps_roi_align_op.h"
 #include "work_sharder.h"
 
@@ -31,6 +33,7 @@
 #include "tensorflow/core/framework/shape_inference.h"
 
 #include <cmath>
+#include <vector>
 
 using namespace tensorflow;
 
@@ -77,7 +80,9 @@ REGISTER_OP("PsRoiAlign")
 
 
 // CPU specialization of actual computation.
-//template <typename T>
+// the feature map is transposed to 'NHWC' first so that all channals of one bank are contiguous,
+// then each worker pools a chunk of ROIs: the bilinear sampling grid is computed once for each ROI and bin,
+// and every sample is applied to the whole bank in one inner loop, which is simple enough to be vectorized
 template <typename T>
 struct PSROIAlignFunctor<CPUDevice, T> {
   void operator()(OpKernelContext* context, const CPUDevice& d, typename TTypes<T>::ConstFlat inputs, typename TTypes<T>::ConstFlat rois, const int32_t grid_dim_width, const int32_t grid_dim_height, typename TTypes<T>::Flat pooled_features, typename TTypes<int32_t>::Flat pooled_index, KDimSize dim_info) {
@@ -91,112 +96,95 @@ struct PSROIAlignFunctor<CPUDevice, T> {
 
     std::tie(batch_size, num_channals, map_height, map_width, num_rois, using_max_pool) = dim_info;
 
-    auto pooling_routine = [&inputs, &rois, &pooled_features, &pooled_index, grid_dim_width, grid_dim_height, batch_size, num_channals, map_height, map_width, num_rois, using_max_pool](int64_t start, int64_t limit){
-      const int32_t grid_size = grid_dim_width * grid_dim_height;
-      const int32_t bank_size = num_channals/grid_size;
-      for (int64_t worker_index = start; worker_index < limit; ++worker_index){
-        // worker_index / bank_size / grid_size * num_channals + worker_index / bank_size / grid_size % num_rois * num_channals + (worker_index % grid_size) + worker_index % bank_size;
-        // image_index * roi_index * channal_pos_remainder * row_index * col_index
-        const int32_t position_index = (worker_index % num_channals) / bank_size;
-        const int32_t row_index = position_index / grid_dim_width;
-        const int32_t col_index = position_index % grid_dim_width;
-        // position of the channal of pooled feature
-        // position of the channal in the bank of feature map
-        const int32_t channal_pos_remainder = worker_index % bank_size;
-        const int32_t pool_index = worker_index / num_channals;
-        const int32_t image_index = pool_index / num_rois;
-        const int32_t roi_index = pool_index % num_rois;
+    Tensor transposed_inputs;
+    OP_REQUIRES_OK(context, context->allocate_temp(DataTypeToEnum<T>::value, TensorShape({batch_size, map_height, map_width, num_channals}), &transposed_inputs));
+    typename TTypes<T, 4>::ConstTensor inputs_nchw(inputs.data(), batch_size, num_channals, map_height, map_width);
+    transposed_inputs.tensor<T, 4>().device(d) = inputs_nchw.shuffle(Eigen::array<int, 4>{{0, 2, 3, 1}});
+    const T * inputs_nhwc = transposed_inputs.flat<T>().data();
 
-        const T * roi_to_pool = rois.data() + (image_index * num_rois + roi_index) * 4;
+    const int32_t grid_size = grid_dim_width * grid_dim_height;
+    const int32_t bank_size = num_channals / grid_size;
 
-        const T * feature_map_to_pool = inputs.data() + (image_index * num_channals + position_index * bank_size + channal_pos_remainder) * map_height * map_width;
-        // T * pooled_features_start = pooled_features.data() + image_index * (num_rois * num_channals) + roi_index * num_channals + (position_index % grid_size) * bank_size + channal_pos_remainder;
-        // int32_t * pooled_index_start = pooled_index.data() + image_index * (num_rois * num_channals) + roi_index * num_channals + (position_index % grid_size) * bank_size + channal_pos_remainder;
-        T * pooled_features_start = pooled_features.data() + worker_index;
-        int32_t * pooled_index_start = pooled_index.data() + worker_index;
+    auto pooling_routine = [&rois, &pooled_features, &pooled_index, inputs_nhwc, grid_dim_width, grid_dim_height, grid_size, bank_size, num_channals, map_height, map_width, num_rois, using_max_pool](int64_t start, int64_t limit){
+      std::vector<BilinearCoord> rows_to_pool;
+      std::vector<BilinearCoord> cols_to_pool;
+      for (int64_t pool_index = start; pool_index < limit; ++pool_index){
+        const int32_t image_index = pool_index / num_rois;
+        T * pooled_features_start = pooled_features.data() + pool_index * grid_size * bank_size;
+        int32_t * pooled_index_start = pooled_index.data() + pool_index * grid_size * bank_size;
+        std::fill(pooled_index_start, pooled_index_start + grid_size * bank_size, 0);
 
-        T roi_ymin = static_cast<T>(0);
-        T roi_xmin = static_cast<T>(0);
-        T roi_ymax = static_cast<T>(0);
-        T roi_xmax = static_cast<T>(0);
+        PSROIAlignGrid grid;
         // fix ROI
-        if(roi_to_pool[2] < std::numeric_limits<T>::min() || roi_to_pool[3] < std::numeric_limits<T>::min()){
-          *pooled_features_start = static_cast<T>(0);
+        if(!grid.init(rois.data() + pool_index * 4, map_height, map_width, grid_dim_width, grid_dim_height)){
+          std::fill(pooled_features_start, pooled_features_start + grid_size * bank_size, static_cast<T>(0));
           continue;
         }
+        const int32_t num_elem_height = grid.num_elem_height;
+        const int32_t num_elem_width = grid.num_elem_width;
+        // sampling coordinates of all bins, the bin (row_index, col_index) uses rows_to_pool[row_index * num_elem_height + h_ind] and cols_to_pool[col_index * num_elem_width + w_ind]
+        rows_to_pool.resize(grid_dim_height * num_elem_height);
+        cols_to_pool.resize(grid_dim_width * num_elem_width);
+        for (int32_t row_index = 0; row_index < grid_dim_height; ++row_index) {
+          make_bilinear_coords(grid.roi_ymin + grid.pool_bin_height * row_index, grid.step_height_each_bin, num_elem_height, map_height, rows_to_pool.data() + row_index * num_elem_height);
+        }
+        for (int32_t col_index = 0; col_index < grid_dim_width; ++col_index) {
+          make_bilinear_coords(grid.roi_xmin + grid.pool_bin_width * col_index, grid.step_width_each_bin, num_elem_width, map_width, cols_to_pool.data() + col_index * num_elem_width);
+        }
 
-        std::tie(roi_ymin, roi_xmin, roi_ymax, roi_xmax) = [roi_to_pool, map_height, map_width](){
-          T roi_y_center = static_cast<T>(roi_to_pool[0] * map_height);
-          T roi_x_center = static_cast<T>(roi_to_pool[1] * map_width);
-          T roi_h = std::max(roi_to_pool[2] * map_height, static_cast<T>(1));
-          T roi_w = std::max(roi_to_pool[3] * map_width, static_cast<T>(1));
-
-          T roi_ymin = std::max(roi_y_center - static_cast<T>(roi_h / 2.), static_cast<T>(0));
-          T roi_xmin = std::max(roi_x_center - static_cast<T>(roi_w / 2.), static_cast<T>(0));
-          T roi_ymax = std::min(roi_y_center + static_cast<T>(roi_h / 2.), static_cast<T>(map_height) - std::numeric_limits<T>::min());
-          T roi_xmax = std::min(roi_x_center + static_cast<T>(roi_w / 2.), static_cast<T>(map_width) - std::numeric_limits<T>::min());
-          return std::make_tuple(roi_ymin, roi_xmin, roi_ymax, roi_xmax);
-        }();
-        // T roi_center_y = roi_to_pool[0];
-        // T roi_center_x = roi_to_pool[1];
-        T roi_h = roi_ymax - roi_ymin;
-        T roi_w = roi_xmax - roi_xmin;
-        float pool_bin_width = static_cast<float>(roi_w) / grid_dim_width;
-        float pool_bin_height = static_cast<float>(roi_h) / grid_dim_height;
-        int32_t num_elem_width = static_cast<int32_t>(pool_bin_width) + 1;
-        int32_t num_elem_height = static_cast<int32_t>(pool_bin_height) + 1;
-
-        // std::cout << "pool_bin_width: " << pool_bin_width << " pool_bin_height: " << pool_bin_height << " num_elem_width: " << num_elem_width << " num_elem_height: " << num_elem_height << std::endl;
-
-        // std::cout << "worker_index: " << worker_index << " roi_index: " << roi_index
-        // << " roi_ymin: " << roi_ymin << " roi_xmin: " << roi_xmin << " roi_ymax: " << roi_ymax << " roi_xmax: " << roi_xmax << " image_index: " << image_index << " position_index: " << (position_index % grid_size) << " channal_pos_remainder: " << channal_pos_remainder << std::endl;
-
-        float step_width_each_bin = pool_bin_width / num_elem_width;
-        float step_height_each_bin = pool_bin_height / num_elem_height;
-
-        float pool_width_start = roi_xmin + pool_bin_width * col_index;
-        float pool_height_start = roi_ymin + pool_bin_height * row_index;
-        int32_t max_pool_ind = 0;
-        T max_or_acc_elem = using_max_pool ? std::numeric_limits<T>::lowest() : static_cast<T>(0);
-        for (int32_t h_ind = 0; h_ind < num_elem_height; ++h_ind) {
-          for (int32_t w_ind = 0; w_ind < num_elem_width; ++w_ind) {
-            float col_to_pool = pool_width_start + step_width_each_bin * w_ind + step_width_each_bin / 2.;
-            float row_to_pool = pool_height_start + step_height_each_bin * h_ind + step_height_each_bin / 2.;
-            //std::cout << "col_to_pool: " << col_to_pool << " row_to_pool: " << row_to_pool << std::endl;
-            int32_t int_col_to_pool = static_cast<int32_t>(col_to_pool);
-            int32_t int_row_to_pool = static_cast<int32_t>(row_to_pool);
-            float float_col_to_pool = col_to_pool - int_col_to_pool;
-            float float_row_to_pool = row_to_pool - int_row_to_pool;
-
-            int32_t current_switch_ind = num_elem_width * h_ind + w_ind;
-            //std::cout << "current_switch_ind: " << current_switch_ind << std::endl;
-            T temp_value = static_cast<T>((1. - float_col_to_pool) * (1. - float_row_to_pool) * feature_map_to_pool[int_row_to_pool * map_width + int_col_to_pool] +
-                                      (1. - float_col_to_pool) * float_row_to_pool * feature_map_to_pool[std::min(int_row_to_pool + 1, map_height - 1) * map_width + int_col_to_pool] +
-                                      float_col_to_pool * (1. - float_row_to_pool) * feature_map_to_pool[int_row_to_pool * map_width + std::min(int_col_to_pool + 1, map_width - 1)] +
-                                      float_col_to_pool * float_row_to_pool * feature_map_to_pool[std::min(int_row_to_pool + 1, map_height - 1) * map_width + std::min(int_col_to_pool + 1, map_width - 1)]);
-            if(using_max_pool){
-              if(max_or_acc_elem < temp_value){
-                max_or_acc_elem = temp_value;
-                max_pool_ind = current_switch_ind;
+        const T * feature_map_to_pool = inputs_nhwc + static_cast<int64_t>(image_index) * map_height * map_width * num_channals;
+        for (int32_t position_index = 0; position_index < grid_size; ++position_index) {
+          const BilinearCoord * bin_rows = rows_to_pool.data() + (position_index / grid_dim_width) * num_elem_height;
+          const BilinearCoord * bin_cols = cols_to_pool.data() + (position_index % grid_dim_width) * num_elem_width;
+          const T * bank_to_pool = feature_map_to_pool + position_index * bank_size;
+          T * pooled_bank = pooled_features_start + position_index * bank_size;
+          int32_t * pooled_bank_index = pooled_index_start + position_index * bank_size;
+          std::fill(pooled_bank, pooled_bank + bank_size, using_max_pool ? std::numeric_limits<T>::lowest() : static_cast<T>(0));
+
+          for (int32_t h_ind = 0; h_ind < num_elem_height; ++h_ind) {
+            const BilinearCoord & row = bin_rows[h_ind];
+            for (int32_t w_ind = 0; w_ind < num_elem_width; ++w_ind) {
+              const BilinearCoord & col = bin_cols[w_ind];
+              const T * top_left = bank_to_pool + (row.low * map_width + col.low) * num_channals;
+              const T * bottom_left = bank_to_pool + (row.high * map_width + col.low) * num_channals;
+              const T * top_right = bank_to_pool + (row.low * map_width + col.high) * num_channals;
+              const T * bottom_right = bank_to_pool + (row.high * map_width + col.high) * num_channals;
+              const T top_left_weight = static_cast<T>((1. - col.frac) * (1. - row.frac));
+              const T bottom_left_weight = static_cast<T>((1. - col.frac) * row.frac);
+              const T top_right_weight = static_cast<T>(col.frac * (1. - row.frac));
+              const T bottom_right_weight = static_cast<T>(col.frac * row.frac);
+
+              if(using_max_pool){
+                const int32_t current_switch_ind = num_elem_width * h_ind + w_ind;
+                for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) {
+                  const T temp_value = top_left_weight * top_left[bank_index] + bottom_left_weight * bottom_left[bank_index] +
+                                        top_right_weight * top_right[bank_index] + bottom_right_weight * bottom_right[bank_index];
+                  if(pooled_bank[bank_index] < temp_value){
+                    pooled_bank[bank_index] = temp_value;
+                    pooled_bank_index[bank_index] = current_switch_ind;
+                  }
+                }
+              }else{
+                for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) {
+                  pooled_bank[bank_index] += top_left_weight * top_left[bank_index] + bottom_left_weight * bottom_left[bank_index] +
+                                              top_right_weight * top_right[bank_index] + bottom_right_weight * bottom_right[bank_index];
+                }
               }
-            }else{
-              max_or_acc_elem += temp_value;
             }
           }
+          if(!using_max_pool){
+            const T num_elem = static_cast<T>(num_elem_height * num_elem_width);
+            for (int32_t bank_index = 0; bank_index < bank_size; ++bank_index) pooled_bank[bank_index] /= num_elem;
+          }
         }
-
-        if(!using_max_pool) max_or_acc_elem /= static_cast<T>(num_elem_height * num_elem_width);
-
-        *pooled_features_start = max_or_acc_elem;
-        *pooled_index_start = using_max_pool ? max_pool_ind : static_cast<T>(0);
       }
     };
 
     const DeviceBase::CpuWorkerThreads& worker_threads = *(context->device()->tensorflow_cpu_worker_threads());
-    // one worker for one position in each ROI
-    const int64_t shard_cost = 4 * map_height * map_width / grid_dim_width / grid_dim_height / 4;
+    // one worker for one ROI, about 4 samples in each bin and 4 multiply-adds for each sample
+    const int64_t shard_cost = grid_size * bank_size * 4 * 8;
     Shard(worker_threads.num_threads, worker_threads.workers,
-          pooled_features.size(), shard_cost, pooling_routine);
+          batch_size * num_rois, shard_cost, pooling_routine);
   }
 };
 
@@ -232,6 +220,8 @@ class PSROIAlignOp : public OpKernel {
     const int num_rois = rois_in.dim_size(1);
 
     const int32_t grid_size = grid_dim_width_in * grid_dim_height_in;
+    // the functors only write grid_size * bank_size channels, the others would be left uninitialized
+    OP_REQUIRES(context, grid_size > 0 && num_channals % grid_size == 0, errors::InvalidArgument("the number of channals ", num_channals, " must be a multiple of grid_dim_width * grid_dim_height = ", grid_size));
 
     auto bank_size = static_cast<int>(num_channals / grid_size);
     Tensor* pooled_features = nullptr;
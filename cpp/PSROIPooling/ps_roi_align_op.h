@@ -26,6 +26,7 @@
 #include "tensorflow/core/framework/tensor_types.h"
 #include "tensorflow/core/framework/op_kernel.h"
 
+#include <algorithm>
 #include <cstdint>
 #include <tuple>
 #include <limits>
@@ -39,6 +40,61 @@ using GPUDevice = Eigen::GpuDevice;
 
 using KDimSize = std::tuple<int, int, int, int, int, bool>;
 
+// the sampling grid of one ROI, shared by the CPU kernels of PsRoiAlign and PsRoiAlignGrad
+struct PSROIAlignGrid {
+  float roi_ymin{0.};
+  float roi_xmin{0.};
+  float pool_bin_height{0.};
+  float pool_bin_width{0.};
+  float step_height_each_bin{0.};
+  float step_width_each_bin{0.};
+  int32_t num_elem_height{0};
+  int32_t num_elem_width{0};
+
+  // return false for the empty ROIs, which are not pooled
+  template <typename T>
+  bool init(const T * roi_to_pool, const int map_height, const int map_width, const int32_t grid_dim_width, const int32_t grid_dim_height) {
+    if(roi_to_pool[2] < std::numeric_limits<T>::min() || roi_to_pool[3] < std::numeric_limits<T>::min()) return false;
+    T roi_y_center = static_cast<T>(roi_to_pool[0] * map_height);
+    T roi_x_center = static_cast<T>(roi_to_pool[1] * map_width);
+    T roi_h = std::max(roi_to_pool[2] * map_height, static_cast<T>(1));
+    T roi_w = std::max(roi_to_pool[3] * map_width, static_cast<T>(1));
+
+    T ymin = std::max(roi_y_center - static_cast<T>(roi_h / 2.), static_cast<T>(0));
+    T xmin = std::max(roi_x_center - static_cast<T>(roi_w / 2.), static_cast<T>(0));
+    T ymax = std::min(roi_y_center + static_cast<T>(roi_h / 2.), static_cast<T>(map_height) - std::numeric_limits<T>::min());
+    T xmax = std::min(roi_x_center + static_cast<T>(roi_w / 2.), static_cast<T>(map_width) - std::numeric_limits<T>::min());
+
+    roi_ymin = ymin;
+    roi_xmin = xmin;
+    pool_bin_width = static_cast<float>(xmax - xmin) / grid_dim_width;
+    pool_bin_height = static_cast<float>(ymax - ymin) / grid_dim_height;
+    num_elem_width = static_cast<int32_t>(pool_bin_width) + 1;
+    num_elem_height = static_cast<int32_t>(pool_bin_height) + 1;
+    step_width_each_bin = pool_bin_width / num_elem_width;
+    step_height_each_bin = pool_bin_height / num_elem_height;
+    return true;
+  }
+};
+
+// one coordinate of a bilinear sample: the two neighbours on the map and the weight of the second one
+struct BilinearCoord {
+  int32_t low;
+  int32_t high;
+  float frac;
+};
+
+// fill the 'num_elem' sample coordinates of the bin starting at 'pool_start' along one side
+inline void make_bilinear_coords(const float pool_start, const float step_each_bin, const int32_t num_elem, const int32_t map_size, BilinearCoord * coords) {
+  for (int32_t ind = 0; ind < num_elem; ++ind) {
+    float to_pool = pool_start + step_each_bin * ind + step_each_bin / 2.;
+    int32_t int_to_pool = std::min(static_cast<int32_t>(to_pool), map_size - 1);
+    coords[ind].low = int_to_pool;
+    coords[ind].high = std::min(int_to_pool + 1, map_size - 1);
+    coords[ind].frac = to_pool - int_to_pool;
+  }
+}
+
 template <typename Device, typename T>
 struct PSROIAlignFunctor {
   void operator()(OpKernelContext* context, const Device& d, typename TTypes<T>::ConstFlat inputs, typename TTypes<T>::ConstFlat rois, const int32_t grid_dim_width, const int32_t grid_dim_height, typename TTypes<T>::Flat pooled_features, typename TTypes<int32_t>::Flat pooled_index, KDimSize dim_info);
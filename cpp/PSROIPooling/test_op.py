@@ -20,31 +20,21 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
-import shutil
-import uuid
+import sys
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.framework import ops
 from tensorflow.python.ops import array_ops
 import math
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../..'))
+from utility import op_library
+
 LIB_NAME = 'ps_roi_align'
 
-def load_op_module(lib_name):
-  """
-  Load TensorFlow operator library.
-  """
-  # use absolute path so that ops.py can be called from other directory
-  lib_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'build/lib{0}.so'.format(lib_name))
-  # duplicate library with a random new name so that
-  # a running program will not be interrupted when the original library is updated
-  lib_copy_path = '/tmp/lib{0}_{1}.so'.format(str(uuid.uuid4())[:8], LIB_NAME)
-  shutil.copyfile(lib_path, lib_copy_path)
-  oplib = tf.load_op_library(lib_copy_path)
-  #print(_)
-  return oplib
-
-op_module = load_op_module(LIB_NAME)
+# built into the op cache only when the sources change, so a running program is never
+# interrupted by a rebuild (each build gets a new file name)
+op_module = op_library.load_op_library(LIB_NAME)
 #print("----",op_module.OP_LIST)
 
 # map_to_pool = [[[[1., 2., 3., 4., 5.], [6., 7., 8., 9., 10.], [11., 12., 13., 14., 15.], [16., 17., 18., 19., 20.], [21., 22., 23., 24., 25.]], [[1., 2., 3., 4., 5.], [6., 7., 8., 9., 10.], [11., 12., 13., 14., 15.], [16., 17., 18., 19., 20.], [21., 22., 23., 24., 25.]], [[1., 2., 3., 4., 5.], [6., 7., 8., 9., 10.], [11., 12., 13., 14., 15.], [16., 17., 18., 19., 20.], [21., 22., 23., 24., 25.]], [[1., 2., 3., 4., 5.], [6., 7., 8., 9., 10.], [11., 12., 13., 14., 15.], [16., 17., 18., 19., 20.], [21., 22., 23., 24., 25.]]]]
@@ -177,6 +177,13 @@ def slim_get_split(split_name, dataset_dir, file_pattern, reader, image_preproce
     if split_name not in split_to_sizes:
         raise ValueError('split name %s was not recognized.' % split_name)
     file_pattern = os.path.join(dataset_dir, file_pattern % split_name)
+    # only read a subset of the record files, used to split the evaluation across several processes
+    num_shards = kwargs.get('num_shards', 1)
+    if num_shards > 1:
+        shard_index = kwargs.get('shard_index', 0)
+        file_pattern = sorted(tf.gfile.Glob(file_pattern))[shard_index::num_shards]
+        if not file_pattern:
+            raise ValueError('No record files left for shard %d of %d.' % (shard_index, num_shards))
 
     # Allowing None in the signature so that dataset_factory can use the default.
     if reader is None:
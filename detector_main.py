@@ -0,0 +1,614 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Train, evaluate or export any detector in detectors/registry.py.
+
+Examples:
+    python detector_main.py --model=xdet_v2_resnet --mode=train --data_dir=../PASCAL/VOC_TF/VOC0712TF/
+    python detector_main.py --model=light_head_rfcn --mode=eval --ps_roi_align_impl=tf
+    python detector_main.py --model=xdet_resnet --export_dir=./export
+
+The model supplies its body, head and loss, everything else (input pipeline, session
+config, optimizer, hooks, evaluation and export) lives here. Flags not given on the
+command line take the defaults of the model and mode (DEFAULTS and EVAL_DEFAULTS of the
+detector module). The <model>_train.py and <model>_eval.py scripts are shortcuts of this.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+from detectors import registry
+from detectors import losses
+
+train_helper = cli.lazy_import('utility.train_helper')
+eval_helper = cli.lazy_import('utility.eval_helper')
+export_helper = cli.lazy_import('utility.export_helper')
+metrics = cli.lazy_import('utility.metrics')
+vis_writer = cli.lazy_import('utility.vis_writer')
+checkpoint_evaluator = cli.lazy_import('utility.checkpoint_evaluator')
+stage_profiler = cli.lazy_import('utility.stage_profiler')
+async_checkpoint = cli.lazy_import('utility.async_checkpoint')
+
+dataset_factory = cli.lazy_import('dataset.dataset_factory')
+dataset_common = cli.lazy_import('dataset.dataset_common')
+preprocessing_factory = cli.lazy_import('preprocessing.preprocessing_factory')
+
+cli.flags.DEFINE_enum(
+    'model', 'xdet_resnet', registry.names(),
+    'The detector to train or evaluate.')
+cli.flags.DEFINE_enum(
+    'mode', 'train', ['train', 'eval'],
+    'Train the model, or evaluate a checkpoint of it.')
+# hardware related configuration
+cli.flags.DEFINE_integer(
+    'num_readers', 16,
+    'The number of parallel readers that read data from the dataset.')
+cli.flags.DEFINE_integer(
+    'num_preprocessing_threads', 48,
+    'The number of threads used to create the batches.')
+cli.flags.DEFINE_integer(
+    'num_cpu_threads', 0,
+    'The number of cpu cores used to train.')
+cli.flags.DEFINE_float(
+    'gpu_memory_fraction', 1., 'GPU memory fraction to use.')
+# scaffold related configuration
+cli.flags.DEFINE_string(
+    'data_dir', '../PASCAL/VOC_TF/VOC0712TF/',
+    'The directory where the dataset input data is stored.')
+cli.flags.DEFINE_string(
+    'dataset_name', 'pascalvoc_0712', 'The name of the dataset to load.')
+cli.flags.DEFINE_integer(
+    'num_classes', 21, 'Number of classes to use in the dataset.')
+cli.flags.DEFINE_string(
+    'dataset_split_name', 'train', 'The name of the train/test split.')
+cli.flags.DEFINE_string(
+    'model_dir', './logs/',
+    'The directory where the model will be stored.')
+cli.flags.DEFINE_string(
+    'debug_dir', './Debug/',
+    'The directory where the debug files will be stored.')
+cli.flags.DEFINE_integer(
+    'vis_every_n_images', 1,
+    'Draw detections of every n-th evaluated image into debug_dir, 0 to disable.')
+cli.flags.DEFINE_boolean(
+    'vis_only_failures', False,
+    'Only draw images with missed ground truth or confident false positives.')
+cli.flags.DEFINE_float(
+    'vis_score_threshold', 0.5,
+    'Unmatched detections above this score are counted as failures.')
+cli.flags.DEFINE_integer(
+    'vis_queue_size', 64,
+    'Max number of images waiting to be drawn, new ones are dropped when full.')
+cli.flags.DEFINE_integer(
+    'vis_num_threads', 2,
+    'The number of background threads used to draw and write images.')
+cli.flags.DEFINE_integer(
+    'log_every_n_steps', 10,
+    'The frequency with which logs are print.')
+cli.flags.DEFINE_integer(
+    'save_summary_steps', 500,
+    'The frequency with which summaries are saved, in seconds.')
+cli.flags.DEFINE_integer(
+    'save_checkpoints_secs', 7200,
+    'The frequency with which the model is saved, in seconds.')
+cli.flags.DEFINE_integer(
+    'stage_stats_every_n_steps', 0,
+    'Trace every n-th step to collect the latency of each inference stage, 0 to disable.')
+cli.flags.DEFINE_integer(
+    'trace_every_n_steps', 0,
+    'Also save a Chrome trace of every n-th step, 0 to disable.')
+cli.flags.DEFINE_string(
+    'stage_stats_dir', None,
+    'The directory where stage latency json, summaries and traces are saved, default to "model_dir/stage_latency".')
+# model related configuration
+cli.flags.DEFINE_integer(
+    'train_image_size', 320,
+    'The size of the input image for the model to use.')
+cli.flags.DEFINE_integer(
+    'resnet_size', 50,
+    'The size of the ResNet model to use.')
+cli.flags.DEFINE_integer(
+    'train_epochs', None,
+    'The number of epochs to use for training.')
+cli.flags.DEFINE_integer(
+    'batch_size', 16,
+    'Batch size for training and evaluation, images are zero padded to the largest one in each batch when evaluating.')
+cli.flags.DEFINE_string(
+    'data_format', 'channels_first', # 'channels_first' or 'channels_last'
+    'A flag to override the data format used in the model. channels_first '
+    'provides a performance boost on GPU but is not always compatible '
+    'with CPU. If left unspecified, the data format will be chosen '
+    'automatically based on whether TensorFlow was built for CPU or GPU.')
+cli.flags.DEFINE_string(
+    'recompute_blocks', '',
+    'Comma separated block layers of the backbone whose activations are recomputed during backprop instead of kept, '
+    'e.g. "block_layer3, block_layer4" for the X-Det ResNets or "block5, block6" for Xception. Saves memory at the cost of step time, see recompute_benchmark.py.')
+cli.flags.DEFINE_float(
+    'match_threshold', 0.6, 'Matching threshold in the loss function.')
+cli.flags.DEFINE_float(
+    'select_threshold', 0.01, 'Class-specific confidence score threshold for selecting a box.')
+cli.flags.DEFINE_float(
+    'nms_threshold', 0.4, 'Matching threshold in NMS algorithm.')
+cli.flags.DEFINE_integer(
+    'nms_topk_percls', 200, 'Number of object for each class to keep after NMS.')
+cli.flags.DEFINE_integer(
+    'nms_topk', 200, 'Number of total object to keep after NMS.')
+# optimizer related configuration
+cli.flags.DEFINE_float(
+    'weight_decay', 0.0005, 'The weight decay on the model weights.')
+cli.flags.DEFINE_float(
+    'momentum', 0.9,
+    'The momentum for the MomentumOptimizer and RMSPropOptimizer.')
+cli.flags.DEFINE_float('learning_rate', 0.001, 'Initial learning rate.')
+cli.flags.DEFINE_float(
+    'end_learning_rate', 0.0001,
+    'The minimal end learning rate used by a polynomial decay learning rate.')
+cli.flags.DEFINE_integer(
+    'accumulate_steps', 1,
+    'Sum the gradients of this many batches before each update, the effective batch size is batch_size times this. '
+    'global_step and so decay_boundaries count updates, not batches.')
+# for learning rate exponential_decay
+cli.flags.DEFINE_float(
+    'learning_rate_decay_factor', 0.96, 'Learning rate decay factor.')
+cli.flags.DEFINE_float(
+    'decay_steps', 1000,
+    'Number of epochs after which learning rate decays.')
+# for learning rate piecewise_constant decay
+cli.flags.DEFINE_string(
+    'decay_boundaries', '70000, 90000',
+    'Learning rate decay boundaries by global_step (comma-separated list).')
+cli.flags.DEFINE_string(
+    'lr_decay_factors', '1, 0.8, 0.1',
+    'The values of learning_rate decay factor for each segment between boundaries (comma-separated list).')
+# checkpoint related configuration
+cli.flags.DEFINE_string(
+    'checkpoint_path', './model/resnet50',#None,
+    'The path to a checkpoint from which to fine-tune.')
+cli.flags.DEFINE_string(
+    'checkpoint_model_scope', '',
+    'Model scope in the checkpoint. None if the same as the trained model.')
+cli.flags.DEFINE_string(
+    'model_scope', 'xdet_resnet',
+    'Model scope name used to replace the name_scope in checkpoint.')
+cli.flags.DEFINE_string(
+    'checkpoint_exclude_scopes', None,
+    'Comma-separated list of scopes of variables to exclude when restoring from a checkpoint.')
+cli.flags.DEFINE_boolean(
+    'ignore_missing_vars', True,
+    'When restoring a checkpoint would ignore missing variables.')
+cli.flags.DEFINE_boolean(
+    'run_on_cloud', True,
+    'Wether we will train on cloud (pre-trained model will be placed in the "data_dir/cloud_checkpoint_path").')
+cli.flags.DEFINE_string(
+    'cloud_checkpoint_path', 'resnet50/model.ckpt',
+    'The path to a checkpoint from which to fine-tune.')
+# distributed training, the cluster is read from TF_CONFIG (see dist_train.py)
+cli.flags.DEFINE_boolean(
+    'sync_replicas', True,
+    'Average the gradients of all workers before each update, otherwise every worker updates the parameter servers asynchronously.')
+cli.flags.DEFINE_integer(
+    'replicas_to_aggregate', 0,
+    'The number of gradients averaged in each synchronous update, 0 for the number of workers.')
+cli.flags.DEFINE_integer(
+    'max_train_steps', None,
+    'Stop training at this global step.')
+cli.flags.DEFINE_string(
+    'throughput_file', None,
+    'Write the images per second of this process into this json file while training.')
+cli.flags.DEFINE_integer(
+    'step_time_every_n_steps', 100,
+    'Log the input wait, compute and host overhead of the train steps and the input queue fill levels every n steps, 0 to disable.')
+cli.flags.DEFINE_integer(
+    'step_time_trace_every_n_steps', 10,
+    'Trace every n-th train step to measure the input wait, 0 to disable the tracing.')
+cli.flags.DEFINE_float(
+    'input_wait_warning', 0.2,
+    'Warn when the input wait is more than this fraction of the train step.')
+cli.flags.DEFINE_boolean(
+    'async_checkpoint', False,
+    'Copy the variables into host memory every save_checkpoints_secs and write the checkpoint on a background thread, '
+    'instead of pausing training for the whole write.')
+cli.flags.DEFINE_integer(
+    'profile_every_n_steps', 0,
+    'Fully trace every n-th train step and write its Chrome trace, per-op time and memory table, peak memory and largest tensors, 0 to disable.')
+cli.flags.DEFINE_string(
+    'profile_dir', None,
+    'The directory of the profiles, default to "model_dir/profile".')
+cli.flags.DEFINE_string(
+    'export_dir', None,
+    'Export the inference graph of the latest checkpoint in model_dir as a SavedModel into this directory instead of training.')
+# evaluation related configuration
+cli.flags.DEFINE_string(
+    'checkpoint_to_evaluate', None,
+    'Evaluate this checkpoint instead of looking for the latest one.')
+cli.flags.DEFINE_integer(
+    'num_shards', 1,
+    'Split the test record files into this many shards.')
+cli.flags.DEFINE_integer(
+    'shard_index', 0,
+    'The index of the shard to evaluate.')
+cli.flags.DEFINE_string(
+    'eval_result_file', None,
+    'Save the raw tp/fp arrays of each class into this .npz file, used to merge the results of all shards.')
+
+# the flags only used by some of the models
+_defined = set()
+for _name in registry.names():
+    _define_flags = getattr(registry.get_detector(_name), 'define_flags', None)
+    if _define_flags is not None and _define_flags not in _defined:
+        _define_flags(cli.flags)
+        _defined.add(_define_flags)
+
+FLAGS = cli.flags.FLAGS
+
+# the defaults of all models when evaluating
+_EVAL_DEFAULTS = {
+    'data_dir': '../PASCAL/VOC_TF/VOC2007TEST_TF/',
+    'dataset_name': 'pascalvoc_2007',
+    'dataset_split_name': 'test',
+    'save_summary_steps': 10,
+}
+
+def set_defaults(model, mode):
+    '''Use the defaults of the model (and mode) for the flags not given on the command line.'''
+    detector = registry.get_detector(model)
+    defaults = dict(getattr(detector, 'DEFAULTS', {}))
+    if mode == 'eval':
+        defaults.update(_EVAL_DEFAULTS)
+        defaults.update(getattr(detector, 'EVAL_DEFAULTS', {}))
+    for name, value in defaults.items():
+        FLAGS.set_default(name, value)
+
+def parse_comma_list(args):
+    return [float(s.strip()) for s in args.split(',')]
+
+def get_params():
+    params = FLAGS.flag_values_dict()
+    params['decay_boundaries'] = parse_comma_list(FLAGS.decay_boundaries)
+    params['lr_decay_factors'] = parse_comma_list(FLAGS.lr_decay_factors)
+    params['recompute_blocks'] = [s.strip() for s in FLAGS.recompute_blocks.split(',') if s.strip()]
+    return params
+
+def input_pipeline(detector, params, mode, num_workers = 1, worker_index = 0):
+    is_training = (mode == tf.estimator.ModeKeys.TRAIN)
+    image_preprocessing_fn = lambda image_, shape_, glabels_, gbboxes_ : preprocessing_factory.get_preprocessing(
+        detector.PREPROCESSING_NAME, is_training=is_training)(image_, glabels_, gbboxes_, out_shape=[params['train_image_size']] * 2, data_format=('NCHW' if params['data_format']=='channels_first' else 'NHWC'))
+
+    def input_fn():
+        anchor_encoder_decoder, num_anchors_list = detector.get_anchor_encoder_decoder(params)
+
+        if is_training:
+            dataset_kwargs = {'num_readers': params['num_readers'],
+                            'num_preprocessing_threads': params['num_preprocessing_threads'],
+                            'num_epochs': params['train_epochs'],
+                            # each worker reads its own subset of the record files
+                            'num_shards': num_workers,
+                            'shard_index': worker_index}
+        else:
+            dataset_kwargs = {'num_readers': params['num_readers'] if params['run_on_cloud'] else 2,
+                            'num_preprocessing_threads': params['num_preprocessing_threads'] if params['run_on_cloud'] else 2,
+                            'num_epochs': 1,
+                            'method': 'eval',
+                            'num_shards': params['num_shards'],
+                            'shard_index': params['shard_index']}
+
+        list_from_batch, _ = dataset_factory.get_dataset(params['dataset_name'],
+                                                params['dataset_split_name'],
+                                                params['data_dir'],
+                                                image_preprocessing_fn,
+                                                file_pattern = None,
+                                                reader = None,
+                                                batch_size = params['batch_size'],
+                                                anchor_encoder = anchor_encoder_decoder.encode_all_anchors,
+                                                **dataset_kwargs)
+
+        targets = list_from_batch[:-1]
+        labels = {'targets': targets, 'num_anchors_list': num_anchors_list}
+        labels.update(detector.label_fns(anchor_encoder_decoder, targets, params, mode))
+        return list_from_batch[-1], labels
+    return input_fn
+
+def gain_translate_table():
+    label2name_table = {}
+    for class_name, labels_pair in dataset_common.VOC_LABELS.items():
+        label2name_table[labels_pair[0]] = class_name
+    return label2name_table
+
+# created in main(), drawing and writing happen on its own threads
+image_writer = None
+
+def save_image_with_bbox(images, shapes, labels_, scores_, bboxes_, failures_):
+    return image_writer.submit(images, shapes, labels_, scores_, bboxes_, failures_)
+
+def post_process(cls_pred_logits, bboxes_pred, bbox_img, image_shape, params):
+    '''Select and nms the detections of each image, return dicts class -> scores and bboxes, on CPU.'''
+    # Performing post-processing on CPU: loop-intensive, usually more efficient.
+    batch_size = tf.shape(cls_pred_logits)[0]
+    cls_pred_prob = tf.nn.softmax(tf.reshape(cls_pred_logits, [batch_size, -1, params['num_classes']]))
+    bboxes_pred = tf.reshape(bboxes_pred, [batch_size, -1, 4])
+    with tf.device('/device:CPU:0'):
+        return eval_helper.bboxes_post_process_batch(cls_pred_prob, bboxes_pred, bbox_img, image_shape, params['num_classes'],
+                                                    params['select_threshold'], params['nms_threshold'], params['nms_topk'],
+                                                    0.03, [params['train_image_size']] * 2, scope='{}_select'.format(params['model']))
+
+#[batch, feature_h, feature_w, num_anchors, 4]
+def bboxes_eval(org_image, image_shape, bbox_img, cls_pred_logits, bboxes_pred, glabels_raw, gbboxes_raw, isdifficult, params):
+    # all inputs keep the batch dimension, ground truth is zero padded by the input pipeline
+    batch_size = tf.shape(cls_pred_logits)[0]
+    glabels_raw = tf.reshape(glabels_raw, [batch_size, -1])
+    gbboxes_raw = tf.reshape(gbboxes_raw, [batch_size, -1, 4])
+    isdifficult = tf.reshape(isdifficult, [batch_size, -1])
+
+    with stage_profiler.stage('select'):
+        selected_scores, selected_bboxes = post_process(cls_pred_logits, bboxes_pred, bbox_img, image_shape, params)
+
+    with tf.device('/device:CPU:0'):
+        dict_metrics = {}
+        # Compute TP and FP statistics.
+        with stage_profiler.stage('matching'):
+            num_gbboxes, tp, fp = eval_helper.bboxes_matching_batch(selected_scores.keys(), selected_scores, selected_bboxes, glabels_raw, gbboxes_raw, isdifficult)
+            # missed ground truth and confident false positives of each image, used to pick images to draw
+            num_failures = tf.add_n([num_gbboxes[c] - tf.count_nonzero(tp[c], axis=-1) +
+                                    tf.count_nonzero(tf.logical_and(fp[c], selected_scores[c] > params['vis_score_threshold']), axis=-1) for c in num_gbboxes.keys()])
+
+        # FP and TP metrics.
+        tp_fp_metric = metrics.streaming_tp_fp_arrays(num_gbboxes, tp, fp, selected_scores)
+        metrics_name = ('nobjects', 'ndetections', 'tp', 'fp', 'scores')
+        label2name_table = gain_translate_table()
+        for c in tp_fp_metric[0].keys():
+            for _ in range(len(tp_fp_metric[0][c])):
+                dict_metrics['tp_fp_%s_%s' % (label2name_table[c], metrics_name[_])] = (tp_fp_metric[0][c][_],
+                                                tp_fp_metric[1][c][_])
+
+        # Add to summaries precision/recall values.
+        aps_voc07 = {}
+        aps_voc12 = {}
+        for c in tp_fp_metric[0].keys():
+            # Precison and recall values.
+            prec, rec = metrics.precision_recall(*tp_fp_metric[0][c])
+
+            # Average precision VOC07.
+            v = metrics.average_precision_voc07(prec, rec)
+            tf.summary.scalar('AP_VOC07/%s' % c, v)
+            aps_voc07[c] = v
+
+            # Average precision VOC12.
+            v = metrics.average_precision_voc12(prec, rec)
+            tf.summary.scalar('AP_VOC12/%s' % c, v)
+            aps_voc12[c] = v
+
+        # Mean average precision VOC07.
+        summary_name = 'AP_VOC07/mAP'
+        mAP = tf.add_n(list(aps_voc07.values())) / len(aps_voc07)
+        mAP = tf.Print(mAP, [mAP], summary_name)
+        tf.summary.scalar(summary_name, mAP)
+
+        # Mean average precision VOC12.
+        summary_name = 'AP_VOC12/mAP'
+        mAP = tf.add_n(list(aps_voc12.values())) / len(aps_voc12)
+        mAP = tf.Print(mAP, [mAP], summary_name)
+        tf.summary.scalar(summary_name, mAP)
+
+        with stage_profiler.stage('visualization'):
+            labels_list = []
+            for k, v in selected_scores.items():
+                labels_list.append(tf.ones_like(v, tf.int32) * k)
+            save_image_op = tf.py_func(save_image_with_bbox,
+                                        [org_image,
+                                        image_shape,
+                                        tf.concat(labels_list, axis=1),
+                                        tf.concat(list(selected_scores.values()), axis=1),
+                                        tf.concat(list(selected_bboxes.values()), axis=1),
+                                        num_failures],
+                                        tf.int64, stateful=True)
+
+    return dict_metrics, save_image_op
+
+def get_train_op(loss, params, config):
+    '''Return the train op and the hooks it needs.'''
+    global_step = tf.train.get_or_create_global_step()
+
+    lr_values = [params['learning_rate'] * decay for decay in params['lr_decay_factors']]
+    learning_rate = tf.train.piecewise_constant(tf.cast(global_step, tf.int32),
+                                                [int(_) for _ in params['decay_boundaries']],
+                                                lr_values)
+    truncated_learning_rate = tf.maximum(learning_rate, tf.constant(params['end_learning_rate'], dtype=learning_rate.dtype))
+    # Create a tensor named learning_rate for logging purposes.
+    tf.identity(truncated_learning_rate, name='learning_rate')
+    tf.summary.scalar('learning_rate', truncated_learning_rate)
+
+    optimizer = tf.train.MomentumOptimizer(learning_rate=truncated_learning_rate,
+                                            momentum=params['momentum'])
+
+    hooks = []
+    if config.num_worker_replicas > 1 and params['sync_replicas']:
+        # the chief applies the averaged gradients once replicas_to_aggregate workers sent theirs
+        optimizer = tf.train.SyncReplicasOptimizer(optimizer,
+                                                replicas_to_aggregate=(params['replicas_to_aggregate'] or config.num_worker_replicas),
+                                                total_num_replicas=config.num_worker_replicas)
+        hooks.append(optimizer.make_session_run_hook(config.is_chief))
+
+    # Batch norm requires update_ops to be added as a train_op dependency.
+    # The moving averages are still updated by every batch when accumulating gradients.
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+    with tf.control_dependencies(update_ops):
+        if params['accumulate_steps'] > 1:
+            if config.num_worker_replicas > 1:
+                raise ValueError('--accumulate_steps is not supported by distributed training, use --replicas_to_aggregate to average more gradients in each update.')
+            return train_helper.accumulate_gradients(optimizer, loss, global_step, params['accumulate_steps']), hooks
+        return optimizer.minimize(loss, global_step), hooks
+
+def detector_model_fn(features, labels, mode, params, config):
+    """The model_fn of all detectors, the detector module builds the body, head and loss."""
+    detector = registry.get_detector(params['model'])
+
+    if mode == tf.estimator.ModeKeys.PREDICT:
+        # features are the dict built by export_helper.jpeg_serving_input_receiver_fn
+        anchor_encoder_decoder, num_anchors_list = detector.get_anchor_encoder_decoder(params)
+        labels = {'num_anchors_list': num_anchors_list}
+        labels.update(detector.label_fns(anchor_encoder_decoder, None, params, mode))
+        images = features['image']
+    else:
+        images = features
+
+    with tf.variable_scope(params['model_scope'], default_name = None, values = [images], reuse=tf.AUTO_REUSE):
+        with stage_profiler.stage('backbone'):
+            body_outputs = detector.body(images, params, (mode == tf.estimator.ModeKeys.TRAIN))
+
+        with stage_profiler.stage('head'):
+            outputs = detector.head(body_outputs, labels, params, mode)
+
+        if mode != tf.estimator.ModeKeys.TRAIN:
+            with stage_profiler.stage('decode'):
+                cls_pred, bboxes_pred = detector.detections(outputs, labels, params)
+
+    if mode == tf.estimator.ModeKeys.PREDICT:
+        selected_scores, selected_bboxes = post_process(cls_pred, bboxes_pred, features['bbox_img'], features['image_shape'], params)
+        with tf.device('/device:CPU:0'):
+            predictions = export_helper.flatten_detections(selected_scores, selected_bboxes, params['nms_topk'])
+
+        return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions,
+                                        export_outputs={'detections': tf.estimator.export.PredictOutput(predictions)})
+
+    save_image_op = None
+    if mode == tf.estimator.ModeKeys.EVAL:
+        targets = labels['targets']
+        eval_ops, save_image_op = bboxes_eval(targets[-2], targets[-1], targets[-4], cls_pred, bboxes_pred,
+                                                targets[-6], targets[-5], targets[-3], params)
+        tf.identity(save_image_op, name='save_image_with_bboxes_op')
+
+    model_loss = detector.loss(outputs, labels, params, mode)
+
+    with tf.control_dependencies([save_image_op] if save_image_op is not None else []):
+        loss = losses.weight_decay_loss(params['weight_decay'])
+        if model_loss is not None:
+            loss = model_loss + loss
+        loss = tf.identity(loss, name='total_loss')
+
+    if mode == tf.estimator.ModeKeys.EVAL:
+        summary_hook = tf.train.SummarySaverHook(
+                            save_secs=params['save_summary_steps'],
+                            output_dir=params['model_dir'],
+                            summary_op=tf.summary.merge_all())
+
+        return tf.estimator.EstimatorSpec(mode=mode, loss=loss, eval_metric_ops=eval_ops,
+                                        evaluation_hooks=[summary_hook])
+
+    train_op, train_hooks = get_train_op(loss, params, config)
+    return tf.estimator.EstimatorSpec(
+          mode=mode,
+          loss=loss,
+          train_op=train_op,
+          training_hooks=train_hooks,
+          scaffold = tf.train.Scaffold(init_fn=train_helper.get_init_fn_for_scaffold(FLAGS)))
+
+def main(_):
+    set_defaults(FLAGS.model, FLAGS.mode)
+    detector = registry.get_detector(FLAGS.model)
+    params = get_params()
+    if hasattr(detector, 'setup'):
+        detector.setup(params)
+
+    # Using the Winograd non-fused algorithms provides a small performance boost.
+    os.environ['TF_ENABLE_WINOGRAD_NONFUSED'] = '1'
+
+    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction = FLAGS.gpu_memory_fraction)
+    config = tf.ConfigProto(allow_soft_placement = True, log_device_placement = False, intra_op_parallelism_threads = FLAGS.num_cpu_threads, inter_op_parallelism_threads = FLAGS.num_cpu_threads, gpu_options = gpu_options)
+
+    # Set up a RunConfig to only save checkpoints once per training cycle.
+    # the checkpoints are saved by AsyncCheckpointSaverHook instead of the Estimator with --async_checkpoint
+    run_config = tf.estimator.RunConfig().replace(
+                                        save_checkpoints_secs=(FLAGS.save_checkpoints_secs if FLAGS.mode == 'train' and not FLAGS.async_checkpoint else None)).replace(
+                                        save_checkpoints_steps=None).replace(
+                                        save_summary_steps=FLAGS.save_summary_steps).replace(
+                                        keep_checkpoint_max=5).replace(
+                                        log_step_count_steps=FLAGS.log_every_n_steps).replace(
+                                        session_config=config)
+
+    # a parameter server only serves the variables until it is killed
+    if run_config.task_type == 'ps':
+        train_helper.start_std_server(run_config, config).join()
+        return
+
+    xdetector = tf.estimator.Estimator(
+        model_fn=detector_model_fn, model_dir=FLAGS.model_dir, config=run_config,
+        params=params)
+
+    if FLAGS.export_dir:
+        print('Exporting the inference graph.')
+        xdetector.export_savedmodel(FLAGS.export_dir, export_helper.jpeg_serving_input_receiver_fn(detector.PREPROCESSING_NAME, FLAGS.train_image_size, FLAGS.data_format))
+        return
+
+    mode = tf.estimator.ModeKeys.TRAIN if FLAGS.mode == 'train' else tf.estimator.ModeKeys.EVAL
+    tensors_to_log = detector.tensors_to_log(params, mode)
+
+    if mode == tf.estimator.ModeKeys.TRAIN:
+        logging_hook = tf.train.LoggingTensorHook(tensors=tensors_to_log, every_n_iter=FLAGS.log_every_n_steps)
+        train_hooks = [logging_hook, train_helper.StartupTimerHook()]
+        if FLAGS.throughput_file:
+            train_hooks.append(train_helper.ThroughputHook(FLAGS.batch_size, FLAGS.throughput_file))
+        if FLAGS.step_time_every_n_steps > 0:
+            train_hooks.append(train_helper.StepTimeHook(FLAGS.step_time_every_n_steps,
+                                                            trace_every_n_steps = FLAGS.step_time_trace_every_n_steps,
+                                                            warning_fraction = FLAGS.input_wait_warning))
+        if FLAGS.profile_every_n_steps > 0:
+            train_hooks.append(stage_profiler.ProfileHook(FLAGS.profile_dir or os.path.join(FLAGS.model_dir, 'profile'), FLAGS.profile_every_n_steps))
+
+        if FLAGS.async_checkpoint and run_config.is_chief:
+            train_hooks.append(async_checkpoint.AsyncCheckpointSaverHook(FLAGS.model_dir, FLAGS.save_checkpoints_secs, run_config.keep_checkpoint_max))
+
+        num_workers, worker_index = 1, 0
+        if run_config.cluster_spec:
+            # the Estimator connects to the server of this task, it is only started by train_and_evaluate
+            train_helper.start_std_server(run_config, config)
+            num_workers, worker_index = train_helper.get_worker_shard(run_config)
+
+        print('Starting a training cycle.')
+        xdetector.train(input_fn=input_pipeline(detector, params, mode, num_workers, worker_index), hooks=train_hooks, max_steps=FLAGS.max_train_steps)
+        return
+
+    tensors_to_log['saved_image_index'] = 'save_image_with_bboxes_op'
+    logging_hook = tf.train.LoggingTensorHook(tensors=tensors_to_log, every_n_iter=FLAGS.log_every_n_steps)
+
+    global image_writer
+    image_writer = vis_writer.AsyncImageWriter(FLAGS.debug_dir, every_n = 0 if FLAGS.run_on_cloud else FLAGS.vis_every_n_images,
+                                                only_failures = FLAGS.vis_only_failures, max_queue_size = FLAGS.vis_queue_size,
+                                                num_threads = FLAGS.vis_num_threads)
+
+    eval_hooks = [logging_hook, vis_writer.AsyncImageWriterHook(image_writer)]
+    if FLAGS.stage_stats_every_n_steps > 0 or FLAGS.trace_every_n_steps > 0:
+        eval_hooks.append(stage_profiler.StageLatencyHook(FLAGS.stage_stats_dir or os.path.join(FLAGS.model_dir, 'stage_latency'),
+                                                        every_n_steps = FLAGS.stage_stats_every_n_steps,
+                                                        trace_every_n_steps = FLAGS.trace_every_n_steps))
+
+    print('Starting evaluate cycle.')
+    eval_results = xdetector.evaluate(input_fn=input_pipeline(detector, params, mode), hooks=eval_hooks, checkpoint_path=train_helper.get_latest_checkpoint_for_evaluate(FLAGS))
+    if FLAGS.eval_result_file:
+        checkpoint_evaluator.save_tp_fp_results(FLAGS.eval_result_file, eval_results)
+
+def run(model, mode):
+    '''Entry of the per-model scripts, --help shows the defaults of this model.'''
+    FLAGS.set_default('model', model)
+    FLAGS.set_default('mode', mode)
+    set_defaults(model, mode)
+    cli.run(main)
+
+if __name__ == '__main__':
+  cli.run(main)
@@ -0,0 +1,319 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Light-Head R-CNN with the Xception body and PsRoiAlign, see detectors/registry.py for the interface.
+
+With OHEM the head ranks the rois by their loss, so the head loss is built inside head() in
+training and loss() adds the RPN loss to it.
+'''
+import os
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+from net import backbones
+from detectors import losses
+
+ops = cli.lazy_import('tensorflow.python.framework.ops')
+
+xception_body = backbones.lazy_backbone('xception_lighthead')
+tf_ps_roi_align = cli.lazy_import('net.tf_ps_roi_align')
+op_library = cli.lazy_import('utility.op_library')
+stage_profiler = cli.lazy_import('utility.stage_profiler')
+anchor_manipulator = cli.lazy_import('preprocessing.anchor_manipulator')
+
+PREPROCESSING_NAME = 'xception_lighthead'
+
+DEFAULTS = {
+    'model_dir': './logs_light/',
+    'train_image_size': 480,
+    'batch_size': 8,
+    'nms_threshold': 0.3,
+    'match_threshold': 0.55,
+    'weight_decay': 0.00002,
+    'decay_boundaries': '60000, 80000',
+    'checkpoint_path': './model/xception',
+    'model_scope': 'xception_lighthead',
+    'checkpoint_exclude_scopes': 'xception_lighthead/rpn_head, xception_lighthead/large_sep_feature, xception_lighthead/final_head',
+    'cloud_checkpoint_path': 'xception_model/xception_model.ckpt',
+}
+EVAL_DEFAULTS = {
+    'debug_dir': './Debug_light/',
+    'save_summary_steps': 100,
+    'rpn_pre_nms_top_n': 4000,
+    'rpn_post_nms_top_n': 300,
+}
+
+def define_flags(flags):
+    flags.DEFINE_boolean(
+        'using_ohem', True, 'Wether to use OHEM.')
+    flags.DEFINE_integer(
+        'ohem_roi_one_image', 32,
+        'Batch size of RoIs for training in the second stage after OHEM.')
+    flags.DEFINE_integer(
+        'roi_one_image', 64,
+        'Batch size of RoIs for training in the second stage.')
+    flags.DEFINE_float(
+        'fg_ratio', 0.25, 'fore-ground ratio in the total proposals.')
+    flags.DEFINE_float(
+        'neg_threshold_high', 0.5, 'Matching threshold for the negtive examples in the loss function for proposals.')
+    flags.DEFINE_float(
+        'neg_threshold_low', 0., 'Matching threshold for the negtive examples in the loss function for proposals.')
+    flags.DEFINE_integer(
+        'rpn_anchors_per_image', 256, 'total rpn anchors to calculate loss and backprop.')
+    flags.DEFINE_integer(
+        'rpn_pre_nms_top_n', 9000, 'selected numbers of proposals to nms.')
+    flags.DEFINE_integer(
+        'rpn_post_nms_top_n', 1600, 'keep numbers of proposals after nms.')
+    flags.DEFINE_float(
+        'rpn_min_size', 16*1./480, 'minsize threshold of proposals to be filtered for rpn.')
+    flags.DEFINE_float(
+        'rpn_nms_thres', 0.7, 'nms threshold for rpn.')
+    flags.DEFINE_float(
+        'rpn_fg_ratio', 0.5, 'fore-ground ratio in the total samples for rpn.')
+    flags.DEFINE_float(
+        'rpn_match_threshold', 0.7, 'Matching threshold in the loss function for rpn.')
+    flags.DEFINE_float(
+        'rpn_neg_threshold', 0.3, 'Matching threshold for the negtive examples in the loss function for rpn.')
+    flags.DEFINE_string(
+        'ps_roi_align_impl', 'custom',
+        'Which PsRoiAlign to use: "custom" loads libps_roi_align.so (built once into the op cache, see utility/op_library.py), "tf" uses the pure TensorFlow '
+        'version in net/tf_ps_roi_align.py which needs no compiled op (slower). The serving side of an exported "custom" model must load libps_roi_align.so.')
+
+LIB_NAME = 'ps_roi_align'
+
+op_module = None
+ps_roi_align = None
+
+pool_method = 'max'
+
+def _ps_roi_align_grad(op, grad, _):
+  '''The gradients for `PsRoiAlign`.
+  '''
+  inputs_features = op.inputs[0]
+  rois = op.inputs[1]
+  pooled_features_grad = op.outputs[0]
+  pooled_index = op.outputs[1]
+  grid_dim_width = op.get_attr('grid_dim_width')
+  grid_dim_height = op.get_attr('grid_dim_height')
+
+  #return [tf.ones_like(inputs_features), None]
+  return [op_module.ps_roi_align_grad(inputs_features, rois, grad, pooled_index, grid_dim_width, grid_dim_height, pool_method), None]
+
+def setup(params):
+    '''Pick the PsRoiAlign implementation, the custom op is built only when its sources
+    change (shared through data_dir when run on cloud) and loaded on first use.
+    '''
+    global op_module, ps_roi_align
+    if params['ps_roi_align_impl'] == 'custom':
+        if params['run_on_cloud']:
+            # when run on cloud we have no access to /tmp directory, so we change TMPDIR first
+            os.environ["TMPDIR"] = os.getcwd()
+        op_module = op_library.LazyOpLibrary(LIB_NAME, remote_dir = params['data_dir'] if params['run_on_cloud'] else None)
+        ps_roi_align = lambda inputs, rois, grid_dim_width, grid_dim_height, pool_method : op_module.ps_roi_align(inputs, rois, grid_dim_width, grid_dim_height, pool_method)
+        ops.RegisterGradient("PsRoiAlign")(_ps_roi_align_grad)
+    elif params['ps_roi_align_impl'] == 'tf':
+        ps_roi_align = tf_ps_roi_align.ps_roi_align
+    else:
+        raise ValueError('Unknown --ps_roi_align_impl: {}'.format(params['ps_roi_align_impl']))
+
+def get_anchor_encoder_decoder(params):
+    anchor_creator = anchor_manipulator.AnchorCreator([params['train_image_size']] * 2,
+                                                    layers_shapes = [(30, 30)],
+                                                    anchor_scales = [[0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]],
+                                                    extra_anchor_scales = [[0.1]],
+                                                    anchor_ratios = [[1., 2., .5]],
+                                                    layer_steps = [16])
+    all_anchors, num_anchors_list = anchor_creator.get_all_anchors()
+
+    return anchor_manipulator.AnchorEncoder(all_anchors,
+                                            num_classes = params['num_classes'],
+                                            allowed_borders = [0.],
+                                            positive_threshold = params['rpn_match_threshold'],
+                                            ignore_threshold = params['rpn_neg_threshold'],
+                                            prior_scaling=[1., 1., 1., 1.],#[0.1, 0.1, 0.2, 0.2],
+                                            rpn_fg_thres = params['match_threshold'],
+                                            rpn_bg_high_thres = params['neg_threshold_high'],
+                                            rpn_bg_low_thres = params['neg_threshold_low']), num_anchors_list
+
+def label_fns(anchor_encoder_decoder, targets, params, mode):
+    fns = {'rpn_decode_fn': lambda pred : anchor_encoder_decoder.decode_all_anchors([pred], squeeze_inner=True)[0],
+            'head_decode_fn': lambda rois, pred : anchor_encoder_decoder.ext_decode_rois(rois, pred, head_prior_scaling=[1., 1., 1., 1.])}
+    if mode == tf.estimator.ModeKeys.TRAIN:
+        # the padded ground truth labels and bboxes of the training batch
+        fns['rpn_encode_fn'] = lambda rois, rois_mask : anchor_encoder_decoder.ext_encode_rois(rois, targets[-3], targets[-2], params['roi_one_image'], params['fg_ratio'], 0.1, head_prior_scaling=[1., 1., 1., 1.], all_rois_mask=rois_mask)
+    return fns
+
+def body(features, params, is_training):
+    return xception_body.XceptionBody(features, params['num_classes'], is_training=is_training, data_format=params['data_format'], recompute_blocks=params['recompute_blocks'])
+
+def head_loss_func(cls_score, bboxes_reg, select_indices, proposals_targets, proposals_labels, proposals_mask, params):
+    # select_indices are the [batch index, roi index] pairs of the rois kept by OHEM
+    if select_indices is not None:
+        proposals_targets = tf.gather_nd(proposals_targets, select_indices)
+        proposals_labels = tf.gather_nd(proposals_labels, select_indices)
+        proposals_mask = tf.gather_nd(proposals_mask, select_indices)
+    # the padded rois are not counted
+    roi_weights = tf.cast(proposals_mask, tf.float32)
+    num_rois = tf.maximum(tf.reduce_sum(roi_weights), 1.)
+    # Calculate loss, which includes softmax cross entropy and L2 regularization.
+    head_cross_entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=proposals_labels, logits=cls_score)
+
+    total_positive_mask = tf.cast((proposals_labels > 0), tf.float32)
+    head_loc_loss = losses.modified_smooth_l1(bboxes_reg, proposals_targets, sigma=1.)
+    head_loc_loss = tf.reduce_sum(head_loc_loss, axis=-1) * total_positive_mask
+    if (params['using_ohem'] and (select_indices is not None)) or (not params['using_ohem']):
+        head_cross_entropy_loss = tf.reduce_sum(head_cross_entropy * roi_weights) / num_rois
+        head_cross_entropy_loss = tf.identity(head_cross_entropy_loss, name='head_cross_entropy_loss')
+        tf.summary.scalar('head_cross_entropy_loss', head_cross_entropy_loss)
+
+        head_location_loss = tf.reduce_sum(head_loc_loss * roi_weights) / num_rois#/params['fg_ratio']
+        head_location_loss = tf.identity(head_location_loss, name='head_location_loss')
+        tf.summary.scalar('head_location_loss', head_location_loss)
+
+    return (head_cross_entropy + head_loc_loss) * roi_weights#/params['fg_ratio']
+
+def head(body_outputs, labels, params, mode):
+    is_training = (mode == tf.estimator.ModeKeys.TRAIN)
+    rpn_feat_map, backbone_feat = body_outputs
+    with stage_profiler.stage('rpn'):
+        rpn_cls_score, rpn_bbox_pred = xception_body.get_rpn(rpn_feat_map, labels['num_anchors_list'][0], is_training, params['data_format'], 'rpn_head')
+
+    large_sep_feature = xception_body.large_sep_kernel(backbone_feat, 256, 10 * 7 * 7, is_training, params['data_format'], 'large_sep_feature')
+
+    if params['data_format'] == 'channels_first':
+        rpn_cls_score = tf.transpose(rpn_cls_score, [0, 2, 3, 1])
+        rpn_bbox_pred = tf.transpose(rpn_bbox_pred, [0, 2, 3, 1])
+
+    rpn_cls_score = tf.reshape(rpn_cls_score, [-1, 2])
+    rpn_object_score = tf.nn.softmax(rpn_cls_score)[:, -1]
+
+    # the last batch of evaluation may be smaller than batch_size
+    batch_size = params['batch_size'] if is_training else tf.shape(rpn_feat_map)[0]
+    rpn_object_score = tf.reshape(rpn_object_score, [batch_size, -1])
+    rpn_location_pred = tf.reshape(rpn_bbox_pred, [batch_size, -1, 4])
+
+    with stage_profiler.stage('decode'):
+        rpn_bboxes_pred = labels['rpn_decode_fn'](rpn_location_pred)
+
+    pooling_op = lambda input_, bboxes_, grid_width_, grid_height_ : ps_roi_align(input_, bboxes_, grid_width_, grid_height_, pool_method)
+    outputs = {'rpn_cls_score': rpn_cls_score, 'rpn_bbox_pred': rpn_bbox_pred}
+    if is_training:
+        proposals_bboxes, proposals_targets, proposals_labels, proposals_scores, proposals_mask = xception_body.get_proposals(rpn_object_score, rpn_bboxes_pred, labels['rpn_encode_fn'], params['rpn_pre_nms_top_n'], params['rpn_post_nms_top_n'], params['nms_threshold'], params['rpn_min_size'], True, params['data_format'])
+
+        head_loss = xception_body.get_head(large_sep_feature, pooling_op, 7, 7, lambda cls, bbox, indices : head_loss_func(cls, bbox, indices, proposals_targets, proposals_labels, proposals_mask, params), proposals_bboxes, params['num_classes'], True, params['using_ohem'], params['ohem_roi_one_image'], params['data_format'], 'final_head', proposals_mask=proposals_mask)
+
+        # Create a tensor named cross_entropy for logging purposes.
+        outputs['head_loss'] = tf.identity(head_loss, name='head_loss')
+        tf.summary.scalar('head_loss', outputs['head_loss'])
+    else:
+        with stage_profiler.stage('proposals'):
+            proposals_bboxes, proposals_mask = xception_body.get_proposals(rpn_object_score, rpn_bboxes_pred, None, params['rpn_pre_nms_top_n'], params['rpn_post_nms_top_n'], params['nms_threshold'], params['rpn_min_size'], False, params['data_format'])
+
+        outputs['cls_score'], outputs['bboxes_reg'] = xception_body.get_head(large_sep_feature, pooling_op, 7, 7, None, proposals_bboxes, params['num_classes'], False, False, 0, params['data_format'], 'final_head', proposals_mask=proposals_mask)
+        outputs['proposals_bboxes'] = proposals_bboxes
+        outputs['proposals_mask'] = proposals_mask
+    return outputs
+
+def rpn_loss(outputs, labels, params):
+    num_feature_layers = len(labels['num_anchors_list'])
+    glabels = labels['targets'][:num_feature_layers][0]
+    gtargets = labels['targets'][num_feature_layers : 2 * num_feature_layers][0]
+    gscores = labels['targets'][2 * num_feature_layers : 3 * num_feature_layers][0]
+
+    cls_pred = tf.reshape(outputs['rpn_cls_score'], [-1, 2])
+    location_pred = tf.reshape(outputs['rpn_bbox_pred'], [-1, 4])
+    glabels = tf.reshape(glabels, [-1])
+    gscores = tf.reshape(gscores, [-1])
+    gtargets = tf.reshape(gtargets, [-1, 4])
+
+    expected_num_fg_rois = tf.cast(tf.round(tf.cast(params['batch_size'] * params['rpn_anchors_per_image'], tf.float32) * params['rpn_fg_ratio']), tf.int32)
+
+    def select_samples(cls_pred, location_pred, glabels, gscores, gtargets):
+        def downsample_impl(now_count, need_count):
+            # downsample with replacement
+            select_indices = tf.random_shuffle(tf.range(now_count))[:need_count]
+            return select_indices
+
+        positive_mask = glabels > 0
+        positive_indices = tf.squeeze(tf.where(positive_mask), axis = -1)
+        n_positives = tf.shape(positive_indices)[0]
+        # either downsample or take all
+        fg_select_indices = tf.cond(n_positives < expected_num_fg_rois, lambda : positive_indices, lambda : tf.gather(positive_indices, downsample_impl(n_positives, expected_num_fg_rois)))
+        # now the all rois taken as positive is min(n_positives, expected_num_fg_rois)
+
+        negtive_mask = tf.logical_and(tf.equal(glabels, 0), gscores > 0.)
+        negtive_indices = tf.squeeze(tf.where(negtive_mask), axis = -1)
+        n_negtives = tf.shape(negtive_indices)[0]
+
+        expected_num_bg_rois = params['batch_size'] * params['rpn_anchors_per_image'] - tf.minimum(n_positives, expected_num_fg_rois)
+        # either downsample or take all
+        bg_select_indices = tf.cond(n_negtives < expected_num_bg_rois, lambda : negtive_indices, lambda : tf.gather(negtive_indices, downsample_impl(n_negtives, expected_num_bg_rois)))
+        # now the all rois taken as positive is min(n_negtives, expected_num_bg_rois)
+
+        # now the number of kept anchors must be equal or less than rpn_anchors_per_image, the losses are means over them
+        final_keep_indices = tf.concat([fg_select_indices, bg_select_indices], axis = 0)
+
+        return tf.gather(cls_pred, final_keep_indices), tf.gather(location_pred, final_keep_indices), tf.cast(tf.gather(tf.clip_by_value(glabels, 0, params['num_classes']), final_keep_indices) > 0, tf.int64), tf.gather(gscores, final_keep_indices), tf.gather(gtargets, final_keep_indices)
+
+    cls_pred, location_pred, glabels, gscores, gtargets = select_samples(cls_pred, location_pred, glabels, gscores, gtargets)
+
+    rpn_cross_entropy = tf.losses.sparse_softmax_cross_entropy(labels=glabels, logits=cls_pred)
+
+    # Create a tensor named cross_entropy for logging purposes.
+    rpn_cross_entropy = tf.identity(rpn_cross_entropy, name='rpn_cross_entropy_loss')
+    tf.summary.scalar('rpn_cross_entropy_loss', rpn_cross_entropy)
+
+    total_positive_mask = (glabels > 0)
+    gtargets = tf.boolean_mask(gtargets, tf.stop_gradient(total_positive_mask))
+    location_pred = tf.boolean_mask(location_pred, tf.stop_gradient(total_positive_mask))
+
+    rpn_l1_distance = losses.modified_smooth_l1(location_pred, gtargets, sigma=1.)
+    rpn_loc_loss = tf.reduce_mean(tf.reduce_sum(rpn_l1_distance, axis=-1)) * params['rpn_fg_ratio']
+    rpn_loc_loss = tf.identity(rpn_loc_loss, name='rpn_location_loss')
+    tf.summary.scalar('rpn_location_loss', rpn_loc_loss)
+    tf.losses.add_loss(rpn_loc_loss)
+
+    rpn_loss = tf.identity(rpn_loc_loss + rpn_cross_entropy, name='rpn_loss')
+    tf.summary.scalar('rpn_loss', rpn_loss)
+
+    return rpn_loss
+
+def loss(outputs, labels, params, mode):
+    # the proposals have no targets when evaluating
+    if mode != tf.estimator.ModeKeys.TRAIN:
+        return None
+    tf.losses.add_loss(outputs['head_loss'])
+    return rpn_loss(outputs, labels, params) + outputs['head_loss']
+
+def detections(outputs, labels, params):
+    # the padded rois are scored as background only
+    roi_weights = tf.expand_dims(tf.cast(outputs['proposals_mask'], tf.float32), -1)
+    background_logits = tf.one_hot(tf.zeros_like(outputs['proposals_mask'], dtype=tf.int32), params['num_classes'], on_value=100., off_value=-100.)
+    cls_score = outputs['cls_score'] * roi_weights + background_logits * (1. - roi_weights)
+    return cls_score, labels['head_decode_fn'](outputs['proposals_bboxes'], outputs['bboxes_reg'])
+
+def tensors_to_log(params, mode):
+    if mode != tf.estimator.ModeKeys.TRAIN:
+        return {}
+    return {
+        'lr': 'learning_rate',
+        'rpn_ce_loss': 'rpn_cross_entropy_loss',
+        'rpn_loc_loss': 'rpn_location_loss',
+        'rpn_loss': 'rpn_loss',
+        'head_loss': '{}/head/head_loss'.format(params['model_scope']),
+        'head_ce_loss': '{}/head/final_head/head_cross_entropy_loss'.format(params['model_scope']),
+        'head_loc_loss': '{}/head/final_head/head_location_loss'.format(params['model_scope']),
+        'total_loss': 'total_loss',
+    }
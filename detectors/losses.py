@@ -0,0 +1,109 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''The losses shared by the detectors.'''
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+def modified_smooth_l1(bbox_pred, bbox_targets, bbox_inside_weights = 1., bbox_outside_weights = 1., sigma = 1.):
+    """
+        ResultLoss = outside_weights * SmoothL1(inside_weights * (bbox_pred - bbox_targets))
+        SmoothL1(x) = 0.5 * (sigma * x)^2,    if |x| < 1 / sigma^2
+                      |x| - 0.5 / sigma^2,    otherwise
+    """
+    sigma2 = sigma * sigma
+
+    inside_mul = tf.multiply(bbox_inside_weights, tf.subtract(bbox_pred, bbox_targets))
+
+    smooth_l1_sign = tf.cast(tf.less(tf.abs(inside_mul), 1.0 / sigma2), tf.float32)
+    smooth_l1_option1 = tf.multiply(tf.multiply(inside_mul, inside_mul), 0.5 * sigma2)
+    smooth_l1_option2 = tf.subtract(tf.abs(inside_mul), 0.5 / sigma2)
+    smooth_l1_result = tf.add(tf.multiply(smooth_l1_option1, smooth_l1_sign),
+                              tf.multiply(smooth_l1_option2, tf.abs(tf.subtract(smooth_l1_sign, 1.0))))
+
+    outside_mul = tf.multiply(bbox_outside_weights, smooth_l1_result)
+
+    return outside_mul
+
+def weight_decay_loss(weight_decay):
+    # We exclude the batch norm variables because doing so leads to a small improvement in accuracy.
+    return weight_decay * tf.add_n([tf.nn.l2_loss(v) for v in tf.trainable_variables() if 'batch_normalization' not in v.name])
+
+def hard_negative_mining_loss(cls_pred, location_pred, glabels, gtargets, gscores, num_classes, negative_ratio, mode):
+    '''The single stage loss of the X-Det models: softmax cross entropy over all positive anchors and the
+    hardest negative ones of each image (at most negative_ratio times its positives), smooth l1 over the positives.
+
+    The cross entropy of every anchor is computed once and also ranks the negatives, exactly
+    min(negative_ratio * positives, negatives) of them are selected in each image, ties broken by index.
+    All the masks keep the [batch, anchors] shape of the inputs.
+
+    Return:
+        (cross_entropy, loc_loss), also named "cross_entropy_loss" and "location_loss" for logging.
+    '''
+    batch_size = cls_pred.get_shape()[0].value
+    if batch_size is None:
+        batch_size = tf.shape(cls_pred)[0]
+    cls_pred = tf.reshape(cls_pred, [batch_size, -1, num_classes])
+    location_pred = tf.reshape(location_pred, [batch_size, -1, 4])
+    glabels = tf.reshape(glabels, [batch_size, -1])
+    gscores = tf.reshape(gscores, [batch_size, -1])
+    gtargets = tf.reshape(gtargets, [batch_size, -1, 4])
+
+    # each positive examples has one label
+    positive_mask = glabels > 0
+    fpositive_mask = tf.cast(positive_mask, tf.float32)
+    n_positives = tf.reduce_sum(fpositive_mask, axis=-1)
+    # negtive examples are those max_overlap is still lower than neg_threshold, note that some positive may also has lower jaccard
+    # note those gscores is 0 is either be ignored during anchors encode or anchors have 0 overlap with all ground truth
+    negtive_mask = tf.logical_and(tf.equal(glabels, 0), gscores > 0.)
+    n_negtives = tf.reduce_sum(tf.cast(negtive_mask, tf.int32), axis=-1)
+
+    # [batch, anchors], the cross entropy of a negative is -log(p_background), so it also ranks them
+    cross_entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=tf.stop_gradient(tf.clip_by_value(glabels, 0, num_classes - 1)), logits=cls_pred)
+
+    # hard negative mining for classification in each image: select its n_neg_to_select hardest negatives by rank,
+    # top_k only partially sorts up to the largest n_neg_to_select of the batch and breaks ties by index
+    n_neg_to_select = tf.minimum(tf.cast(negative_ratio * n_positives, tf.int32), n_negtives)
+    max_neg_to_select = tf.reduce_max(n_neg_to_select)
+    neg_cross_entropy = tf.where(negtive_mask, cross_entropy, -tf.ones_like(cross_entropy))
+    _, hardest_indices = tf.nn.top_k(tf.stop_gradient(neg_cross_entropy), k=max_neg_to_select)
+    # [batch, max_neg_to_select], the first n_neg_to_select of each image are kept
+    keep_rank = tf.cast(tf.expand_dims(tf.range(max_neg_to_select), 0) < tf.expand_dims(n_neg_to_select, -1), tf.int32)
+    batch_indices = tf.tile(tf.expand_dims(tf.range(batch_size), -1), [1, max_neg_to_select])
+    selected_neg_mask = tf.scatter_nd(tf.stack([batch_indices, hardest_indices], axis=-1), keep_rank, tf.shape(glabels)) > 0
+
+    # include both selected negtive and all positive examples
+    cls_weights = tf.stop_gradient(tf.cast(tf.logical_or(selected_neg_mask, positive_mask), tf.float32))
+    total_positives = tf.reduce_sum(n_positives)
+
+    # the mean over the selected anchors, 0 when there is no positive in the batch
+    cross_entropy_loss = tf.reduce_sum(cross_entropy * cls_weights) / tf.maximum(tf.reduce_sum(cls_weights), 1.)
+    # Create a tensor named cross_entropy for logging purposes.
+    cross_entropy_loss = tf.identity(cross_entropy_loss, name='cross_entropy_loss')
+    tf.summary.scalar('cross_entropy_loss', cross_entropy_loss)
+    tf.losses.add_loss(cross_entropy_loss)
+
+    loc_loss = tf.reduce_sum(modified_smooth_l1(location_pred, tf.stop_gradient(gtargets), sigma=1.), axis=-1)
+    loc_loss = tf.reduce_sum(loc_loss * fpositive_mask) / tf.maximum(total_positives, 1.)
+    loc_loss = tf.identity(loc_loss, name='location_loss')
+    tf.summary.scalar('location_loss', loc_loss)
+    tf.losses.add_loss(loc_loss)
+
+    if mode == tf.estimator.ModeKeys.TRAIN:
+        cls_accuracy = tf.metrics.accuracy(glabels, tf.argmax(cls_pred, axis=-1), weights=cls_weights)
+        # Create a tensor named train_accuracy for logging purposes.
+        tf.identity(cls_accuracy[1], name='cls_accuracy')
+        tf.summary.scalar('cls_accuracy', cls_accuracy[1])
+
+    return cross_entropy_loss, loc_loss
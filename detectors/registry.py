@@ -0,0 +1,55 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Registry of the detectors trained and evaluated by detector_main.py.
+
+A detector is a module supplying only what differs between the models, detector_main.py
+owns the input pipeline, session config, optimizer, hooks, evaluation and export:
+
+    PREPROCESSING_NAME: the name in preprocessing_factory, also used for the exported model.
+    DEFAULTS: flag defaults of this model, EVAL_DEFAULTS are applied on top when evaluating.
+    define_flags(flags): optional, define the flags only this model uses.
+    setup(params): optional, called once before any graph is built.
+    get_anchor_encoder_decoder(params): return (anchor_encoder_decoder, num_anchors_list).
+    label_fns(anchor_encoder_decoder, targets, params, mode): dict of the encode/decode functions
+        put into labels, targets is the batch from the input pipeline (None when exporting).
+    body(features, params, is_training): the backbone.
+    head(body_outputs, labels, params, mode): dict of the head outputs.
+    loss(outputs, labels, params, mode): the model loss without weight decay, None if the
+        model has no loss in this mode.
+    detections(outputs, labels, params): (class logits, decoded bboxes) of every prediction.
+    tensors_to_log(params, mode): dict of the tensors logged every log_every_n_steps.
+
+The modules import TensorFlow and their nets lazily, so loading all of them is cheap.
+'''
+import importlib
+
+_DETECTORS = {
+    'xdet_resnet': 'detectors.xdet_resnet',
+    'xdet_v2_resnet': 'detectors.xdet_v2_resnet',
+    'xdet_v3_resnet': 'detectors.xdet_v3_resnet',
+    'light_head_rfcn': 'detectors.light_head_rfcn',
+}
+
+def register(name, module_name):
+    _DETECTORS[name] = module_name
+
+def names():
+    return sorted(_DETECTORS.keys())
+
+def get_detector(name):
+    '''Import and return the module of the detector.'''
+    if name not in _DETECTORS:
+        raise ValueError('Unknown detector "{}", choose from: {}'.format(name, ', '.join(names())))
+    return importlib.import_module(_DETECTORS[name])
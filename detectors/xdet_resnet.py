@@ -0,0 +1,123 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''X-Det V1: dilated ResNet body with one anchor layer, see detectors/registry.py for the interface.'''
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+from net import backbones
+from detectors import losses
+
+xdet_body = backbones.lazy_backbone('xdet_resnet')
+anchor_manipulator = cli.lazy_import('preprocessing.anchor_manipulator')
+
+PREPROCESSING_NAME = 'xdet_resnet'
+
+DEFAULTS = {
+    'model_dir': './logs/',
+    'train_image_size': 320,
+    'checkpoint_path': './model/resnet50',
+    'model_scope': 'xdet_resnet',
+    'checkpoint_exclude_scopes': 'xdet_resnet/xdet_head, xdet_resnet/xdet_multi_path, xdet_resnet/xdet_additional_conv',
+    'cloud_checkpoint_path': 'resnet50/model.ckpt',
+}
+EVAL_DEFAULTS = {
+    'debug_dir': './Debug/',
+}
+
+def define_flags(flags):
+    flags.DEFINE_float(
+        'negative_ratio', 3., 'Negative ratio in the loss function.')
+    flags.DEFINE_float(
+        'neg_threshold', 0.4, 'Matching threshold for the negtive examples in the loss function.')
+    flags.DEFINE_string(
+        'anchor_scales', '0.2,0.3,0.4,0.5,0.6,0.7,0.8',
+        'Comma separated anchor scales relative to the image, each is combined with every ratio of --anchor_ratios, see anchor_kmeans.py.')
+    flags.DEFINE_string(
+        'anchor_ratios', '1.,2.,3.,.5,0.3333',
+        'Comma separated width / height ratios of the anchors.')
+    flags.DEFINE_string(
+        'extra_anchor_scales', '0.1',
+        'Comma separated scales of the extra square anchors, can be empty.')
+
+def parse_anchor_list(args):
+    return [float(s.strip()) for s in args.split(',') if s.strip()]
+
+def xdet_anchor_encoder_decoder(params, layers_shape, layer_step):
+    '''The anchors of all X-Det versions, they differ only in the size of the feature map.'''
+    anchor_creator = anchor_manipulator.AnchorCreator([params['train_image_size']] * 2,
+                                                    layers_shapes = [layers_shape],
+                                                    anchor_scales = [parse_anchor_list(params['anchor_scales'])],
+                                                    extra_anchor_scales = [parse_anchor_list(params['extra_anchor_scales'])],
+                                                    anchor_ratios = [parse_anchor_list(params['anchor_ratios'])],
+                                                    layer_steps = [layer_step])
+    all_anchors, num_anchors_list = anchor_creator.get_all_anchors()
+
+    return anchor_manipulator.AnchorEncoder(all_anchors,
+                                            num_classes = params['num_classes'],
+                                            allowed_borders = [0.05],
+                                            positive_threshold = params['match_threshold'],
+                                            ignore_threshold = params['neg_threshold'],
+                                            prior_scaling=[0.1, 0.1, 0.2, 0.2]), num_anchors_list
+
+def get_anchor_encoder_decoder(params):
+    return xdet_anchor_encoder_decoder(params, (40, 40), 8)
+
+def label_fns(anchor_encoder_decoder, targets, params, mode):
+    return {'decode_fn': lambda pred : anchor_encoder_decoder.decode_all_anchors([pred])[0]}
+
+def body(features, params, is_training):
+    backbone = xdet_body.xdet_resnet_v2(params['resnet_size'], params['data_format'], params['recompute_blocks'])
+    return backbone(inputs=features, is_training=is_training)
+
+def head(body_outputs, labels, params, mode):
+    cls_pred, location_pred = xdet_body.xdet_head(body_outputs, params['num_classes'], labels['num_anchors_list'][0], (mode == tf.estimator.ModeKeys.TRAIN), data_format=params['data_format'])
+    return xdet_outputs(cls_pred, location_pred, params)
+
+def xdet_outputs(cls_pred, location_pred, params):
+    if params['data_format'] == 'channels_first':
+        cls_pred = tf.transpose(cls_pred, [0, 2, 3, 1])
+        location_pred = tf.transpose(location_pred, [0, 2, 3, 1])
+    return {'cls_pred': cls_pred, 'location_pred': location_pred}
+
+def xdet_loss(outputs, labels, params, mode, loss_scale):
+    num_feature_layers = len(labels['num_anchors_list'])
+    glabels = labels['targets'][:num_feature_layers][0]
+    gtargets = labels['targets'][num_feature_layers : 2 * num_feature_layers][0]
+    gscores = labels['targets'][2 * num_feature_layers : 3 * num_feature_layers][0]
+
+    cross_entropy, loc_loss = losses.hard_negative_mining_loss(outputs['cls_pred'], outputs['location_pred'], glabels, gtargets, gscores,
+                                                                params['num_classes'], params['negative_ratio'], mode)
+    return loss_scale * (cross_entropy + loc_loss)
+
+def loss(outputs, labels, params, mode):
+    return xdet_loss(outputs, labels, params, mode, 1.2)
+
+def detections(outputs, labels, params):
+    return outputs['cls_pred'], labels['decode_fn'](outputs['location_pred'])
+
+def tensors_to_log(params, mode):
+    if mode == tf.estimator.ModeKeys.TRAIN:
+        return {
+            'lr': 'learning_rate',
+            'ce_loss': 'cross_entropy_loss',
+            'loc_loss': 'location_loss',
+            'total_loss': 'total_loss',
+            'cls_acc': 'cls_accuracy',
+        }
+    return {
+        'ce_loss': 'cross_entropy_loss',
+        'loc_loss': 'location_loss',
+        'total_loss': 'total_loss',
+    }
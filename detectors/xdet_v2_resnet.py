@@ -0,0 +1,55 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''X-Det V2: separate classification and regression outputs of the body, anchors and loss of X-Det V1.'''
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+from net import backbones
+from detectors import xdet_resnet
+
+xdet_body_v2 = backbones.lazy_backbone('xdet_v2_resnet')
+
+PREPROCESSING_NAME = 'xdet_resnet'
+
+DEFAULTS = dict(xdet_resnet.DEFAULTS, **{
+    'model_dir': './logs_v2/',
+    'train_image_size': 304,
+})
+EVAL_DEFAULTS = {
+    'debug_dir': './Debug_v2/',
+    'neg_threshold': 0.45,
+    'select_threshold': 0.51,
+    'nms_topk': 100,
+}
+
+define_flags = xdet_resnet.define_flags
+label_fns = xdet_resnet.label_fns
+detections = xdet_resnet.detections
+tensors_to_log = xdet_resnet.tensors_to_log
+
+def get_anchor_encoder_decoder(params):
+    return xdet_resnet.xdet_anchor_encoder_decoder(params, (38, 38), 8)
+
+def body(features, params, is_training):
+    backbone = xdet_body_v2.xdet_resnet_v2(params['resnet_size'], params['data_format'], params['recompute_blocks'])
+    return backbone(inputs=features, is_training=is_training)
+
+def head(body_outputs, labels, params, mode):
+    body_cls_output, body_regress_output = body_outputs
+    cls_pred, location_pred = xdet_body_v2.xdet_head(body_cls_output, body_regress_output, params['num_classes'], labels['num_anchors_list'][0], (mode == tf.estimator.ModeKeys.TRAIN), data_format=params['data_format'])
+    return xdet_resnet.xdet_outputs(cls_pred, location_pred, params)
+
+def loss(outputs, labels, params, mode):
+    return xdet_resnet.xdet_loss(outputs, labels, params, mode, 1.2)
@@ -0,0 +1,57 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''X-Det V3: the body of X-Det V2 one stage deeper, on a 22x22 feature map.'''
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+from net import backbones
+from detectors import xdet_resnet
+
+xdet_body_v3 = backbones.lazy_backbone('xdet_v3_resnet')
+
+PREPROCESSING_NAME = 'xdet_resnet'
+
+DEFAULTS = dict(xdet_resnet.DEFAULTS, **{
+    'model_dir': './logs_v3/',
+    'train_image_size': 352,
+    'batch_size': 12,
+    'end_learning_rate': 0.00005,
+    'decay_boundaries': '60000, 800000',
+    'lr_decay_factors': '1, 0.6, 0.1',
+})
+EVAL_DEFAULTS = {
+    'debug_dir': './Debug_v3/',
+    'batch_size': 16,
+}
+
+define_flags = xdet_resnet.define_flags
+label_fns = xdet_resnet.label_fns
+detections = xdet_resnet.detections
+tensors_to_log = xdet_resnet.tensors_to_log
+
+def get_anchor_encoder_decoder(params):
+    return xdet_resnet.xdet_anchor_encoder_decoder(params, (22, 22), 16)
+
+def body(features, params, is_training):
+    backbone = xdet_body_v3.xdet_resnet_v3(params['resnet_size'], params['data_format'], params['recompute_blocks'])
+    return backbone(inputs=features, is_training=is_training)
+
+def head(body_outputs, labels, params, mode):
+    body_cls_output, body_regress_output = body_outputs
+    cls_pred, location_pred = xdet_body_v3.xdet_head(body_cls_output, body_regress_output, params['num_classes'], labels['num_anchors_list'][0], (mode == tf.estimator.ModeKeys.TRAIN), data_format=params['data_format'])
+    return xdet_resnet.xdet_outputs(cls_pred, location_pred, params)
+
+def loss(outputs, labels, params, mode):
+    return xdet_resnet.xdet_loss(outputs, labels, params, mode, 1.)
@@ -0,0 +1,251 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Data-parallel training with detector_main.py: the parameter servers and the workers each run
+in their own process, every worker reads its own shard of the record files and the gradients are
+averaged by SyncReplicasOptimizer (pass --nosync_replicas to detector_main.py for asynchronous updates).
+
+Examples:
+    # 4 workers and 1 parameter server on this machine
+    python dist_train.py --model=xdet_resnet --num_workers=4 -- --batch_size=8
+    # 2 hosts with 4 workers each, run the same command on each host with its own --host_index
+    python dist_train.py --hosts=10.0.0.1,10.0.0.2 --host_index=0 --num_workers=4 -- --batch_size=8
+    # images per second and scaling efficiency of 1, 2 and 4 local workers
+    python dist_train.py --model=xdet_resnet --scaling_workers=1,2,4 --scaling_steps=50
+
+Arguments not known by this script are passed to every process. The output of each process
+is written to "model_dir/dist_logs".
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+from detectors import registry
+
+cli.flags.DEFINE_string(
+    'model', 'xdet_resnet',
+    'The detector to train.')
+cli.flags.DEFINE_string(
+    'model_dir', None,
+    'The directory where the model will be stored, default to the one of the model.')
+cli.flags.DEFINE_string(
+    'hosts', 'localhost',
+    'Comma separated hosts of the cluster, the parameter servers and the chief are placed on the first one.')
+cli.flags.DEFINE_integer(
+    'host_index', 0,
+    'The index of this machine in --hosts, only the tasks on it are started.')
+cli.flags.DEFINE_integer(
+    'num_workers', 2,
+    'The number of worker processes on each host.')
+cli.flags.DEFINE_integer(
+    'num_ps', 1,
+    'The number of parameter server processes.')
+cli.flags.DEFINE_integer(
+    'port', 2222,
+    'The first port used on each host, the tasks of a host use consecutive ports.')
+cli.flags.DEFINE_integer(
+    'grace_secs', 60,
+    'Kill the remaining workers and the parameter servers this long after the end of training.')
+cli.flags.DEFINE_integer(
+    'timeout_secs', 0,
+    'Stop all the tasks of this host after this many seconds, 0 for no limit. Needed on the hosts '
+    'without the chief when --model_dir is not shared and --max_train_steps is not given.')
+cli.flags.DEFINE_string(
+    'scaling_workers', '',
+    'Comma separated numbers of local workers, train each for --scaling_steps steps and report their scaling efficiency.')
+cli.flags.DEFINE_integer(
+    'scaling_steps', 50,
+    'The number of global steps of each scaling run.')
+
+FLAGS = cli.flags.FLAGS
+
+def get_cluster(hosts, num_workers, num_ps, port):
+    '''Return the cluster dict of TF_CONFIG and the list of (host index, task type, task index).'''
+    cluster = {'ps': [], 'chief': [], 'worker': []}
+    tasks = []
+    for host_index, host in enumerate(hosts):
+        num_tasks = num_workers + (num_ps if host_index == 0 else 0)
+        for task_port in range(port, port + num_tasks):
+            address = '{}:{}'.format(host, task_port)
+            if host_index == 0 and len(cluster['ps']) < num_ps:
+                task_type = 'ps'
+            elif not cluster['chief']:
+                task_type = 'chief'
+            else:
+                task_type = 'worker'
+            tasks.append((host_index, task_type, len(cluster[task_type])))
+            cluster[task_type].append(address)
+    return {k: v for k, v in cluster.items() if v}, tasks
+
+def launch(cluster, tasks, host_index, model_dir, extra_args, throughput_dir = None):
+    '''Start the tasks of this host, return dict (task type, task index) -> process.'''
+    log_dir = os.path.join(model_dir, 'dist_logs')
+    tf.gfile.MakeDirs(log_dir)
+    local_tasks = [task for task in tasks if task[0] == host_index]
+    # split the cores of this host evenly, unless given explicitly
+    if not any(arg.startswith('--num_cpu_threads') for arg in extra_args):
+        extra_args = ['--num_cpu_threads={}'.format(max(1, multiprocessing.cpu_count() // len(local_tasks)))] + list(extra_args)
+
+    processes = {}
+    for _, task_type, task_index in local_tasks:
+        name = '{}_{}'.format(task_type, task_index)
+        cmd = [sys.executable, 'detector_main.py',
+                '--model={}'.format(FLAGS.model),
+                '--mode=train',
+                '--model_dir={}'.format(model_dir)] + list(extra_args)
+        if throughput_dir is not None and task_type != 'ps':
+            cmd.append('--throughput_file={}'.format(os.path.join(throughput_dir, name + '.json')))
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': task_type, 'index': task_index}})
+        tf.logging.info('%s: %s', name, ' '.join(cmd))
+        with open(os.path.join(log_dir, name + '.log'), 'w') as log_file:
+            processes[(task_type, task_index)] = subprocess.Popen(cmd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    return processes
+
+def get_max_train_steps(extra_args):
+    '''The --max_train_steps passed to detector_main.py, None if not given.'''
+    for i, arg in enumerate(extra_args):
+        if arg.startswith('--max_train_steps='):
+            return int(arg.split('=', 1)[1])
+        if arg == '--max_train_steps' and i + 1 < len(extra_args):
+            return int(extra_args[i + 1])
+    return None
+
+def checkpoint_step(model_dir):
+    '''The global step of the latest checkpoint in model_dir, None if there is none.'''
+    checkpoint = tf.train.latest_checkpoint(model_dir)
+    if checkpoint is None:
+        return None
+    try:
+        return int(checkpoint.rsplit('-', 1)[-1])
+    except ValueError:
+        return None
+
+def wait(processes, grace_secs, model_dir=None, max_steps=None, timeout_secs=0, poll_secs=30):
+    '''Wait for the end of training, then kill the remaining tasks of this host after grace_secs:
+    the non-chief workers may block on the sync queue after the chief stopped and the parameter
+    servers never exit by themselves.
+
+    The end of training is the exit of the chief on its own host. The other hosts poll the latest
+    checkpoint in model_dir until its global step reaches max_steps, the chief saves it last.
+    Every host gives up after timeout_secs if it is positive.
+
+    Return:
+        True if all the workers which were not killed exited successfully and the timeout was not hit.
+    '''
+    workers = {task: process for task, process in processes.items() if task[0] != 'ps'}
+    ps_only = not workers and bool(processes)
+    if ps_only and (not model_dir or max_steps is None) and timeout_secs <= 0:
+        tf.logging.warning('This host only runs parameter servers, without --max_train_steps or --timeout_secs they are never stopped.')
+    start_time = time.time()
+    last_poll = None
+    done_time = None
+    success = True
+    while workers or (ps_only and done_time is None):
+        for task, process in list(workers.items()):
+            return_code = process.poll()
+            if return_code is None:
+                continue
+            if return_code != 0:
+                tf.logging.error('%s_%d failed with exit code %d.', task[0], task[1], return_code)
+                success = False
+            if task[0] == 'chief' and done_time is None:
+                tf.logging.info('The chief finished.')
+                done_time = time.time()
+            del workers[task]
+        now = time.time()
+        if done_time is None and model_dir and max_steps is not None and (last_poll is None or now - last_poll >= poll_secs):
+            last_poll = now
+            step = checkpoint_step(model_dir)
+            if step is not None and step >= max_steps:
+                tf.logging.info('The checkpoint of step %d in %s reached the last step.', step, model_dir)
+                done_time = now
+        if done_time is None and timeout_secs > 0 and now - start_time > timeout_secs:
+            tf.logging.error('Training did not finish in %d secs.', timeout_secs)
+            success = False
+            done_time = now - grace_secs
+        if workers and done_time is not None and now - done_time > grace_secs:
+            for task, process in workers.items():
+                tf.logging.warning('Kill %s_%d, training finished %d secs ago.', task[0], task[1], grace_secs)
+                process.kill()
+                process.wait()
+            workers = {}
+        time.sleep(1)
+    # the parameter servers of a host without workers serve the others during their grace period
+    if ps_only:
+        time.sleep(max(0., grace_secs - (time.time() - done_time)))
+    for task, process in processes.items():
+        if task[0] == 'ps':
+            process.kill()
+            process.wait()
+    return success
+
+def read_throughput(throughput_dir):
+    '''Sum the images per second of all the workers.'''
+    images_per_sec = 0.
+    for filename in tf.gfile.Glob(os.path.join(throughput_dir, '*.json')):
+        with tf.gfile.GFile(filename, 'r') as f:
+            images_per_sec += json.load(f)['images_per_sec']
+    return images_per_sec
+
+def scaling_report(model_dir, workers_list, extra_args):
+    '''Train with each number of local workers from scratch, the efficiency of n workers is
+    (images per second / n) divided by the same of the first entry.
+    '''
+    results = []
+    for num_workers in workers_list:
+        run_dir = os.path.join(model_dir, 'scaling_{}'.format(num_workers))
+        throughput_dir = os.path.join(run_dir, 'throughput')
+        tf.gfile.MakeDirs(throughput_dir)
+        cluster, tasks = get_cluster(['localhost'], num_workers, FLAGS.num_ps, FLAGS.port)
+        processes = launch(cluster, tasks, 0, run_dir,
+                            ['--max_train_steps={}'.format(FLAGS.scaling_steps)] + list(extra_args), throughput_dir)
+        if not wait(processes, FLAGS.grace_secs, run_dir, FLAGS.scaling_steps, FLAGS.timeout_secs):
+            raise RuntimeError('Training with {} workers failed, see {}.'.format(num_workers, os.path.join(run_dir, 'dist_logs')))
+        results.append({'num_workers': num_workers, 'images_per_sec': read_throughput(throughput_dir)})
+
+    base = results[0]['images_per_sec'] / results[0]['num_workers']
+    for result in results:
+        result['efficiency'] = result['images_per_sec'] / result['num_workers'] / base if base > 0 else 0.
+        tf.logging.info('%d workers: %.2f images/sec, scaling efficiency %.2f', result['num_workers'], result['images_per_sec'], result['efficiency'])
+    with tf.gfile.GFile(os.path.join(model_dir, 'scaling.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+def main(argv):
+    extra_args = [arg for arg in argv[1:] if arg != '--']
+    model_dir = FLAGS.model_dir or registry.get_detector(FLAGS.model).DEFAULTS['model_dir']
+
+    if FLAGS.scaling_workers:
+        scaling_report(model_dir, [int(_) for _ in FLAGS.scaling_workers.split(',')], extra_args)
+        return
+
+    hosts = [host.strip() for host in FLAGS.hosts.split(',') if host.strip()]
+    cluster, tasks = get_cluster(hosts, FLAGS.num_workers, FLAGS.num_ps, FLAGS.port)
+    processes = launch(cluster, tasks, FLAGS.host_index, model_dir, extra_args)
+    if not wait(processes, FLAGS.grace_secs, model_dir, get_max_train_steps(extra_args), FLAGS.timeout_secs):
+        sys.exit(1)
+
+if __name__ == '__main__':
+  cli.run(main)
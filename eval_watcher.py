@@ -0,0 +1,117 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Watch model_dir and evaluate every new checkpoint once.
+
+Example:
+    python eval_watcher.py --eval_script=xdet_resnet_eval.py --model_dir=./logs/ --num_shards=4 -- --num_cpu_threads=4
+
+Arguments not known by this script are passed to every eval process.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+checkpoint_evaluator = cli.lazy_import('utility.checkpoint_evaluator')
+
+cli.flags.DEFINE_string(
+    'eval_script', 'xdet_resnet_eval.py',
+    'The eval script used to evaluate each shard.')
+cli.flags.DEFINE_string(
+    'model_dir', './logs/',
+    'The directory to watch for new checkpoints.')
+cli.flags.DEFINE_string(
+    'index_file', None,
+    'The json file of per-checkpoint results, default to "model_dir/eval_index.json".')
+cli.flags.DEFINE_string(
+    'result_dir', None,
+    'The directory of the per-shard tp/fp arrays, default to "model_dir/eval_results".')
+cli.flags.DEFINE_integer(
+    'num_shards', 1,
+    'The number of local processes the test set is split across.')
+cli.flags.DEFINE_string(
+    'shard_gpus', '',
+    'Comma separated GPU ids assigned to the shards in turn, empty to keep the environment.')
+cli.flags.DEFINE_integer(
+    'poll_secs', 60,
+    'The interval between two checks of model_dir.')
+cli.flags.DEFINE_integer(
+    'timeout_secs', 0,
+    'Stop after no new checkpoint appears for this long, 0 to watch forever.')
+
+FLAGS = cli.flags.FLAGS
+
+def checkpoints_to_evaluate(model_dir, index, failed):
+    ckpt_state = tf.train.get_checkpoint_state(model_dir)
+    if ckpt_state is None:
+        return []
+    # the older ones first, they may be deleted by the trainer soon
+    return [ckpt for ckpt in ckpt_state.all_model_checkpoint_paths if ckpt not in index and ckpt not in failed]
+
+def main(argv):
+    extra_args = [arg for arg in argv[1:] if arg != '--']
+    index_file = FLAGS.index_file or os.path.join(FLAGS.model_dir, 'eval_index.json')
+    result_dir = FLAGS.result_dir or os.path.join(FLAGS.model_dir, 'eval_results')
+    shard_gpus = [gpu.strip() for gpu in FLAGS.shard_gpus.split(',') if gpu.strip()]
+
+    index = checkpoint_evaluator.EvalIndex(index_file)
+    summary_writer = tf.summary.FileWriter(os.path.join(FLAGS.model_dir, 'eval_watcher'))
+    # checkpoints failed in this run are not retried until restart
+    failed = set()
+    last_new_checkpoint = time.time()
+    while True:
+        pending = checkpoints_to_evaluate(FLAGS.model_dir, index, failed)
+        if pending:
+            last_new_checkpoint = time.time()
+        for checkpoint_path in pending:
+            if not tf.train.checkpoint_exists(checkpoint_path):
+                tf.logging.warning('Checkpoint %s was removed before evaluation.', checkpoint_path)
+                failed.add(checkpoint_path)
+                continue
+            tf.logging.info('Evaluating %s with %d shards.', checkpoint_path, FLAGS.num_shards)
+            result = checkpoint_evaluator.evaluate_checkpoint(FLAGS.eval_script, checkpoint_path, result_dir,
+                                                            num_shards = FLAGS.num_shards, shard_gpus = shard_gpus,
+                                                            extra_args = extra_args)
+            if result is None:
+                failed.add(checkpoint_path)
+                continue
+            index.add(checkpoint_path, result)
+            tf.logging.info('%s: mAP VOC07 %.4f, VOC12 %.4f, %.1f secs.', checkpoint_path,
+                            result['mAP_VOC07'], result['mAP_VOC12'], result['eval_secs'])
+
+            summary = tf.Summary()
+            summary.value.add(tag='AP_VOC07/mAP', simple_value=result['mAP_VOC07'])
+            summary.value.add(tag='AP_VOC12/mAP', simple_value=result['mAP_VOC12'])
+            for class_name, ap in result['AP_VOC07'].items():
+                summary.value.add(tag='AP_VOC07/%s' % class_name, simple_value=ap)
+            for class_name, ap in result['AP_VOC12'].items():
+                summary.value.add(tag='AP_VOC12/%s' % class_name, simple_value=ap)
+            summary.value.add(tag='eval_secs', simple_value=result['eval_secs'])
+            summary_writer.add_summary(summary, result['global_step'])
+            summary_writer.flush()
+
+        if FLAGS.timeout_secs > 0 and time.time() - last_new_checkpoint > FLAGS.timeout_secs:
+            tf.logging.info('No new checkpoint for %d secs, exit.', FLAGS.timeout_secs)
+            break
+        time.sleep(FLAGS.poll_secs)
+    summary_writer.close()
+
+if __name__ == '__main__':
+  cli.run(main)
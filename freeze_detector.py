@@ -0,0 +1,135 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Freeze a SavedModel exported by the train scripts (--export_dir) into one GraphDef
+optimized for CPU inference: BNs folded into the conv kernels, constant subgraphs
+(anchors) evaluated once and the nodes not needed by the detections removed.
+
+Example:
+    python freeze_detector.py --saved_model_dir=./export/1525340112 --output_graph=./xdet_frozen.pb --verify_image_dir=demo
+
+With --verify_image_dir the detections of the frozen graph are checked against the
+SavedModel and the script fails if they do not match within --verify_tolerance.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import glob
+import time
+
+import numpy as np
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+graph_optimizer = cli.lazy_import('utility.graph_optimizer')
+inference_server = cli.lazy_import('utility.inference_server')
+
+cli.flags.DEFINE_string(
+    'saved_model_dir', None,
+    'The SavedModel directory (a timestamped sub directory of --export_dir).')
+cli.flags.DEFINE_string(
+    'output_graph', './frozen_detector.pb',
+    'The frozen GraphDef to write, its input/output names are saved into "<output_graph>.json".')
+cli.flags.DEFINE_string(
+    'signature_key', None,
+    'The signature to freeze, default to the one taking preprocessed images.')
+cli.flags.DEFINE_string(
+    'op_library', '',
+    'Comma separated custom op libraries to load before the model, e.g. "./libps_roi_align.so" for light-head models.')
+cli.flags.DEFINE_string(
+    'preprocessing_name', 'xdet_resnet',
+    'The eval preprocessing used by the exported model.')
+cli.flags.DEFINE_string(
+    'verify_image_dir', '',
+    'The directory of JPEGs to compare the frozen graph with the SavedModel, empty to skip.')
+cli.flags.DEFINE_integer(
+    'num_verify_images', 16,
+    'The max number of images used to verify.')
+cli.flags.DEFINE_integer(
+    'verify_batch_size', 4,
+    'The batch size used to verify.')
+cli.flags.DEFINE_float(
+    'verify_tolerance', 1e-3,
+    'The max absolute difference of scores and boxes.')
+cli.flags.DEFINE_integer(
+    'num_cpu_threads', 0,
+    'The number of cpu threads used to verify, 0 to let TensorFlow pick.')
+
+FLAGS = cli.flags.FLAGS
+
+def verify(frozen_graph_def, inputs, outputs):
+    reference = inference_server.DetectorSession(FLAGS.saved_model_dir, num_cpu_threads=FLAGS.num_cpu_threads)
+    optimized = graph_optimizer.FrozenGraphSession(frozen_graph_def, inputs, outputs, num_cpu_threads=FLAGS.num_cpu_threads)
+    preprocessor = inference_server.JpegPreprocessor(FLAGS.preprocessing_name, reference.image_size, reference.data_format)
+
+    filenames = sorted(glob.glob(os.path.join(FLAGS.verify_image_dir, '*.jpg')))[:FLAGS.num_verify_images]
+    if not filenames:
+        raise ValueError('No JPEG found in %s' % FLAGS.verify_image_dir)
+    preprocessed = []
+    for filename in filenames:
+        with tf.gfile.GFile(filename, 'rb') as f:
+            preprocessed.append(preprocessor(f.read()))
+
+    failed = False
+    reference_secs = []
+    optimized_secs = []
+    for start in range(0, len(preprocessed), FLAGS.verify_batch_size):
+        batch = preprocessed[start:start + FLAGS.verify_batch_size]
+        images, image_shapes, bbox_imgs = [np.stack([_[i] for _ in batch]) for i in range(3)]
+        start_time = time.time()
+        reference_result = reference.run(images, image_shapes, bbox_imgs)
+        reference_secs.append(time.time() - start_time)
+        start_time = time.time()
+        optimized_result = optimized.run({'image': images, 'image_shape': image_shapes, 'bbox_img': bbox_imgs})
+        optimized_secs.append(time.time() - start_time)
+
+        errors = graph_optimizer.compare_outputs(reference_result, optimized_result, atol=FLAGS.verify_tolerance)
+        for error in errors:
+            tf.logging.error('Images %d-%d: %s', start, start + len(batch) - 1, error)
+        failed = failed or len(errors) > 0
+
+    # the first batch includes the warm up of both sessions
+    if len(reference_secs) > 1:
+        reference_secs, optimized_secs = reference_secs[1:], optimized_secs[1:]
+    tf.logging.info('SavedModel %.2f ms/batch, frozen graph %.2f ms/batch (batch size %d).',
+                    np.mean(reference_secs) * 1000., np.mean(optimized_secs) * 1000., FLAGS.verify_batch_size)
+    preprocessor.close()
+    optimized.close()
+    reference.close()
+    if failed:
+        raise RuntimeError('The frozen graph does not match the SavedModel within tolerance %g.' % FLAGS.verify_tolerance)
+    tf.logging.info('The frozen graph matches the SavedModel on %d images.', len(preprocessed))
+
+def main(_):
+    if not FLAGS.saved_model_dir:
+        raise ValueError('You must supply the SavedModel directory with --saved_model_dir')
+    for op_library in [_.strip() for _ in FLAGS.op_library.split(',') if _.strip()]:
+        tf.load_op_library(os.path.abspath(op_library))
+
+    graph_def, inputs, outputs = graph_optimizer.freeze_saved_model(FLAGS.saved_model_dir, FLAGS.signature_key)
+    num_nodes = len(graph_def.node)
+    graph_def, stats = graph_optimizer.optimize_for_inference(graph_def, list(outputs.values()))
+    tf.logging.info('Frozen graph: %d -> %d nodes, %d BNs folded (%d pre-activation BNs left), %d constants folded, %d summaries stripped.',
+                    num_nodes, stats['num_nodes'], stats['num_bn_folded'], stats['num_bn_left'],
+                    stats['num_constants_folded'], stats['num_summaries_stripped'])
+    graph_optimizer.save_frozen_graph(FLAGS.output_graph, graph_def, inputs, outputs)
+    tf.logging.info('Saved to %s.', FLAGS.output_graph)
+
+    if FLAGS.verify_image_dir:
+        verify(graph_def, inputs, outputs)
+
+if __name__ == '__main__':
+  cli.run(main)
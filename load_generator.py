@@ -0,0 +1,125 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Send JPEGs to serve_detector.py and report throughput and latency.
+
+Example:
+    python load_generator.py --url=http://localhost:8500 --image_dir=demo --concurrency=16 --num_requests=1000
+    python load_generator.py --url=http://localhost:8500 --image_dir=demo --qps=50 --duration_secs=60
+
+Only needs the standard library, so it can run on a machine without TensorFlow.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import glob
+import json
+import time
+import argparse
+import threading
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+def percentile(values, p):
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100. * (len(values) - 1))))]
+
+def post_image(url, encoded_image, timeout):
+    request = Request(url + '/detect', data=encoded_image, headers={'Content-Type': 'image/jpeg'})
+    return json.loads(urlopen(request, timeout=timeout).read().decode('utf-8'))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8500', help='The address of serve_detector.py.')
+    parser.add_argument('--image_dir', required=True, help='The directory of JPEGs to send, used in turn.')
+    parser.add_argument('--concurrency', type=int, default=8, help='The number of clients sending requests.')
+    parser.add_argument('--qps', type=float, default=0., help='The total request rate, 0 to send as fast as the clients can.')
+    parser.add_argument('--num_requests', type=int, default=500, help='The number of requests to send, ignored if --duration_secs is set.')
+    parser.add_argument('--duration_secs', type=float, default=0., help='Send requests for this long.')
+    parser.add_argument('--timeout', type=float, default=60., help='The timeout of each request.')
+    args = parser.parse_args()
+
+    filenames = sorted(glob.glob(os.path.join(args.image_dir, '*.jpg')) + glob.glob(os.path.join(args.image_dir, '*.jpeg')))
+    if not filenames:
+        raise ValueError('No JPEG found in %s' % args.image_dir)
+    images = []
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            images.append(f.read())
+
+    lock = threading.Lock()
+    state = {'sent': 0, 'errors': 0, 'latencies': [], 'detections': 0}
+    start_time = time.time()
+
+    def next_request():
+        # returns the index of the request to send or None when done, paces the clients in --qps mode
+        with lock:
+            index = state['sent']
+            if args.duration_secs > 0:
+                if time.time() - start_time >= args.duration_secs:
+                    return None
+            elif index >= args.num_requests:
+                return None
+            state['sent'] += 1
+        if args.qps > 0:
+            delay = start_time + index / args.qps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return index
+
+    def client():
+        while True:
+            index = next_request()
+            if index is None:
+                break
+            request_start = time.time()
+            try:
+                result = post_image(args.url, images[index % len(images)], args.timeout)
+            except Exception as e:
+                with lock:
+                    state['errors'] += 1
+                print('Request %d failed: %s' % (index, e))
+                continue
+            with lock:
+                state['latencies'].append((time.time() - request_start) * 1000.)
+                state['detections'] += result['num_detections']
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start_time
+
+    latencies = state['latencies']
+    print('%d requests in %.2f secs, %d errors, %.2f images/sec, %.2f detections/image.' % (len(latencies), elapsed, state['errors'],
+                                                len(latencies) / elapsed, state['detections'] / max(len(latencies), 1)))
+    print('Client latency (ms): mean %.2f, p50 %.2f, p95 %.2f, p99 %.2f, max %.2f.' % (sum(latencies) / max(len(latencies), 1),
+                                                percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99), max(latencies or [0.])))
+    try:
+        metrics = json.loads(urlopen(args.url + '/metrics', timeout=args.timeout).read().decode('utf-8'))
+        print('Server metrics:')
+        print(json.dumps(metrics, indent=2, sort_keys=True))
+    except Exception as e:
+        print('Failed to get the server metrics: %s' % e)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Registry of the network bodies by name, only the selected module is imported.'''
+import importlib
+
+from utility import cli
+
+_BACKBONES = {
+    'xdet_resnet': 'net.xdet_body',
+    'xdet_v2_resnet': 'net.xdet_body_v2',
+    'xdet_v3_resnet': 'net.xdet_body_v3',
+    'xception_lighthead': 'net.xception_body',
+}
+
+def register(name, module_name):
+    _BACKBONES[name] = module_name
+
+def names():
+    return sorted(_BACKBONES.keys())
+
+def _module_name(name):
+    if name not in _BACKBONES:
+        raise ValueError('Unknown backbone "{}", choose from: {}'.format(name, ', '.join(names())))
+    return _BACKBONES[name]
+
+def get_backbone(name):
+    '''Import and return the module of the backbone.'''
+    return importlib.import_module(_module_name(name))
+
+def lazy_backbone(name):
+    '''The module of the backbone, imported on first use.'''
+    return cli.lazy_import(_module_name(name))
@@ -0,0 +1,101 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+
+import tensorflow as tf
+
+_grad_uid = itertools.count()
+
+def _subgraph_ops(inputs, outputs):
+  """The ops on a data path from `inputs` to `outputs`, in the order they were created."""
+  forward = set()
+  stack = list(inputs.consumers())
+  while stack:
+    op = stack.pop()
+    if op not in forward:
+      forward.add(op)
+      stack.extend(c for t in op.outputs for c in t.consumers())
+  between = set()
+  stack = [outputs.op]
+  while stack:
+    op = stack.pop()
+    if op in forward and op not in between:
+      between.add(op)
+      stack.extend(t.op for t in op.inputs)
+  # graph creation order is a topological order
+  return [op for op in inputs.graph.get_operations() if op in between]
+
+def _variable_reads(ops):
+  """The values of the trainable variables read by `ops`."""
+  variable_ops = {v.op: v for v in tf.trainable_variables()}
+  op_set = set(ops)
+  reads = []
+  for op in ops:
+    for t in op.inputs:
+      if t.op in op_set or t in reads:
+        continue
+      # ref variables are read by their snapshot identity, resource ones by ReadVariableOp
+      if t.op in variable_ops or (t.op.type in ('Identity', 'ReadVariableOp') and t.op.inputs and t.op.inputs[0].op in variable_ops):
+        reads.append(t)
+  return reads
+
+def _copy_ops(ops, replacements):
+  """Copy `ops` into the current name scope, with inputs remapped through `replacements`."""
+  graph = tf.get_default_graph()
+  mapping = dict(replacements)
+  for op in ops:
+    with tf.device(op.device):
+      new_op = graph.create_op(op.type, [mapping.get(t, t) for t in op.inputs],
+                               [t.dtype for t in op.outputs],
+                               name=op.name.split('/')[-1],
+                               attrs=dict(op.node_def.attr),
+                               op_def=op.op_def)
+    for t, new_t in zip(op.outputs, new_op.outputs):
+      mapping[t] = new_t
+  return mapping
+
+def recompute_grad(fn):
+  """Wrap `fn(inputs) -> outputs`, both single tensors, so backprop keeps only `inputs`.
+
+  The activations inside `fn` are freed after the forward pass, the gradients are computed
+  from a copy of its ops rebuilt from `inputs` once backprop reaches `outputs`. Batch norm
+  moving average updates are not copied; `fn` must be deterministic (no dropout).
+  """
+  def wrapped(inputs):
+    outputs = fn(inputs)
+    ops = _subgraph_ops(inputs, outputs)
+    variables = _variable_reads(ops)
+
+    grad_name = 'RecomputeGrad_{}'.format(next(_grad_uid))
+
+    @tf.RegisterGradient(grad_name)
+    def _recompute_grad(op, *grads):
+      output_grad = grads[-1]
+      # recompute only when needed, so the copies are not alive during the forward pass
+      with tf.control_dependencies([output_grad]):
+        recompute_inputs = tf.identity(inputs)
+      with tf.name_scope('recompute'):
+        recomputed = _copy_ops(ops, {inputs: recompute_inputs})[outputs]
+      input_grads = tf.gradients(recomputed, [recompute_inputs] + variables, grad_ys=output_grad)
+      return input_grads + [None]
+
+    # the forward ops get no gradient through this op, so their outputs are not kept for backprop
+    with tf.get_default_graph().gradient_override_map({'IdentityN': grad_name}):
+      return tf.identity_n([inputs] + variables + [outputs])[-1]
+  return wrapped
@@ -34,6 +34,8 @@ from __future__ import print_function
 
 import tensorflow as tf
 
+from .recompute import recompute_grad
+
 _BATCH_NORM_DECAY = 0.997
 _BATCH_NORM_EPSILON = 1e-5
 
@@ -185,7 +187,7 @@ def bottleneck_block(inputs, filters, is_training, projection_shortcut,
 
 
 def block_layer(inputs, filters, block_fn, blocks, strides, is_training, name,
-                data_format):
+                data_format, recompute=False):
   """Creates one layer of blocks for the ResNet model.
 
   Args:
@@ -201,6 +203,8 @@ def block_layer(inputs, filters, block_fn, blocks, strides, is_training, name,
       model. Needed for batch norm.
     name: A string name for the tensor output of the block layer.
     data_format: The input format ('channels_last' or 'channels_first').
+    recompute: Whether to recompute the activations inside each block during
+      backprop instead of keeping them, see net/recompute.py.
 
   Returns:
     The output tensor of the block layer.
@@ -213,12 +217,15 @@ def block_layer(inputs, filters, block_fn, blocks, strides, is_training, name,
         inputs=inputs, filters=filters_out, kernel_size=1, strides=strides,
         data_format=data_format)
 
+  def run_block(block):
+    return recompute_grad(block) if recompute else block
+
   # Only the first block per block_layer uses projection_shortcut and strides
-  inputs = block_fn(inputs, filters, is_training, projection_shortcut, strides,
-                    data_format)
+  inputs = run_block(lambda inputs: block_fn(inputs, filters, is_training, projection_shortcut, strides,
+                    data_format))(inputs)
 
   for _ in range(1, blocks):
-    inputs = block_fn(inputs, filters, is_training, None, 1, data_format)
+    inputs = run_block(lambda inputs: block_fn(inputs, filters, is_training, None, 1, data_format))(inputs)
 
   return tf.identity(inputs, name)
 
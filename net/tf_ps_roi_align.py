@@ -0,0 +1,139 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Pure TensorFlow version of the PsRoiAlign op in cpp/PSROIPooling, used when
+libps_roi_align.so is not available. The gradient is derived by TensorFlow.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+_FLT_MIN = float(np.finfo(np.float32).tiny)
+
+def ps_roi_align(inputs, rois, grid_dim_width, grid_dim_height, pool_method, name=None):
+    '''Same inputs and outputs as op_module.ps_roi_align.
+
+    Args:
+        inputs: feature map in 'NCHW' format, the channels are grid_dim_height x grid_dim_width banks.
+        rois: batch_size x num_rois x 4, [center_y, center_x, h, w] relative to the feature map.
+        pool_method: 'max' or 'mean' over the samples of each bin.
+    Return:
+        pooled features and index of the max sample in each bin (zeros for 'mean'), both
+        batch_size x num_rois x (grid_dim_height * grid_dim_width) x bank_size.
+
+    Like the custom op, each bin of a roi samples (int(bin_size) + 1) points along each
+    side with bilinear interpolation. Rois have different numbers of samples, so all of
+    them are sampled on the largest grid and the extra points are masked out.
+    '''
+    with tf.name_scope(name, 'tf_ps_roi_align', [inputs, rois]):
+        inputs = tf.convert_to_tensor(inputs, dtype=tf.float32)
+        rois = tf.convert_to_tensor(rois, dtype=tf.float32)
+        grid_size = grid_dim_width * grid_dim_height
+
+        inputs_shape = tf.shape(inputs)
+        batch_size, num_channals, map_height, map_width = inputs_shape[0], inputs_shape[1], inputs_shape[2], inputs_shape[3]
+        num_rois = tf.shape(rois)[1]
+        bank_size = num_channals // grid_size
+        height = tf.cast(map_height, tf.float32)
+        width = tf.cast(map_width, tf.float32)
+
+        roi_y_center, roi_x_center, roi_h, roi_w = tf.unstack(rois, axis=-1)
+        valid_mask = tf.logical_and(roi_h >= _FLT_MIN, roi_w >= _FLT_MIN)
+        roi_y_center = roi_y_center * height
+        roi_x_center = roi_x_center * width
+        roi_h = tf.maximum(roi_h * height, 1.)
+        roi_w = tf.maximum(roi_w * width, 1.)
+        roi_ymin = tf.maximum(roi_y_center - roi_h / 2., 0.)
+        roi_xmin = tf.maximum(roi_x_center - roi_w / 2., 0.)
+        # map_height - FLT_MIN in the op, which is map_height in float32
+        roi_ymax = tf.minimum(roi_y_center + roi_h / 2., height)
+        roi_xmax = tf.minimum(roi_x_center + roi_w / 2., width)
+
+        pool_bin_height = (roi_ymax - roi_ymin) / grid_dim_height
+        pool_bin_width = (roi_xmax - roi_xmin) / grid_dim_width
+        num_elem_height = tf.cast(pool_bin_height, tf.int32) + 1
+        num_elem_width = tf.cast(pool_bin_width, tf.int32) + 1
+        step_height = pool_bin_height / tf.cast(num_elem_height, tf.float32)
+        step_width = pool_bin_width / tf.cast(num_elem_width, tf.float32)
+        max_elem_height = tf.maximum(tf.reduce_max(tf.where(valid_mask, num_elem_height, tf.ones_like(num_elem_height))), 1)
+        max_elem_width = tf.maximum(tf.reduce_max(tf.where(valid_mask, num_elem_width, tf.ones_like(num_elem_width))), 1)
+
+        def sample_coords(roi_min, pool_bin, step, num_elem, grid_dim, max_elem, size):
+            # batch_size x num_rois x grid_dim x max_elem
+            expand = lambda t : tf.expand_dims(tf.expand_dims(t, -1), -1)
+            grid_ind = tf.reshape(tf.range(grid_dim, dtype=tf.float32), [1, 1, -1, 1])
+            elem_ind = tf.reshape(tf.range(max_elem), [1, 1, 1, -1])
+            coords = expand(roi_min) + expand(pool_bin) * grid_ind + expand(step) * tf.cast(elem_ind, tf.float32) + expand(step) / 2.
+            mask = tf.less(elem_ind, expand(num_elem))
+            int_coords = tf.minimum(tf.cast(coords, tf.int32), size - 1)
+            frac_coords = coords - tf.cast(int_coords, tf.float32)
+            return int_coords, tf.minimum(int_coords + 1, size - 1), frac_coords, mask
+
+        int_rows, next_rows, frac_rows, mask_rows = sample_coords(roi_ymin, pool_bin_height, step_height, num_elem_height, grid_dim_height, max_elem_height, map_height)
+        int_cols, next_cols, frac_cols, mask_cols = sample_coords(roi_xmin, pool_bin_width, step_width, num_elem_width, grid_dim_width, max_elem_width, map_width)
+
+        # all samples are batch_size x num_rois x grid_dim_height x grid_dim_width x max_elem_height x max_elem_width
+        rows_to_sample = lambda t : tf.expand_dims(tf.expand_dims(t, 3), -1)
+        cols_to_sample = lambda t : tf.expand_dims(tf.expand_dims(t, 2), 4)
+
+        # position sensitive gather: the bank of bin (i, j) at pixel (y, x) is one row of
+        # the feature map reshaped to (batch_size * height * width * grid_size) x bank_size
+        flat_features = tf.reshape(tf.transpose(inputs[:, :grid_size * bank_size, :, :], [0, 2, 3, 1]), [-1, bank_size])
+        batch_ind = tf.reshape(tf.range(batch_size), [-1, 1, 1, 1, 1, 1])
+        position_ind = tf.reshape(tf.range(grid_size), [1, 1, grid_dim_height, grid_dim_width, 1, 1])
+        def gather(rows, cols):
+            return tf.gather(flat_features, ((batch_ind * map_height + rows_to_sample(rows)) * map_width + cols_to_sample(cols)) * grid_size + position_ind)
+
+        frac_y = tf.expand_dims(rows_to_sample(frac_rows), -1)
+        frac_x = tf.expand_dims(cols_to_sample(frac_cols), -1)
+        samples = (1. - frac_x) * (1. - frac_y) * gather(int_rows, int_cols) + \
+                    (1. - frac_x) * frac_y * gather(next_rows, int_cols) + \
+                    frac_x * (1. - frac_y) * gather(int_rows, next_cols) + \
+                    frac_x * frac_y * gather(next_rows, next_cols)
+
+        # the number of samples only depends on the roi, broadcast the mask to all bins and channels
+        sample_mask = tf.cast(tf.logical_and(rows_to_sample(mask_rows), cols_to_sample(mask_cols)), tf.float32)
+        sample_mask = tf.expand_dims(sample_mask, -1) * tf.ones_like(samples)
+        # merge the sample axes, batch_size x num_rois x grid_h x grid_w x num_samples x bank_size
+        num_samples = max_elem_height * max_elem_width
+        pooled_shape = [batch_size, num_rois, grid_dim_height, grid_dim_width, num_samples, bank_size]
+        samples = tf.reshape(samples, pooled_shape)
+        sample_mask = tf.reshape(sample_mask, pooled_shape)
+
+        if 'max' in pool_method:
+            max_ind = tf.argmax(tf.where(sample_mask > 0., samples, tf.fill(tf.shape(samples), np.finfo(np.float32).min)), axis=4, output_type=tf.int32)
+            # select with one_hot so only the max sample gets the gradient, as in the op
+            pooled_features = tf.reduce_sum(samples * tf.one_hot(max_ind, num_samples, axis=4, dtype=tf.float32), axis=4)
+            expand_roi = lambda t : tf.reshape(t, [batch_size, num_rois, 1, 1, 1])
+            pooled_index = (max_ind // max_elem_width) * expand_roi(num_elem_width) + max_ind % max_elem_width
+        elif 'mean' in pool_method:
+            num_elem = tf.cast(num_elem_height * num_elem_width, tf.float32)
+            pooled_features = tf.reduce_sum(samples * sample_mask, axis=4) / tf.reshape(num_elem, [batch_size, num_rois, 1, 1, 1])
+            pooled_index = tf.zeros(tf.shape(pooled_features), dtype=tf.int32)
+        else:
+            raise ValueError('Need pool_method to be either "mean" or "max", got {}'.format(pool_method))
+
+        output_shape = [batch_size, num_rois, grid_size, bank_size]
+        valid_mask = tf.reshape(valid_mask, [batch_size, num_rois, 1, 1])
+        pooled_features = tf.reshape(pooled_features, output_shape) * tf.cast(valid_mask, tf.float32)
+        pooled_index = tf.reshape(pooled_index, output_shape) * tf.cast(valid_mask, tf.int32)
+
+        static_bank_size = inputs.get_shape()[1].value // grid_size if inputs.get_shape()[1].value is not None else None
+        static_shape = [inputs.get_shape()[0].value, rois.get_shape()[1].value, grid_size, static_bank_size]
+        pooled_features.set_shape(static_shape)
+        pooled_index.set_shape(static_shape)
+        return pooled_features, pooled_index
@@ -15,6 +15,7 @@
 import tensorflow as tf
 
 from . import resnet_v2
+from .recompute import recompute_grad
 from utility import eval_helper
 
 USE_FUSED_BN = True
@@ -181,24 +182,12 @@ def _bboxes_clip(bbox_ref, bboxes, scope=None):
         bboxes = tf.transpose(tf.stack([ymin, xmin, ymax, xmax], axis=0))
         return bboxes
 
-def _upsample_rois(scores, bboxes, keep_top_k):
-    # upsample with replacement
-    # filter out paddings
-    bboxes = tf.boolean_mask(bboxes, scores > 0.)
-    scores = tf.boolean_mask(scores, scores > 0.)
-
-    scores, bboxes = tf.cond(tf.less(tf.shape(scores)[0], 1), lambda: (tf.constant([1.]), tf.constant([[0.2, 0.2, 0.8, 0.8]])), lambda: (scores, bboxes))
-    #scores = tf.Print(scores,[scores])
-    def upsampel_impl():
-        num_bboxes = tf.shape(scores)[0]
-        left_count = keep_top_k - num_bboxes
-
-        select_indices = tf.random_shuffle(tf.range(num_bboxes))[:tf.floormod(left_count, num_bboxes)]
-        #### zero
-        select_indices = tf.concat([tf.tile(tf.range(num_bboxes), [tf.floor_div(left_count, num_bboxes) + 1]), select_indices], axis = 0)
-
-        return [tf.gather(scores, select_indices), tf.gather(bboxes, select_indices)]
-    return tf.cond(tf.shape(scores)[0] < keep_top_k, lambda : upsampel_impl(), lambda : [scores, bboxes])
+def _pad_rois(scores, bboxes, keep_top_k):
+    # move the rois left by nms to the front and zero pad the rest, instead of upsampling them
+    valid_mask = scores > 0.
+    bboxes = _pad_axis(tf.boolean_mask(bboxes, valid_mask), 0, keep_top_k)
+    scores = _pad_axis(tf.boolean_mask(scores, valid_mask), 0, keep_top_k)
+    return scores, bboxes, scores > 0.
 
 def _point2center(proposals_bboxes):
     ymin, xmin, ymax, xmax = proposals_bboxes[:, :, 0], proposals_bboxes[:, :, 1], proposals_bboxes[:, :, 2], proposals_bboxes[:, :, 3]
@@ -221,12 +210,16 @@ def relu_separable_bn_block(inputs, filters, name_prefix, is_training, data_form
                             epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
     return inputs
 
-def XceptionBody(input_image, num_classes, is_training = False, data_format='channels_last'):
+def XceptionBody(input_image, num_classes, is_training = False, data_format='channels_last', recompute_blocks = ()):
     # one question: is there problems with the unaligned 'valid-conv' when mapping ROI from input image to last feature maps
 
     # modify the input size to 481
     bn_axis = -1 if data_format == 'channels_last' else 1
 
+    def run_block(name, block):
+        # the residual blocks in recompute_blocks, e.g. 'block5', keep only their input for backprop
+        return recompute_grad(block) if is_training and name in recompute_blocks else block
+
     # (481-3+0*2)/2 + 1 = 240
     inputs = tf.layers.conv2d(input_image, 32, (3, 3), use_bias=False, name='block1_conv1', strides=(2, 2),
                 padding='valid', data_format=data_format, activation=None,
@@ -245,94 +238,107 @@ def XceptionBody(input_image, num_classes, is_training = False, data_format='cha
                             epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
     inputs = tf.nn.relu(inputs, name='block1_conv2_act')
 
-    # (238-1+0*2)/2 + 1 = 119
-    residual = tf.layers.conv2d(inputs, 128, (1, 1), use_bias=False, name='conv2d_1', strides=(2, 2),
-                padding='same', data_format=data_format, activation=None,
-                kernel_initializer=conv_bn_initializer_to_use(),
-                bias_initializer=tf.zeros_initializer())
-    residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_1', axis=bn_axis,
-                            epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
-
-    inputs = tf.layers.separable_conv2d(inputs, 128, (3, 3),
-                        strides=(1, 1), padding='same',
-                        data_format=data_format,
-                        activation=None, use_bias=False,
-                        depthwise_initializer=conv_bn_initializer_to_use(),
-                        pointwise_initializer=conv_bn_initializer_to_use(),
-                        bias_initializer=tf.zeros_initializer(),
-                        name='block2_sepconv1', reuse=None)
-    inputs = tf.layers.batch_normalization(inputs, momentum=BN_MOMENTUM, name='block2_sepconv1_bn', axis=bn_axis,
-                            epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
-
-    inputs = relu_separable_bn_block(inputs, 128, 'block2_sepconv2', is_training, data_format)
-    # (238-3+1*2)/2 + 1 = 119
-    inputs = tf.layers.max_pooling2d(inputs, pool_size=(3, 3), strides=(2, 2),
-                                    padding='same', data_format=data_format,
-                                    name='block2_pool')
-    # 119
-    inputs = inputs + residual
+    def block2(inputs):
+        # (238-1+0*2)/2 + 1 = 119
+        residual = tf.layers.conv2d(inputs, 128, (1, 1), use_bias=False, name='conv2d_1', strides=(2, 2),
+                    padding='same', data_format=data_format, activation=None,
+                    kernel_initializer=conv_bn_initializer_to_use(),
+                    bias_initializer=tf.zeros_initializer())
+        residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_1', axis=bn_axis,
+                                epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
+
+        inputs = tf.layers.separable_conv2d(inputs, 128, (3, 3),
+                            strides=(1, 1), padding='same',
+                            data_format=data_format,
+                            activation=None, use_bias=False,
+                            depthwise_initializer=conv_bn_initializer_to_use(),
+                            pointwise_initializer=conv_bn_initializer_to_use(),
+                            bias_initializer=tf.zeros_initializer(),
+                            name='block2_sepconv1', reuse=None)
+        inputs = tf.layers.batch_normalization(inputs, momentum=BN_MOMENTUM, name='block2_sepconv1_bn', axis=bn_axis,
+                                epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
+
+        inputs = relu_separable_bn_block(inputs, 128, 'block2_sepconv2', is_training, data_format)
+        # (238-3+1*2)/2 + 1 = 119
+        inputs = tf.layers.max_pooling2d(inputs, pool_size=(3, 3), strides=(2, 2),
+                                        padding='same', data_format=data_format,
+                                        name='block2_pool')
+        # 119
+        return inputs + residual
+    inputs = run_block('block2', block2)(inputs)
 
     #inputs = tf.Print(inputs,[tf.shape(inputs), inputs,residual])
 
-    # (119-1+0*2)/2 + 1 = 60
-    residual = tf.layers.conv2d(inputs, 256, (1, 1), use_bias=False, name='conv2d_2', strides=(2, 2),
-                padding='same', data_format=data_format, activation=None,
-                kernel_initializer=conv_bn_initializer_to_use(),
-                bias_initializer=tf.zeros_initializer())
-    residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_2', axis=bn_axis,
-                            epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
-
-    inputs = relu_separable_bn_block(inputs, 256, 'block3_sepconv1', is_training, data_format)
-    inputs = relu_separable_bn_block(inputs, 256, 'block3_sepconv2', is_training, data_format)
-
-    # (119-3+1*2)/2 + 1 = 60
-    inputs = tf.layers.max_pooling2d(inputs, pool_size=(3, 3), strides=(2, 2),
-                                    padding='same', data_format=data_format,
-                                    name='block3_pool')
-    # 60
-    inputs = inputs + residual
-
-    # (119-1+0*2)/2 + 1 = 30
-    residual = tf.layers.conv2d(inputs, 728, (1, 1), use_bias=False, name='conv2d_3', strides=(2, 2),
-                padding='same', data_format=data_format, activation=None,
-                kernel_initializer=conv_bn_initializer_to_use(),
-                bias_initializer=tf.zeros_initializer())
-    residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_3', axis=bn_axis,
-                            epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
-
-    inputs = relu_separable_bn_block(inputs, 728, 'block4_sepconv1', is_training, data_format)
-    inputs = relu_separable_bn_block(inputs, 728, 'block4_sepconv2', is_training, data_format)
-
-    # (119-3+1*2)/2 + 1 = 30
-    inputs = tf.layers.max_pooling2d(inputs, pool_size=(3, 3), strides=(2, 2),
-                                    padding='same', data_format=data_format,
-                                    name='block4_pool')
-    # 30
-    inputs = inputs + residual
+    def block3(inputs):
+        # (119-1+0*2)/2 + 1 = 60
+        residual = tf.layers.conv2d(inputs, 256, (1, 1), use_bias=False, name='conv2d_2', strides=(2, 2),
+                    padding='same', data_format=data_format, activation=None,
+                    kernel_initializer=conv_bn_initializer_to_use(),
+                    bias_initializer=tf.zeros_initializer())
+        residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_2', axis=bn_axis,
+                                epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
+
+        inputs = relu_separable_bn_block(inputs, 256, 'block3_sepconv1', is_training, data_format)
+        inputs = relu_separable_bn_block(inputs, 256, 'block3_sepconv2', is_training, data_format)
+
+        # (119-3+1*2)/2 + 1 = 60
+        inputs = tf.layers.max_pooling2d(inputs, pool_size=(3, 3), strides=(2, 2),
+                                        padding='same', data_format=data_format,
+                                        name='block3_pool')
+        # 60
+        return inputs + residual
+    inputs = run_block('block3', block3)(inputs)
+
+    def block4(inputs):
+        # (119-1+0*2)/2 + 1 = 30
+        residual = tf.layers.conv2d(inputs, 728, (1, 1), use_bias=False, name='conv2d_3', strides=(2, 2),
+                    padding='same', data_format=data_format, activation=None,
+                    kernel_initializer=conv_bn_initializer_to_use(),
+                    bias_initializer=tf.zeros_initializer())
+        residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_3', axis=bn_axis,
+                                epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
+
+        inputs = relu_separable_bn_block(inputs, 728, 'block4_sepconv1', is_training, data_format)
+        inputs = relu_separable_bn_block(inputs, 728, 'block4_sepconv2', is_training, data_format)
+
+        # (119-3+1*2)/2 + 1 = 30
+        inputs = tf.layers.max_pooling2d(inputs, pool_size=(3, 3), strides=(2, 2),
+                                        padding='same', data_format=data_format,
+                                        name='block4_pool')
+        # 30
+        return inputs + residual
+    inputs = run_block('block4', block4)(inputs)
+
+    def middle_block(prefix):
+        def block(inputs):
+            residual = inputs
+
+            inputs = relu_separable_bn_block(inputs, 728, prefix + '_sepconv1', is_training, data_format)
+            inputs = relu_separable_bn_block(inputs, 728, prefix + '_sepconv2', is_training, data_format)
+            inputs = relu_separable_bn_block(inputs, 728, prefix + '_sepconv3', is_training, data_format)
+
+            return inputs + residual
+        return block
 
     for index in range(8):
-        residual = inputs
         prefix = 'block' + str(index + 5)
-
-        inputs = relu_separable_bn_block(inputs, 728, prefix + '_sepconv1', is_training, data_format)
-        inputs = relu_separable_bn_block(inputs, 728, prefix + '_sepconv2', is_training, data_format)
-        inputs = relu_separable_bn_block(inputs, 728, prefix + '_sepconv3', is_training, data_format)
-
-        inputs = inputs + residual
+        inputs = run_block(prefix, middle_block(prefix))(inputs)
 
     mid_outputs = tf.nn.relu(inputs, name='before_block13_act')
-    # remove stride 2 for the residual connection
-    residual = tf.layers.conv2d(inputs, 1024, (1, 1), use_bias=False, name='conv2d_4', strides=(1, 1),
-                padding='same', data_format=data_format, activation=None,
-                kernel_initializer=conv_bn_initializer_to_use(),
-                bias_initializer=tf.zeros_initializer())
-    residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_4', axis=bn_axis,
-                            epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
-
-    inputs = relu_separable_bn_block(inputs, 728, 'block13_sepconv1', is_training, data_format)
-    inputs = relu_separable_bn_block(inputs, 1024, 'block13_sepconv2', is_training, data_format)
-
-    inputs = inputs + residual
+    def block13(inputs):
+        # remove stride 2 for the residual connection
+        residual = tf.layers.conv2d(inputs, 1024, (1, 1), use_bias=False, name='conv2d_4', strides=(1, 1),
+                    padding='same', data_format=data_format, activation=None,
+                    kernel_initializer=conv_bn_initializer_to_use(),
+                    bias_initializer=tf.zeros_initializer())
+        residual = tf.layers.batch_normalization(residual, momentum=BN_MOMENTUM, name='batch_normalization_4', axis=bn_axis,
+                                epsilon=BN_EPSILON, training=is_training, reuse=None, fused=USE_FUSED_BN)
+
+        inputs = relu_separable_bn_block(inputs, 728, 'block13_sepconv1', is_training, data_format)
+        inputs = relu_separable_bn_block(inputs, 1024, 'block13_sepconv2', is_training, data_format)
+
+        return inputs + residual
+    inputs = run_block('block13', block13)(inputs)
     # use atrous algorithm at last two conv
     inputs = tf.layers.separable_conv2d(inputs, 1536, (3, 3),
                         strides=(1, 1), dilation_rate=(2, 2), padding='same',
@@ -400,7 +406,7 @@ def get_proposals(object_score, bboxes_pred, encode_fn, rpn_pre_nms_top_n, rpn_p
     4. sort all (proposal, score) pairs by score from highest to lowest
     5. take top pre_nms_topN rois before NMS
     6. apply NMS with threshold 0.7 to remaining rois
-    7. take after_nms_topN rois after NMS (if number of bboxes if less than after_nms_topN, the upsample them)
+    7. take after_nms_topN rois after NMS (if number of bboxes if less than after_nms_topN, zero pad them and mask them out)
     8. take both the top rois and all the ground truth bboxes as all_rois
     9. rematch all_rois to get regress and classification target
     10.sample all_rois as proposals
@@ -412,21 +418,20 @@ def get_proposals(object_score, bboxes_pred, encode_fn, rpn_pre_nms_top_n, rpn_p
     # object_score.set_shape([None, rpn_pre_nms_top_n])
     # bboxes_pred.set_shape([None, rpn_pre_nms_top_n, 4])
     object_score, bboxes_pred = tf.map_fn(lambda _score_bboxes : _bboxes_nms(_score_bboxes[0], _score_bboxes[1], nms_threshold = nms_threshold, keep_top_k=rpn_post_nms_top_n, mode = 'union'), [object_score, bboxes_pred], back_prop=False)#, dtype=[tf.float32, tf.float32], infer_shape=True
-    # padding to fix the size of rois
-    # the object_score is not in descending order when the upsample padding happened
+    # padding to fix the size of rois, the mask marks the real ones
     #object_score = tf.Print(object_score, [object_score[0],object_score[1],object_score[2],object_score[3]], message='object_score0:', summarize=1000)
     #bboxes_pred = tf.Print(bboxes_pred, [bboxes_pred[0],bboxes_pred[1],bboxes_pred[2],bboxes_pred[3]], message='bboxes_pred0:', summarize=1000)
-    object_score, bboxes_pred = tf.map_fn(lambda _score_bboxes : _upsample_rois(_score_bboxes[0], _score_bboxes[1], keep_top_k= rpn_post_nms_top_n), [object_score, bboxes_pred], back_prop=False)
+    object_score, bboxes_pred, rois_mask = tf.map_fn(lambda _score_bboxes : _pad_rois(_score_bboxes[0], _score_bboxes[1], keep_top_k= rpn_post_nms_top_n), [object_score, bboxes_pred], dtype=(tf.float32, tf.float32, tf.bool), back_prop=False)
     # match and sample to get proposals and targets
     #print(encode_fn(bboxes_pred))
     # object_score = tf.Print(object_score, [object_score[0],object_score[1],object_score[2],object_score[3]], message='object_score1:', summarize=1000)
     # bboxes_pred = tf.Print(bboxes_pred, [bboxes_pred[0],bboxes_pred[1],bboxes_pred[2],bboxes_pred[3]], message='bboxes_pred1:', summarize=1000)
     if not is_training:
-        return tf.stop_gradient(bboxes_pred)
+        return tf.stop_gradient(bboxes_pred), rois_mask
 
-    proposals_bboxes, proposals_targets, proposals_labels, proposals_scores = encode_fn(bboxes_pred)
+    proposals_bboxes, proposals_targets, proposals_labels, proposals_scores, proposals_mask = encode_fn(bboxes_pred, rois_mask)
 
-    return tf.stop_gradient(proposals_bboxes), tf.stop_gradient(proposals_targets), tf.stop_gradient(proposals_labels), tf.stop_gradient(proposals_scores)
+    return tf.stop_gradient(proposals_bboxes), tf.stop_gradient(proposals_targets), tf.stop_gradient(proposals_labels), tf.stop_gradient(proposals_scores), proposals_mask
 
 def large_sep_kernel(net_input, depth_mid, depth_output, is_training, data_format, var_scope):
   with tf.variable_scope(var_scope):
@@ -455,7 +460,10 @@ def large_sep_kernel(net_input, depth_mid, depth_output, is_training, data_forma
 
     return resnet_v2.batch_norm_relu(branch_0b + branch_1b, is_training, data_format)
 
-def get_head(net_input, pooling_op, grid_width, grid_height, loss_func, proposals_bboxes, num_classes, is_training, using_ohem, ohem_roi_one_image, data_format, var_scope):
+def get_head(net_input, pooling_op, grid_width, grid_height, loss_func, proposals_bboxes, num_classes, is_training, using_ohem, ohem_roi_one_image, data_format, var_scope, proposals_mask=None):
+    '''proposals_mask: batch x num_rois, the real rois come first in each image and the padded ones are masked out,
+    only the real ones are pooled and fed into the fc layers, the outputs of the padded ones are zeros.
+    '''
     # proposals_bboxes = tf.Print(proposals_bboxes, [tf.shape(proposals_bboxes), proposals_bboxes])
     with tf.variable_scope(var_scope):
         # two pooling op here in original r-fcn
@@ -471,74 +479,78 @@ def get_head(net_input, pooling_op, grid_width, grid_height, loss_func, proposal
         #                           data_format=data_format)
         # {num_per_batch, num_rois, grid_size, bank_size}
 
-        yxhw_bboxes = _point2center(proposals_bboxes)
+        if proposals_mask is None:
+            proposals_mask = tf.ones(tf.shape(proposals_bboxes)[:2], dtype=tf.bool)
+        output_shape = tf.shape(proposals_mask, out_type=tf.int64)
+        # pool only up to the last real roi of the fullest image
+        num_pooled = tf.reduce_max(tf.reduce_sum(tf.cast(proposals_mask, tf.int32), axis=-1))
+        valid_indices = tf.where(proposals_mask[:, :num_pooled])
+
+        yxhw_bboxes = _point2center(proposals_bboxes[:, :num_pooled])
         if data_format == 'channels_last':
             net_input = tf.transpose(net_input, [0, 3, 1, 2])
 
         psroipooled_rois, _ = pooling_op(net_input, yxhw_bboxes, grid_width, grid_height)
 
-        psroipooled_rois = tf.map_fn(lambda pooled_feat: tf.reshape(pooled_feat, [-1, 10 * grid_width * grid_height]), psroipooled_rois)
-        #psroipooled_rois = tf.reshape(psroipooled_rois, [-1, proposals_labels.get_shape().as_list()[-1], 10 * grid_width * grid_height])
+        # batch x num_pooled x feature_size
+        psroipooled_rois = tf.reshape(psroipooled_rois, [tf.shape(psroipooled_rois)[0], num_pooled, 10 * grid_width * grid_height])
 
-        select_indices = None
+        def fc_layers(features, reuse):
+            subnet_fc_feature = tf.layers.dense(features, 2048,
+                                        activation=tf.nn.relu,
+                                        use_bias=True,
+                                        kernel_initializer=initializer_to_use(),
+                                        bias_initializer=tf.zeros_initializer(),
+                                        name='subnet_fc', reuse=reuse)
 
-        if using_ohem:
-            subnet_fc_feature = tf.layers.dense(psroipooled_rois, 2048,
-                                    activation=tf.nn.relu,
-                                    use_bias=True,
-                                    kernel_initializer=initializer_to_use(),
-                                    bias_initializer=tf.zeros_initializer(),
-                                    name='subnet_fc', reuse=False)
             cls_score = tf.layers.dense(subnet_fc_feature, num_classes,
                                         activation=None,
                                         use_bias=True,
                                         kernel_initializer=initializer_to_use(),
                                         bias_initializer=tf.zeros_initializer(),
-                                        name='fc_cls', reuse=False)
+                                        name='fc_cls', reuse=reuse)
             bboxes_reg = tf.layers.dense(subnet_fc_feature, 4,
                                         activation=None,
                                         use_bias=True,
                                         kernel_initializer=initializer_to_use(),
                                         bias_initializer=tf.zeros_initializer(),
-                                        name='fc_loc', reuse=False)
+                                        name='fc_loc', reuse=reuse)
+            return cls_score, bboxes_reg
+
+        # only the real rois go through the fc layers, the outputs are scattered back to batch x num_rois
+        cls_score, bboxes_reg = fc_layers(tf.gather_nd(psroipooled_rois, valid_indices), None)
+        if using_ohem:
+            # the ranking pass has no backward pass
+            cls_score, bboxes_reg = tf.stop_gradient(cls_score), tf.stop_gradient(bboxes_reg)
+        cls_score = tf.scatter_nd(valid_indices, cls_score, tf.concat([output_shape, tf.constant([num_classes], dtype=tf.int64)], axis=0))
+        bboxes_reg = tf.scatter_nd(valid_indices, bboxes_reg, tf.concat([output_shape, tf.constant([4], dtype=tf.int64)], axis=0))
+
+        select_indices = None
+        roi_weights = tf.cast(proposals_mask, tf.float32)
+
+        if using_ohem:
+            # rank the rois by the loss of the forward pass, then run the fc layers again on the hardest ones,
+            # so the backward pass only covers the selected rois
             # the input of loss_func is (batch, num_rois, num_classes), (batch, num_rois, 4)
             # the output should be (batch, num_rois)
-            ohem_loss = loss_func(tf.stop_gradient(cls_score), tf.stop_gradient(bboxes_reg), None)
+            ohem_loss = loss_func(cls_score, bboxes_reg, None)[:, :num_pooled]
+            # padded rois are ranked last
+            ohem_loss = tf.where(proposals_mask[:, :num_pooled], ohem_loss, -tf.ones_like(ohem_loss))
 
-            ohem_select_num = tf.minimum(ohem_roi_one_image, tf.shape(ohem_loss)[1])
+            ohem_select_num = tf.minimum(ohem_roi_one_image, num_pooled)
 
             _, select_indices = tf.nn.top_k(ohem_loss, k=ohem_select_num)
+            # [batch index, roi index] pairs, batch x ohem_select_num x 2
+            batch_indices = tf.tile(tf.expand_dims(tf.range(tf.shape(select_indices)[0]), -1), [1, ohem_select_num])
+            select_indices = tf.stop_gradient(tf.stack([batch_indices, select_indices], axis=-1))
+
+            cls_score, bboxes_reg = fc_layers(tf.gather_nd(psroipooled_rois, select_indices), True)
+            roi_weights = tf.gather_nd(roi_weights, select_indices)
 
-            select_indices = tf.stop_gradient(select_indices)
-
-            psroipooled_rois = tf.gather(psroipooled_rois, select_indices, axis=1)
-
-            # proposals_bboxes = tf.gather(proposals_bboxes, select_indices, axis=1)
-            # proposals_targets = tf.gather(proposals_targets, select_indices, axis=1)
-            # proposals_labels = tf.gather(proposals_labels, select_indices, axis=1)
-            # proposals_scores = tf.gather(proposals_scores, select_indices, axis=1)
-
-        subnet_fc_feature = tf.layers.dense(psroipooled_rois, 2048,
-                                    activation=tf.nn.relu,
-                                    use_bias=True,
-                                    kernel_initializer=initializer_to_use(),
-                                    bias_initializer=tf.zeros_initializer(),
-                                    name='subnet_fc', reuse=using_ohem)
-
-        cls_score = tf.layers.dense(subnet_fc_feature, num_classes,
-                                    activation=None,
-                                    use_bias=True,
-                                    kernel_initializer=initializer_to_use(),
-                                    bias_initializer=tf.zeros_initializer(),
-                                    name='fc_cls', reuse=using_ohem)
-        bboxes_reg = tf.layers.dense(subnet_fc_feature, 4,
-                                    activation=None,
-                                    use_bias=True,
-                                    kernel_initializer=initializer_to_use(),
-                                    bias_initializer=tf.zeros_initializer(),
-                                    name='fc_loc', reuse=using_ohem)
-
-        return tf.reduce_mean(loss_func(cls_score, bboxes_reg, select_indices)) if is_training else (cls_score, bboxes_reg)
+        if not is_training:
+            return cls_score, bboxes_reg
+        # mean over the real rois
+        return tf.reduce_sum(loss_func(cls_score, bboxes_reg, select_indices) * roi_weights) / tf.maximum(tf.reduce_sum(roi_weights), 1.)
 
 
 
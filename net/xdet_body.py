@@ -20,6 +20,7 @@ import tensorflow as tf
 
 from . import resnet_v2
 from . import depth_conv2d
+from .recompute import recompute_grad
 
 #initializer_to_use = tf.glorot_uniform_initializer
 initializer_to_use = tf.glorot_normal_initializer
@@ -82,7 +83,7 @@ def xdet_bottleneck_block(inputs, filters, is_training, projection_shortcut,
 
 
 def xdet_block_layer(inputs, filters, block_fn, blocks, dilation_rate, is_training, name,
-                data_format):
+                data_format, recompute=False):
   """Creates one layer of blocks for the ResNet model.
 
   Args:
@@ -98,6 +99,8 @@ def xdet_block_layer(inputs, filters, block_fn, blocks, dilation_rate, is_traini
       model. Needed for batch norm.
     name: A string name for the tensor output of the block layer.
     data_format: The input format ('channels_last' or 'channels_first').
+    recompute: Whether to recompute the activations inside each block during
+      backprop instead of keeping them, see net/recompute.py.
 
   Returns:
     The output tensor of the block layer.
@@ -112,15 +115,18 @@ def xdet_block_layer(inputs, filters, block_fn, blocks, dilation_rate, is_traini
                             kernel_initializer=initializer_to_use(),
                             data_format=data_format)
 
+  def run_block(block):
+    return recompute_grad(block) if recompute else block
+
   # Only the first block per block_layer uses projection_shortcut and dilation_rate
-  inputs = block_fn(inputs, filters, is_training, projection_shortcut, dilation_rate, data_format)
+  inputs = run_block(lambda inputs: block_fn(inputs, filters, is_training, projection_shortcut, dilation_rate, data_format))(inputs)
 
   for _ in range(1, blocks):
-    inputs = block_fn(inputs, filters, is_training, None, dilation_rate, data_format)
+    inputs = run_block(lambda inputs: block_fn(inputs, filters, is_training, None, dilation_rate, data_format))(inputs)
 
   return tf.identity(inputs, name)
 
-def xdet_resnet_v2_generator(block_fn, layers, data_format=None):
+def xdet_resnet_v2_generator(block_fn, layers, data_format=None, recompute_layers=()):
   """Generator for X-Det ResNet v2 models.
 
   Args:
@@ -130,6 +136,8 @@ def xdet_resnet_v2_generator(block_fn, layers, data_format=None):
       layer. Each layer consists of blocks that take inputs of the same size.
     data_format: The input format ('channels_last', 'channels_first', or None).
       If set to None, the format is dependent on whether a GPU is available.
+    recompute_layers: The names of the block layers, e.g. 'block_layer3', whose
+      activations are recomputed during backprop when training.
 
   Returns:
     The model function that takes in `inputs` and `is_training` and
@@ -160,24 +168,29 @@ def xdet_resnet_v2_generator(block_fn, layers, data_format=None):
     inputs = resnet_v2.block_layer(
         inputs=inputs, filters=64, block_fn=block_fn, blocks=layers[0],
         strides=1, is_training=is_training, name='block_layer1',
-        data_format=data_format)
+        data_format=data_format,
+        recompute=is_training and 'block_layer1' in recompute_layers)
     inputs = resnet_v2.block_layer(
         inputs=inputs, filters=128, block_fn=block_fn, blocks=layers[1],
         strides=2, is_training=is_training, name='block_layer2',
-        data_format=data_format)
+        data_format=data_format,
+        recompute=is_training and 'block_layer2' in recompute_layers)
     output_conv4 = xdet_block_layer(
         inputs=inputs, filters=256, block_fn=xdet_bottleneck_block, blocks=layers[2],
         dilation_rate=2, is_training=is_training, name='block_layer3',
-        data_format=data_format)
+        data_format=data_format,
+        recompute=is_training and 'block_layer3' in recompute_layers)
     output_conv5 = xdet_block_layer(
         inputs=output_conv4, filters=512, block_fn=xdet_bottleneck_block, blocks=layers[3],
         dilation_rate=4, is_training=is_training, name='block_layer4',
-        data_format=data_format)
+        data_format=data_format,
+        recompute=is_training and 'block_layer4' in recompute_layers)
     with tf.variable_scope('xdet_additional_conv', default_name = None, values = [output_conv5], reuse=tf.AUTO_REUSE):
       output_conv6 = xdet_block_layer(
           inputs=output_conv5, filters=512, block_fn=xdet_bottleneck_block, blocks=layers[4],
           dilation_rate=8, is_training=is_training, name='block_layer5',
-          data_format=data_format)
+          data_format=data_format,
+          recompute=is_training and 'block_layer5' in recompute_layers)
     with tf.variable_scope('xdet_multi_path', default_name = None, values = [output_conv4, output_conv5, output_conv6], reuse=tf.AUTO_REUSE):
       output_conv4 = resnet_v2.batch_norm_relu(output_conv4, is_training, data_format)
       output_conv4 = tf.layers.conv2d(inputs=output_conv4, filters=256, kernel_size=1, strides=1,
@@ -290,7 +303,7 @@ def xdet_head(body_input, num_classes, num_anchors, is_training, data_format=Non
 
     return tf.identity(cls_outputs, 'class_module'), tf.identity(regress_outputs, 'location_module')
 
-def xdet_resnet_v2(resnet_size, data_format=None):
+def xdet_resnet_v2(resnet_size, data_format=None, recompute_layers=()):
   """Returns the ResNet model for a given size and number of output classes."""
   model_params = {
       18: {'block': resnet_v2.building_block, 'layers': [2, 2, 2, 2, 2]},
@@ -306,4 +319,4 @@ def xdet_resnet_v2(resnet_size, data_format=None):
 
   params = model_params[resnet_size]
   return xdet_resnet_v2_generator(
-      params['block'], params['layers'], data_format)
+      params['block'], params['layers'], data_format, recompute_layers)
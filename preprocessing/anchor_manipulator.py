@@ -310,22 +310,26 @@ class AnchorEncoder(object):
         #return ground_labels, anchor_regress_targets, ground_scores, len(self._anchors)
         return ground_labels, anchor_regress_targets, ground_scores, ground_bboxes, len(self._anchors)
 
-    def ext_encode_rois(self, all_rois, all_labels, all_bboxes, rois_per_image, fg_fraction, allowed_border, head_prior_scaling=[1., 1., 1., 1.]):
+    def ext_encode_rois(self, all_rois, all_labels, all_bboxes, rois_per_image, fg_fraction, allowed_border, head_prior_scaling=[1., 1., 1., 1.], all_rois_mask=None):
         '''Do encoder for rois from SS or RPN
         fg_fraction: the fraction of fg in total bboxes
+        all_rois_mask: the real rois of all_rois, None if all of them are real
+        the sampled rois of each image come first and are zero padded to rois_per_image, the returned mask marks the sampled ones
         '''
+        if all_rois_mask is None:
+            all_rois_mask = tf.ones(tf.shape(all_rois)[:2], dtype=tf.bool)
 
         #all_rois = tf.Print(all_rois, [all_rois], message='all_rois:')
         expected_num_fg_rois = tf.cast(tf.round(tf.cast(rois_per_image, tf.float32) * fg_fraction), tf.int32)
         #expected_num_bg_rois = rois_per_image - expected_num_fg_rois
-        def encode_impl(_rois, _labels, _bboxes):
+        def encode_impl(_rois, _labels, _bboxes, _mask):
             '''encode along batch
             '''
             _bboxes = tf.boolean_mask(_bboxes, _labels > 0)
             _labels = tf.boolean_mask(_labels, _labels > 0)
             #print(_labels)
             # we should first include all ground truth, then we match them all together
-            _rois = tf.concat([_rois, _bboxes], axis = 0)
+            _rois = tf.concat([tf.boolean_mask(_rois, _mask), _bboxes], axis = 0)
 
             ymin_, xmin_, ymax_, xmax_ = _rois[:, 0], _rois[:, 1], _rois[:, 2], _rois[:, 3]
 
@@ -377,13 +381,6 @@ class AnchorEncoder(object):
             total_labels = gt_labels
             total_scores = gt_scores
 
-            def upsampel_impl(now_count, need_count):
-                # sample with replacement
-                left_count = need_count - now_count
-                select_indices = tf.random_shuffle(tf.range(now_count))[:tf.floormod(left_count, now_count)]
-                select_indices = tf.concat([tf.tile(tf.range(now_count), [tf.floor_div(left_count, now_count) + 1]), select_indices], axis = 0)
-
-                return select_indices
             def downsample_impl(now_count, need_count):
                 # downsample with replacement
                 select_indices = tf.random_shuffle(tf.range(now_count))[:need_count]
@@ -414,11 +411,14 @@ class AnchorEncoder(object):
 
             keep_indices = tf.concat([fg_select_indices, bg_select_indices], axis = 0)
             n_keeps = tf.shape(keep_indices)[0]
-            # now n_keeps must be equal or less than rois_per_image
-            final_keep_indices = tf.cond(n_keeps < rois_per_image, lambda : tf.gather(keep_indices, upsampel_impl(n_keeps, rois_per_image)), lambda : keep_indices)
-
-            #print(tf.gather(total_rois, final_keep_indices), tf.gather(total_targets, final_keep_indices), tf.gather(total_labels, final_keep_indices), tf.gather(total_scores, final_keep_indices))
-            return tf.gather(total_rois, final_keep_indices), tf.gather(total_targets, final_keep_indices), tf.gather(total_labels, final_keep_indices), tf.gather(total_scores, final_keep_indices)
+            # now n_keeps must be equal or less than rois_per_image, zero pad the rest
+            num_padding = rois_per_image - n_keeps
+            def pad_keeps(x):
+                x = tf.gather(x, keep_indices)
+                return tf.pad(x, [[0, num_padding]] + [[0, 0]] * (len(x.get_shape()) - 1))
+
+            keep_mask = tf.range(rois_per_image) < n_keeps
+            return pad_keeps(total_rois), pad_keeps(total_targets), pad_keeps(total_labels), pad_keeps(total_scores), keep_mask
         # def encode_impl(_rois, _labels, _bboxes):
         #     '''encode along batch
         #     '''
@@ -609,7 +609,7 @@ class AnchorEncoder(object):
             # return tf.gather(total_rois, final_keep_indices), tf.gather(total_targets, final_keep_indices), tf.gather(total_labels, final_keep_indices), tf.gather(total_scores, final_keep_indices)
 
         #print(tf.map_fn(lambda  _rois_labels_bboxes: encode_impl(_rois_labels_bboxes[0], _rois_labels_bboxes[1], _rois_labels_bboxes[2]), (all_rois, all_labels, all_bboxes), dtype=(tf.float32, tf.float32, tf.int64, tf.float32)))
-        return tf.map_fn(lambda  _rois_labels_bboxes: encode_impl(_rois_labels_bboxes[0], _rois_labels_bboxes[1], _rois_labels_bboxes[2]), (all_rois, all_labels, all_bboxes), dtype=(tf.float32, tf.float32, tf.int64, tf.float32), back_prop=False)
+        return tf.map_fn(lambda  _rois_labels_bboxes: encode_impl(_rois_labels_bboxes[0], _rois_labels_bboxes[1], _rois_labels_bboxes[2], _rois_labels_bboxes[3]), (all_rois, all_labels, all_bboxes, all_rois_mask), dtype=(tf.float32, tf.float32, tf.int64, tf.float32, tf.bool), back_prop=False)
 
     # return a list, of which each is:
     #   shape: [feature_h, feature_w, num_anchors, 4]
@@ -0,0 +1,227 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Post-training eight bit quantization of a graph frozen by freeze_detector.py.
+
+The first --num_calibration_images images of the TFRecords are used to calibrate the
+activation ranges, the next --num_eval_images ones to compare the mAP and the CPU
+latency of the float and the quantized graphs.
+
+Example:
+    python freeze_detector.py --saved_model_dir=./export/1525340112 --output_graph=./xdet_frozen.pb
+    python quantize_detector.py --frozen_graph=./xdet_frozen.pb --output_graph=./xdet_int8.pb --data_dir=../PASCAL/VOC_TF/VOC2007TEST_TF/
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import time
+import itertools
+
+import numpy as np
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+dataset_factory = cli.lazy_import('dataset.dataset_factory')
+graph_optimizer = cli.lazy_import('utility.graph_optimizer')
+inference_server = cli.lazy_import('utility.inference_server')
+checkpoint_evaluator = cli.lazy_import('utility.checkpoint_evaluator')
+
+cli.flags.DEFINE_string(
+    'frozen_graph', './frozen_detector.pb',
+    'The float graph written by freeze_detector.py.')
+cli.flags.DEFINE_string(
+    'output_graph', './quantized_detector.pb',
+    'The quantized GraphDef to write, a "<output_graph>.report.json" is written beside it.')
+cli.flags.DEFINE_string(
+    'op_library', '',
+    'Comma separated custom op libraries to load before the model, e.g. "./libps_roi_align.so" for light-head models.')
+cli.flags.DEFINE_string(
+    'preprocessing_name', 'xdet_resnet',
+    'The eval preprocessing used by the exported model.')
+cli.flags.DEFINE_string(
+    'data_dir', '../PASCAL/VOC_TF/VOC2007TEST_TF/',
+    'The directory where the dataset input data is stored.')
+cli.flags.DEFINE_string(
+    'dataset_name', 'pascalvoc_2007', 'The name of the dataset to load.')
+cli.flags.DEFINE_string(
+    'dataset_split_name', 'test', 'The name of the train/test split.')
+cli.flags.DEFINE_integer(
+    'num_classes', 21, 'Number of classes to use in the dataset.')
+cli.flags.DEFINE_integer(
+    'num_calibration_images', 300,
+    'The number of images used to collect the activation ranges.')
+cli.flags.DEFINE_integer(
+    'num_eval_images', 500,
+    'The number of images used to compare the mAP and latency, 0 for all the rest.')
+cli.flags.DEFINE_integer(
+    'batch_size', 1,
+    'The batch size used to calibrate and evaluate.')
+cli.flags.DEFINE_float(
+    'matching_threshold', 0.5,
+    'The IoU threshold of a true positive.')
+cli.flags.DEFINE_integer(
+    'num_cpu_threads', 0,
+    'The number of cpu threads used by the sessions, 0 to let TensorFlow pick.')
+
+FLAGS = cli.flags.FLAGS
+
+def voc_records(data_dir, dataset_name, split_name):
+    '''Yield (encoded jpeg, labels, bboxes, difficults) of the records in order.'''
+    file_pattern = os.path.join(data_dir, dataset_factory.datasets_map[dataset_name].FILE_PATTERN % split_name)
+    filenames = sorted(tf.gfile.Glob(file_pattern))
+    if not filenames:
+        raise ValueError('No record file matches %s' % file_pattern)
+    keys_to_features = {
+        'image/encoded': tf.FixedLenFeature((), tf.string, default_value=''),
+        'image/object/bbox/xmin': tf.VarLenFeature(dtype=tf.float32),
+        'image/object/bbox/ymin': tf.VarLenFeature(dtype=tf.float32),
+        'image/object/bbox/xmax': tf.VarLenFeature(dtype=tf.float32),
+        'image/object/bbox/ymax': tf.VarLenFeature(dtype=tf.float32),
+        'image/object/bbox/label': tf.VarLenFeature(dtype=tf.int64),
+        'image/object/bbox/difficult': tf.VarLenFeature(dtype=tf.int64),
+    }
+    with tf.Graph().as_default():
+        features = tf.parse_single_example(tf.data.TFRecordDataset(filenames).make_one_shot_iterator().get_next(), keys_to_features)
+        dense = lambda name : tf.sparse_tensor_to_dense(features[name])
+        bboxes = tf.stack([dense('image/object/bbox/ymin'), dense('image/object/bbox/xmin'),
+                            dense('image/object/bbox/ymax'), dense('image/object/bbox/xmax')], axis=-1)
+        fetches = [features['image/encoded'], dense('image/object/bbox/label'), bboxes, dense('image/object/bbox/difficult')]
+        with tf.Session(config = tf.ConfigProto(device_count = {'GPU': 0})) as sess:
+            while True:
+                try:
+                    yield sess.run(fetches)
+                except tf.errors.OutOfRangeError:
+                    break
+
+def batches(records, preprocessor, batch_size, num_images):
+    '''Yield (feeds, groundtruths) of at most `num_images` images from the records.'''
+    feeds = []
+    groundtruths = []
+    # islice does not pull one record too many, the rest of `records` can be used later
+    for encoded_image, glabels, gbboxes, gdifficults in (itertools.islice(records, num_images) if num_images > 0 else records):
+        feeds.append(preprocessor(encoded_image))
+        groundtruths.append((glabels, gbboxes, gdifficults))
+        if len(feeds) == batch_size:
+            yield dict(zip(('image', 'image_shape', 'bbox_img'), [np.stack([_[i] for _ in feeds]) for i in range(3)])), groundtruths
+            feeds = []
+            groundtruths = []
+    if feeds:
+        yield dict(zip(('image', 'image_shape', 'bbox_img'), [np.stack([_[i] for _ in feeds]) for i in range(3)])), groundtruths
+
+class DetectionAccumulator(object):
+    '''Match the flattened detections with the groundtruth and keep the tp/fp of each class.'''
+    def __init__(self, num_classes, matching_threshold):
+        self._num_classes = num_classes
+        self._matching_threshold = matching_threshold
+        self._results = dict((c, [0, [], [], []]) for c in range(1, num_classes))
+
+    def add(self, detections, groundtruths):
+        for index, (glabels, gbboxes, gdifficults) in enumerate(groundtruths):
+            num_detections = int(detections['num_detections'][index])
+            labels = detections['labels'][index][:num_detections]
+            scores = detections['scores'][index][:num_detections]
+            bboxes = detections['bboxes'][index][:num_detections]
+            for c in range(1, self._num_classes):
+                mask = labels == c
+                n, tp, fp = checkpoint_evaluator.np_bboxes_matching(c, scores[mask], bboxes[mask], glabels, gbboxes, gdifficults,
+                                                                    matching_threshold=self._matching_threshold)
+                self._results[c][0] += n
+                self._results[c][1].append(tp)
+                self._results[c][2].append(fp)
+                self._results[c][3].append(scores[mask])
+
+    def mean_average_precisions(self):
+        tp_fp_results = dict((c, (n, np.concatenate(tp), np.concatenate(fp), np.concatenate(scores)))
+                            for c, (n, tp, fp, scores) in self._results.items())
+        aps_voc07, aps_voc12 = checkpoint_evaluator.compute_average_precisions(tp_fp_results)
+        return float(np.mean(list(aps_voc07.values()))), float(np.mean(list(aps_voc12.values())))
+
+def main(_):
+    for op_library in [_.strip() for _ in FLAGS.op_library.split(',') if _.strip()]:
+        tf.load_op_library(os.path.abspath(op_library))
+
+    graph_def, inputs, outputs = graph_optimizer.load_frozen_graph(FLAGS.frozen_graph)
+    float_session = graph_optimizer.FrozenGraphSession(graph_def, inputs, outputs, num_cpu_threads=FLAGS.num_cpu_threads)
+    image_shape = float_session.input_shape('image')
+    data_format = 'channels_first' if image_shape[1] == 3 else 'channels_last'
+    preprocessor = inference_server.JpegPreprocessor(FLAGS.preprocessing_name, image_shape[2] if data_format == 'channels_first' else image_shape[1], data_format)
+
+    quantized_graph_def = graph_optimizer.quantize_graph(graph_def, inputs, outputs)
+    collector = graph_optimizer.RangeCollector(quantized_graph_def, inputs, num_cpu_threads=FLAGS.num_cpu_threads)
+    tf.logging.info('Calibrating %d requantization ranges on %d images.', len(graph_optimizer.get_requantization_ranges(quantized_graph_def)), FLAGS.num_calibration_images)
+
+    records = voc_records(FLAGS.data_dir, FLAGS.dataset_name, FLAGS.dataset_split_name)
+    for feeds, _ in batches(records, preprocessor, FLAGS.batch_size, FLAGS.num_calibration_images):
+        collector.update(feeds)
+    collector.close()
+    quantized_graph_def, num_frozen = graph_optimizer.freeze_requantization_ranges(quantized_graph_def, collector.ranges, list(outputs.values()))
+    graph_optimizer.save_frozen_graph(FLAGS.output_graph, quantized_graph_def, inputs, outputs)
+    tf.logging.info('Saved the quantized graph with %d frozen ranges to %s.', num_frozen, FLAGS.output_graph)
+
+    # the calibration images are already consumed from `records`
+    quantized_session = graph_optimizer.FrozenGraphSession(quantized_graph_def, inputs, outputs, num_cpu_threads=FLAGS.num_cpu_threads)
+    float_results = DetectionAccumulator(FLAGS.num_classes, FLAGS.matching_threshold)
+    quantized_results = DetectionAccumulator(FLAGS.num_classes, FLAGS.matching_threshold)
+    float_secs = []
+    quantized_secs = []
+    num_images = 0
+    for feeds, groundtruths in batches(records, preprocessor, FLAGS.batch_size, FLAGS.num_eval_images):
+        start_time = time.time()
+        float_detections = float_session.run(feeds)
+        float_secs.append(time.time() - start_time)
+        start_time = time.time()
+        quantized_detections = quantized_session.run(feeds)
+        quantized_secs.append(time.time() - start_time)
+        float_results.add(float_detections, groundtruths)
+        quantized_results.add(quantized_detections, groundtruths)
+        num_images += len(groundtruths)
+        if len(float_secs) % 50 == 0:
+            tf.logging.info('Evaluated %d images.', num_images)
+    if num_images == 0:
+        raise ValueError('No image left to evaluate after %d calibration images.' % FLAGS.num_calibration_images)
+
+    # the first batch includes the warm up of both sessions
+    if len(float_secs) > 1:
+        float_secs, quantized_secs = float_secs[1:], quantized_secs[1:]
+    float_map07, float_map12 = float_results.mean_average_precisions()
+    quantized_map07, quantized_map12 = quantized_results.mean_average_precisions()
+    report = {'num_calibration_images': FLAGS.num_calibration_images,
+            'num_eval_images': num_images,
+            'num_frozen_ranges': num_frozen,
+            'float_mAP_VOC07': float_map07,
+            'float_mAP_VOC12': float_map12,
+            'int8_mAP_VOC07': quantized_map07,
+            'int8_mAP_VOC12': quantized_map12,
+            'delta_mAP_VOC07': quantized_map07 - float_map07,
+            'delta_mAP_VOC12': quantized_map12 - float_map12,
+            'float_ms_per_batch': float(np.mean(float_secs) * 1000.),
+            'int8_ms_per_batch': float(np.mean(quantized_secs) * 1000.),
+            'speedup': float(np.mean(float_secs) / max(np.mean(quantized_secs), 1e-12)),
+            'batch_size': FLAGS.batch_size}
+    with tf.gfile.GFile(FLAGS.output_graph + '.report.json', 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    tf.logging.info('mAP VOC07 %.4f -> %.4f (%+.4f), VOC12 %.4f -> %.4f (%+.4f) on %d images.', float_map07, quantized_map07, report['delta_mAP_VOC07'],
+                    float_map12, quantized_map12, report['delta_mAP_VOC12'], num_images)
+    tf.logging.info('CPU %.2f ms -> %.2f ms per batch of %d, %.2fx speedup.', report['float_ms_per_batch'], report['int8_ms_per_batch'],
+                    FLAGS.batch_size, report['speedup'])
+
+    preprocessor.close()
+    quantized_session.close()
+    float_session.close()
+
+if __name__ == '__main__':
+  cli.run(main)
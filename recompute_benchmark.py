@@ -0,0 +1,129 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Compare the peak memory and step time of training a backbone with and without
+--recompute_blocks, on random images of the train size.
+
+Example:
+    python recompute_benchmark.py --model=xdet_resnet --recompute_blocks=block_layer3,block_layer4,block_layer5 --batch_size=8
+
+Each setting runs in its own process, so the peak resident memory of the process
+measures it. Only the backbone is trained, with the sum of its outputs as the loss;
+the head and loss of the model are the same in both settings. All the flags of
+detector_main.py are accepted.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+import detector_main
+from detectors import registry
+
+cli.flags.DEFINE_integer(
+    'num_steps', 10,
+    'The number of timed train steps of each setting.')
+cli.flags.DEFINE_integer(
+    'warmup_steps', 2,
+    'The number of untimed train steps before.')
+cli.flags.DEFINE_string(
+    'benchmark_result_file', None,
+    'Run one setting in this process and write its result into this json file, used internally.')
+
+FLAGS = cli.flags.FLAGS
+
+def run_setting(result_file):
+    '''Train the backbone of FLAGS.model with FLAGS.recompute_blocks and write the result.'''
+    detector_main.set_defaults(FLAGS.model, 'train')
+    detector = registry.get_detector(FLAGS.model)
+    params = detector_main.get_params()
+
+    image_size = params['train_image_size']
+    if params['data_format'] == 'channels_first':
+        shape = [params['batch_size'], 3, image_size, image_size]
+    else:
+        shape = [params['batch_size'], image_size, image_size, 3]
+    images = tf.random_uniform(shape)
+
+    with tf.variable_scope(params['model_scope'], default_name = None, values = [images], reuse=tf.AUTO_REUSE):
+        body_outputs = detector.body(images, params, True)
+    if not isinstance(body_outputs, (list, tuple)):
+        body_outputs = [body_outputs]
+    loss = tf.add_n([tf.reduce_mean(output) for output in body_outputs])
+
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+    with tf.control_dependencies(update_ops):
+        train_op = tf.train.MomentumOptimizer(params['learning_rate'], params['momentum']).minimize(loss)
+
+    config = tf.ConfigProto(intra_op_parallelism_threads = FLAGS.num_cpu_threads, inter_op_parallelism_threads = FLAGS.num_cpu_threads)
+    with tf.Session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        for _ in range(FLAGS.warmup_steps):
+            sess.run(train_op)
+        start_time = time.time()
+        for _ in range(FLAGS.num_steps):
+            sess.run(train_op)
+        step_secs = (time.time() - start_time) / FLAGS.num_steps
+
+    # ru_maxrss is in kilobytes on Linux
+    result = {'recompute_blocks': params['recompute_blocks'],
+            'step_secs': step_secs,
+            'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.}
+    with open(result_file, 'w') as f:
+        json.dump(result, f)
+
+def run_in_subprocess(recompute_blocks):
+    fd, result_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    # the same flags as this process, the later ones override
+    cmd = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+            '--recompute_blocks={}'.format(recompute_blocks),
+            '--benchmark_result_file={}'.format(result_file)]
+    tf.logging.info(' '.join(cmd))
+    subprocess.check_call(cmd)
+    with open(result_file, 'r') as f:
+        result = json.load(f)
+    os.remove(result_file)
+    return result
+
+def main(_):
+    if FLAGS.benchmark_result_file:
+        run_setting(FLAGS.benchmark_result_file)
+        return
+    if not FLAGS.recompute_blocks:
+        raise ValueError('--recompute_blocks is required, it is compared against recomputing nothing.')
+
+    baseline = run_in_subprocess('')
+    recompute = run_in_subprocess(FLAGS.recompute_blocks)
+
+    saved_mb = baseline['peak_memory_mb'] - recompute['peak_memory_mb']
+    slowdown = recompute['step_secs'] / baseline['step_secs'] - 1.
+    print('{:<12}{:>18}{:>16}'.format('', 'peak memory (MB)', 'step time (s)'))
+    print('{:<12}{:>18.1f}{:>16.3f}'.format('baseline', baseline['peak_memory_mb'], baseline['step_secs']))
+    print('{:<12}{:>18.1f}{:>16.3f}'.format('recompute', recompute['peak_memory_mb'], recompute['step_secs']))
+    print('Recomputing {} saves {:.1f} MB ({:.1%}) for {:.1%} more step time.'.format(
+            ', '.join(recompute['recompute_blocks']), saved_mb, saved_mb / baseline['peak_memory_mb'], slowdown))
+
+if __name__ == '__main__':
+  cli.run(main)
@@ -0,0 +1,98 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Serve a SavedModel exported by the train scripts (--export_dir) on CPU with dynamic batching.
+
+Example:
+    python serve_detector.py --saved_model_dir=./export/1525340112 --max_batch_size=8 --max_wait_ms=10
+    curl --data-binary @demo/test.jpg http://localhost:8500/detect
+    curl http://localhost:8500/metrics
+
+Use load_generator.py to measure throughput and latency.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from utility import cli
+tf = cli.lazy_import('tensorflow')
+
+dataset_common = cli.lazy_import('dataset.dataset_common')
+inference_server = cli.lazy_import('utility.inference_server')
+
+cli.flags.DEFINE_string(
+    'saved_model_dir', None,
+    'The SavedModel directory (a timestamped sub directory of --export_dir).')
+cli.flags.DEFINE_string(
+    'preprocessing_name', 'xdet_resnet',
+    'The eval preprocessing used by the exported model.')
+cli.flags.DEFINE_string(
+    'op_library', '',
+    'Comma separated custom op libraries to load before the model, e.g. "./libps_roi_align.so" for light-head models.')
+cli.flags.DEFINE_string(
+    'dataset_name', 'pascalvoc_2007', 'The dataset whose class names are returned.')
+cli.flags.DEFINE_string(
+    'host', '0.0.0.0', 'The address to listen on.')
+cli.flags.DEFINE_integer(
+    'port', 8500, 'The port to listen on.')
+cli.flags.DEFINE_integer(
+    'max_batch_size', 8,
+    'The max number of images run in one session call.')
+cli.flags.DEFINE_float(
+    'max_wait_ms', 10.,
+    'The max time the first image of a batch waits for more images.')
+cli.flags.DEFINE_integer(
+    'num_preprocess_threads', 4,
+    'The number of threads decoding and preprocessing images.')
+cli.flags.DEFINE_integer(
+    'num_cpu_threads', 0,
+    'The number of cpu threads used by the detector session, 0 to let TensorFlow pick.')
+
+FLAGS = cli.flags.FLAGS
+
+def label2name_table(dataset_name):
+    labels = dataset_common.COCO_LABELS if 'coco' in dataset_name else dataset_common.VOC_LABELS
+    return dict((pair[0], name) for name, pair in labels.items())
+
+def main(_):
+    if not FLAGS.saved_model_dir:
+        raise ValueError('You must supply the SavedModel directory with --saved_model_dir')
+    for op_library in [_.strip() for _ in FLAGS.op_library.split(',') if _.strip()]:
+        tf.load_op_library(os.path.abspath(op_library))
+
+    detector = inference_server.DetectorSession(FLAGS.saved_model_dir, num_cpu_threads=FLAGS.num_cpu_threads)
+    preprocessor = inference_server.JpegPreprocessor(FLAGS.preprocessing_name, detector.image_size, detector.data_format)
+    batcher = inference_server.DynamicBatcher(detector, preprocessor,
+                                            max_batch_size=FLAGS.max_batch_size,
+                                            max_wait_ms=FLAGS.max_wait_ms,
+                                            num_preprocess_threads=FLAGS.num_preprocess_threads)
+    server = inference_server.make_http_server(batcher, FLAGS.port, host=FLAGS.host,
+                                            label2name_table=label2name_table(FLAGS.dataset_name))
+    tf.logging.info('Serving %s on %s:%d, max batch size %d, max wait %.1f ms.', FLAGS.saved_model_dir,
+                    FLAGS.host, FLAGS.port, FLAGS.max_batch_size, FLAGS.max_wait_ms)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        tf.logging.info('Final metrics: %s', batcher.metrics())
+        preprocessor.close()
+        detector.close()
+
+if __name__ == '__main__':
+  cli.run(main)
@@ -0,0 +1,88 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Check that utility/graph_optimizer.optimize_for_inference folds the BNs of a small frozen
+graph of the layers used by the detectors and keeps its outputs.
+
+    python test_graph_optimizer.py
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from utility import graph_optimizer
+
+def batch_norm(inputs, rng, name):
+  depth = inputs.get_shape().as_list()[-1]
+  gamma, beta, mean = [tf.constant(rng.normal(size=[depth]).astype(np.float32)) for _ in range(3)]
+  variance = tf.constant(rng.uniform(0.5, 2., size=[depth]).astype(np.float32))
+  return tf.nn.fused_batch_norm(inputs, gamma, beta, mean, variance, epsilon=1e-3, is_training=False, name=name)[0]
+
+def build_frozen_graph(bn_op):
+  '''Return the GraphDef with every BN as bn_op, its input and output names.'''
+  rng = np.random.RandomState(0)
+  weight = lambda *shape : tf.constant(rng.normal(scale=0.3, size=shape).astype(np.float32))
+  with tf.Graph().as_default() as graph:
+    image = tf.placeholder(tf.float32, [2, 16, 16, 3], name='image')
+    # pre-activation BN, nothing to fold into
+    net = batch_norm(image, rng, 'preact_bn')
+    # dilated conv, SpaceToBatchND -> Conv2D -> BatchToSpaceND -> BiasAdd -> BN
+    net = tf.nn.atrous_conv2d(net, weight(3, 3, 3, 8), rate=2, padding='SAME')
+    net = tf.nn.relu(batch_norm(tf.nn.bias_add(net, weight(8)), rng, 'dilated_bn'))
+    net = tf.nn.separable_conv2d(net, weight(3, 3, 8, 2), weight(1, 1, 16, 12), [1, 1, 1, 1], 'SAME')
+    net = tf.nn.relu(batch_norm(net, rng, 'separable_bn'))
+    net = tf.nn.depthwise_conv2d(net, weight(3, 3, 12, 1), [1, 2, 2, 1], 'SAME')
+    net = tf.nn.relu(batch_norm(net, rng, 'depthwise_bn'))
+    net = tf.matmul(tf.reshape(net, [2, -1]), weight(8 * 8 * 12, 5))
+    tf.identity(net, name='logits')
+  graph_def = graph.as_graph_def()
+  for node in graph_def.node:
+    if node.op.startswith('FusedBatchNorm'):
+      node.op = bn_op
+      if bn_op == 'FusedBatchNorm':
+        del node.attr['U']
+  return graph_def, 'image:0', 'logits:0'
+
+def run_graph(graph_def, input_name, output_name, image):
+  with tf.Graph().as_default() as graph:
+    tf.import_graph_def(graph_def, name='')
+    with tf.Session(graph=graph) as sess:
+      return sess.run(output_name, feed_dict={input_name: image})
+
+class OptimizeForInferenceTest(tf.test.TestCase):
+  def _check(self, bn_op):
+    graph_def, input_name, output_name = build_frozen_graph(bn_op)
+    optimized_graph_def, stats = graph_optimizer.optimize_for_inference(graph_def, [output_name])
+    self.assertEqual(stats['num_bn_folded'], 3)
+    self.assertEqual(stats['num_bn_left'], 1)
+    self.assertEqual(len([_ for _ in optimized_graph_def.node if _.op == bn_op]), 1)
+
+    image = np.random.RandomState(1).normal(size=[2, 16, 16, 3]).astype(np.float32)
+    self.assertAllClose(run_graph(optimized_graph_def, input_name, output_name, image),
+                        run_graph(graph_def, input_name, output_name, image), rtol=1e-4, atol=1e-4)
+
+  def testFusedBatchNorm(self):
+    self._check('FusedBatchNorm')
+
+  def testFusedBatchNormV2(self):
+    self._check('FusedBatchNormV2')
+
+  def testFusedBatchNormV3(self):
+    self._check('FusedBatchNormV3')
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,96 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Check detectors/losses.hard_negative_mining_loss against a NumPy version of the per-image selection.
+
+    python test_losses.py
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from detectors import losses
+
+def np_smooth_l1(x):
+  return np.where(np.abs(x) < 1., 0.5 * x * x, np.abs(x) - 0.5)
+
+def np_hard_negative_mining_loss(cls_pred, location_pred, glabels, gtargets, gscores, num_classes, negative_ratio):
+  logits = cls_pred - cls_pred.max(axis=-1, keepdims=True)
+  log_prob = logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+  labels = np.clip(glabels, 0, num_classes - 1)
+  cross_entropy = -np.take_along_axis(log_prob, labels[..., None], axis=-1)[..., 0]
+
+  weights = np.zeros_like(cross_entropy)
+  for image in range(glabels.shape[0]):
+    positive = glabels[image] > 0
+    negative = np.logical_and(glabels[image] == 0, gscores[image] > 0.)
+    weights[image][positive] = 1.
+    n_neg_to_select = min(int(negative_ratio * positive.sum()), negative.sum())
+    neg_indices = np.where(negative)[0]
+    # hardest first, ties broken by the lower index like tf.nn.top_k
+    order = np.argsort(-cross_entropy[image][neg_indices], kind='stable')
+    weights[image][neg_indices[order[:n_neg_to_select]]] = 1.
+
+  cross_entropy_loss = (cross_entropy * weights).sum() / max(weights.sum(), 1.)
+  positive = (glabels > 0).astype(np.float32)
+  loc_loss = (np_smooth_l1(location_pred - gtargets).sum(axis=-1) * positive).sum() / max(positive.sum(), 1.)
+  return cross_entropy_loss, loc_loss, weights
+
+class HardNegativeMiningLossTest(tf.test.TestCase):
+  def _check(self, cls_pred, glabels, gscores, num_classes=5, negative_ratio=3.):
+    rng = np.random.RandomState(1)
+    location_pred = rng.normal(size=glabels.shape + (4,)).astype(np.float32)
+    gtargets = rng.normal(size=glabels.shape + (4,)).astype(np.float32)
+    expected = np_hard_negative_mining_loss(cls_pred, location_pred, glabels, gtargets, gscores, num_classes, negative_ratio)
+    with self.test_session() as sess:
+      cross_entropy_loss, loc_loss = losses.hard_negative_mining_loss(tf.constant(cls_pred), tf.constant(location_pred), tf.constant(glabels),
+                                                                      tf.constant(gtargets), tf.constant(gscores), num_classes, negative_ratio,
+                                                                      tf.estimator.ModeKeys.EVAL)
+      cross_entropy_loss, loc_loss = sess.run([cross_entropy_loss, loc_loss])
+    self.assertAllClose(cross_entropy_loss, expected[0], rtol=1e-5, atol=1e-5)
+    self.assertAllClose(loc_loss, expected[1], rtol=1e-5, atol=1e-5)
+    return expected[2]
+
+  def testRandom(self):
+    rng = np.random.RandomState(0)
+    batch_size, num_anchors, num_classes = 4, 200, 5
+    glabels = rng.randint(0, num_classes, [batch_size, num_anchors]) * (rng.uniform(size=[batch_size, num_anchors]) < 0.05)
+    # some ignored anchors (label -1) and some negatives without overlap (score 0)
+    glabels[rng.uniform(size=glabels.shape) < 0.05] = -1
+    gscores = rng.uniform(size=[batch_size, num_anchors]).astype(np.float32) * (rng.uniform(size=glabels.shape) < 0.9)
+    cls_pred = rng.normal(size=[batch_size, num_anchors, num_classes]).astype(np.float32)
+    self._check(cls_pred, glabels.astype(np.int64), gscores, num_classes)
+
+  def testTiedNegatives(self):
+    # all negatives have the same loss, still exactly negative_ratio times the positives are selected
+    glabels = np.zeros([2, 50], dtype=np.int64)
+    glabels[0, :2] = 1
+    glabels[1, :5] = 3
+    gscores = np.full([2, 50], 0.3, dtype=np.float32)
+    cls_pred = np.zeros([2, 50, 5], dtype=np.float32)
+    weights = self._check(cls_pred, glabels, gscores)
+    self.assertAllEqual(weights.sum(axis=-1), [2 + 6, 5 + 15])
+
+  def testNoPositives(self):
+    glabels = np.zeros([2, 30], dtype=np.int64)
+    gscores = np.full([2, 30], 0.3, dtype=np.float32)
+    cls_pred = np.random.RandomState(2).normal(size=[2, 30, 5]).astype(np.float32)
+    weights = self._check(cls_pred, glabels, gscores)
+    self.assertAllEqual(weights.sum(), 0)
+
+if __name__ == "__main__":
+  tf.test.main()
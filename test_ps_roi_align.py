@@ -0,0 +1,184 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Check net/tf_ps_roi_align.py against the loops of the CPU PsRoiAlign kernel
+(and against libps_roi_align.so itself when it can be built), then benchmark both.
+
+    python test_ps_roi_align.py
+    python test_ps_roi_align.py --benchmarks=all
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import ops
+
+from net import tf_ps_roi_align
+from utility import op_library
+
+try:
+  op_module = op_library.load_op_library('ps_roi_align')
+except (IOError, OSError, RuntimeError) as e:
+  print('libps_roi_align.so is not available, only the TensorFlow version is tested: {}'.format(e))
+  op_module = None
+
+if op_module is not None:
+  @ops.RegisterGradient("PsRoiAlign")
+  def _ps_roi_align_grad(op, grad, _):
+    '''The gradients for `PsRoiAlign`.
+    '''
+    return [op_module.ps_roi_align_grad(op.inputs[0], op.inputs[1], grad, op.outputs[1], op.get_attr('grid_dim_width'),
+                                        op.get_attr('grid_dim_height'), op.get_attr('pool_method')), None]
+
+map_to_pool = np.tile(np.reshape(np.arange(1., 26., dtype=np.float32), [1, 1, 5, 5]), [1, 16, 1, 1])
+rois_to_pool = np.array([[[0.2, 0.2, 0.7, 0.7], [0.5, 0.5, 0.9, 0.9], [0.9, 0.9, 1., 1.]]], dtype=np.float32)
+
+def np_ps_roi_align(inputs, rois, grid_dim_width, grid_dim_height, pool_method):
+    '''Same loops as PSROIAlignFunctor<CPUDevice, T> in cpp/PSROIPooling/ps_roi_align_op.cc.'''
+    batch_size, num_channals, map_height, map_width = inputs.shape
+    num_rois = rois.shape[1]
+    grid_size = grid_dim_width * grid_dim_height
+    bank_size = num_channals // grid_size
+    f32 = np.float32
+    pooled_features = np.zeros([batch_size, num_rois, grid_size, bank_size], dtype=np.float32)
+    pooled_index = np.zeros([batch_size, num_rois, grid_size, bank_size], dtype=np.int32)
+    for b in range(batch_size):
+        for r in range(num_rois):
+            roi = rois[b, r]
+            if roi[2] < np.finfo(np.float32).tiny or roi[3] < np.finfo(np.float32).tiny:
+                continue
+            roi_h, roi_w = max(roi[2] * f32(map_height), f32(1.)), max(roi[3] * f32(map_width), f32(1.))
+            roi_ymin = max(roi[0] * f32(map_height) - roi_h / f32(2.), f32(0.))
+            roi_xmin = max(roi[1] * f32(map_width) - roi_w / f32(2.), f32(0.))
+            roi_ymax = min(roi[0] * f32(map_height) + roi_h / f32(2.), f32(map_height))
+            roi_xmax = min(roi[1] * f32(map_width) + roi_w / f32(2.), f32(map_width))
+            pool_bin_height = (roi_ymax - roi_ymin) / f32(grid_dim_height)
+            pool_bin_width = (roi_xmax - roi_xmin) / f32(grid_dim_width)
+            num_elem_height, num_elem_width = int(pool_bin_height) + 1, int(pool_bin_width) + 1
+            step_height, step_width = pool_bin_height / f32(num_elem_height), pool_bin_width / f32(num_elem_width)
+            for pos in range(grid_size):
+                row_index, col_index = pos // grid_dim_width, pos % grid_dim_width
+                feature_map = inputs[b, pos * bank_size:(pos + 1) * bank_size]
+                samples = []
+                for h_ind in range(num_elem_height):
+                    for w_ind in range(num_elem_width):
+                        row = roi_ymin + pool_bin_height * f32(row_index) + step_height * f32(h_ind) + step_height / f32(2.)
+                        col = roi_xmin + pool_bin_width * f32(col_index) + step_width * f32(w_ind) + step_width / f32(2.)
+                        int_row, int_col = min(int(row), map_height - 1), min(int(col), map_width - 1)
+                        next_row, next_col = min(int_row + 1, map_height - 1), min(int_col + 1, map_width - 1)
+                        y, x = row - f32(int_row), col - f32(int_col)
+                        samples.append((1. - x) * (1. - y) * feature_map[:, int_row, int_col] + (1. - x) * y * feature_map[:, next_row, int_col] +
+                                        x * (1. - y) * feature_map[:, int_row, next_col] + x * y * feature_map[:, next_row, next_col])
+                samples = np.stack(samples)
+                if 'max' in pool_method:
+                    pooled_index[b, r, pos] = np.argmax(samples, axis=0)
+                    pooled_features[b, r, pos] = np.max(samples, axis=0)
+                else:
+                    pooled_features[b, r, pos] = np.mean(samples, axis=0)
+    return pooled_features, pooled_index
+
+def random_inputs(batch_size, num_rois, num_channals, map_height, map_width, seed=0):
+    rng = np.random.RandomState(seed)
+    inputs = rng.randn(batch_size, num_channals, map_height, map_width).astype(np.float32)
+    rois_hw = rng.uniform(0.05, 0.9, size=(batch_size, num_rois, 2))
+    rois_center = rng.uniform(0., 1., size=(batch_size, num_rois, 2))
+    return inputs, np.concatenate([rois_center, rois_hw], axis=-1).astype(np.float32)
+
+class TFPSROIAlignTest(tf.test.TestCase):
+  def _check(self, inputs, rois, grid_dim_width, grid_dim_height, pool_method):
+    expected_features, expected_index = np_ps_roi_align(inputs, rois, grid_dim_width, grid_dim_height, pool_method)
+    with tf.Graph().as_default(), tf.device('/cpu:0'):
+      result = tf_ps_roi_align.ps_roi_align(inputs, rois, grid_dim_width, grid_dim_height, pool_method)
+      op_result = op_module.ps_roi_align(inputs, rois, grid_dim_width, grid_dim_height, pool_method) if op_module is not None else result
+      with tf.Session() as sess:
+        (features, index), (op_features, op_index) = sess.run([result, op_result])
+    self.assertAllClose(features, expected_features, rtol=1e-5, atol=1e-5)
+    self.assertAllClose(op_features, features, rtol=1e-5, atol=1e-5)
+    if 'max' in pool_method:
+      self.assertAllEqual(index, expected_index)
+      self.assertAllEqual(op_index, index)
+
+  def testPSROIAlign(self):
+    for pool_method in ['max', 'mean']:
+      self._check(map_to_pool, rois_to_pool, 2, 2, pool_method)
+
+  def testRandomRois(self):
+    inputs, rois = random_inputs(2, 20, 7 * 7 * 10, 24, 32)
+    # an empty roi pools to zeros
+    rois[1, 3, 2:] = 0.
+    for pool_method in ['max', 'mean']:
+      self._check(inputs, rois, 7, 7, pool_method)
+
+  def testPSROIAlignGrad(self):
+    for pool_method in ['max', 'mean']:
+      with tf.Graph().as_default(), tf.device('/cpu:0'):
+        inputs_features = tf.constant(map_to_pool, dtype=tf.float32)
+        pooled_features, _ = tf_ps_roi_align.ps_roi_align(inputs_features, rois_to_pool, 2, 2, pool_method)
+        with tf.Session():
+          # bilinear sampling is piecewise linear, the error comes from the kinks
+          error = tf.test.compute_gradient_error(inputs_features, [1, 16, 5, 5], pooled_features, [1, 3, 4, 4],
+                                                  delta=0.001, x_init_value=map_to_pool)
+      self.assertLess(error, 1e-2)
+
+  def testCustomPSROIAlignGrad(self):
+    if op_module is None:
+      return
+    inputs, rois = random_inputs(2, 20, 7 * 7 * 10, 24, 32)
+    rois[1, 3, 2:] = 0.
+    for pool_method in ['max', 'mean']:
+      with tf.Graph().as_default(), tf.device('/cpu:0'):
+        inputs_features = tf.constant(inputs)
+        grads = []
+        for ps_roi_align in [tf_ps_roi_align.ps_roi_align, op_module.ps_roi_align]:
+          pooled_features, _ = ps_roi_align(inputs_features, rois, 7, 7, pool_method)
+          # weight the outputs so that every pooled feature has its own gradient
+          grads.append(tf.gradients(tf.reduce_sum(pooled_features * tf.sin(pooled_features)), [inputs_features])[0])
+        with tf.Session() as sess:
+          tf_grad, op_grad = sess.run(grads)
+      self.assertAllClose(op_grad, tf_grad, rtol=1e-4, atol=1e-4)
+
+class PSROIAlignBenchmark(tf.test.Benchmark):
+  '''Light-Head shapes: 300 rois, 7 x 7 grid and 490 channels.'''
+  def _run(self, name, ps_roi_align, with_grad, num_iters=10):
+    inputs, rois = random_inputs(1, 300, 490, 38, 63)
+    with tf.Graph().as_default(), tf.device('/cpu:0'):
+      inputs_features = tf.Variable(inputs)
+      pooled_features, _ = ps_roi_align(inputs_features, tf.constant(rois), 7, 7, 'max')
+      target = tf.gradients(tf.reduce_sum(pooled_features), [inputs_features])[0] if with_grad else pooled_features
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(target)
+        start_time = time.time()
+        for _ in range(num_iters):
+          sess.run(target)
+        wall_time = (time.time() - start_time) / num_iters
+    print('{}: {:.2f} ms'.format(name, wall_time * 1000.))
+    self.report_benchmark(name=name, iters=num_iters, wall_time=wall_time)
+
+  def benchmarkTFPSROIAlign(self):
+    self._run('tf_ps_roi_align_forward', tf_ps_roi_align.ps_roi_align, False)
+    self._run('tf_ps_roi_align_forward_backward', tf_ps_roi_align.ps_roi_align, True)
+
+  def benchmarkCustomPSROIAlign(self):
+    if op_module is None:
+      return
+    self._run('custom_ps_roi_align_forward', op_module.ps_roi_align, False)
+    self._run('custom_ps_roi_align_forward_backward', op_module.ps_roi_align, True)
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,126 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import os
+import threading
+import time
+
+import tensorflow as tf
+from tensorflow.python.ops import gen_io_ops
+
+class AsyncCheckpointSaverHook(tf.train.SessionRunHook):
+    '''Save checkpoints without pausing training for the disk write.
+
+    Every `save_secs` the values of all global variables are copied into host memory by one
+    session.run, then written on a background thread: into temporary files first, renamed to
+    "model_dir/model.ckpt-<global step>" when complete, and registered in the "checkpoint" file
+    so only complete checkpoints are ever seen by evaluation or restore. The oldest ones beyond
+    `max_to_keep` are deleted. While a write is in flight no new snapshot is taken, and the
+    last step is saved when training ends.
+
+    The checkpoints hold no meta graph, the Estimator rebuilds the graph from the model_fn.
+    '''
+    def __init__(self, model_dir, save_secs, max_to_keep = 5, checkpoint_basename = 'model.ckpt'):
+        self._model_dir = model_dir
+        self._save_path = os.path.join(model_dir, checkpoint_basename)
+        self._timer = tf.train.SecondOrStepTimer(every_secs=save_secs)
+        self._max_to_keep = max_to_keep
+
+    def begin(self):
+        self._global_step_tensor = tf.train.get_global_step()
+        if self._global_step_tensor is None:
+            raise RuntimeError('Global step should be created to use AsyncCheckpointSaverHook.')
+        self._variables = tf.global_variables()
+        self._thread = None
+        self._error = None
+        self._last_saved_step = None
+        # the write needs no variables, SaveV2 takes the snapshot through placeholders in a graph of its own
+        self._write_graph = tf.Graph()
+        with self._write_graph.as_default():
+            self._prefix = tf.placeholder(tf.string, [])
+            self._placeholders = [tf.placeholder(var.dtype.base_dtype, var.get_shape()) for var in self._variables]
+            self._save_op = gen_io_ops.save_v2(self._prefix, [var.op.name for var in self._variables], [''] * len(self._variables), self._placeholders)
+        self._write_session = tf.Session(graph=self._write_graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+        checkpoint_state = tf.train.get_checkpoint_state(self._model_dir)
+        self._checkpoints = list(checkpoint_state.all_model_checkpoint_paths) if checkpoint_state else []
+
+    def after_create_session(self, session, coord):
+        tf.train.write_graph(tf.get_default_graph().as_graph_def(add_shapes=True), self._model_dir, 'graph.pbtxt')
+        self._snapshot_and_write(session, session.run(self._global_step_tensor))
+
+    def before_run(self, run_context):
+        return tf.train.SessionRunArgs(self._global_step_tensor)
+
+    def after_run(self, run_context, run_values):
+        if self._error is not None:
+            raise self._error
+        global_step = run_values.results
+        # never queue a second write, try again on the next step
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self._timer.should_trigger_for_step(global_step):
+            self._snapshot_and_write(run_context.session, global_step)
+
+    def end(self, session):
+        self._wait()
+        global_step = session.run(self._global_step_tensor)
+        if global_step != self._last_saved_step:
+            self._snapshot_and_write(session, global_step)
+            self._wait()
+        self._write_session.close()
+
+    def _wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def _snapshot_and_write(self, session, global_step):
+        self._timer.update_last_triggered_step(global_step)
+        start_time = time.time()
+        values = session.run(self._variables)
+        tf.logging.info('Copied the variables of step %d in %.2f secs, writing them in the background.', global_step, time.time() - start_time)
+        self._last_saved_step = global_step
+        self._thread = threading.Thread(target=self._write, args=(values, global_step), name='async_checkpoint')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self, values, global_step):
+        try:
+            start_time = time.time()
+            checkpoint_path = '{}-{}'.format(self._save_path, global_step)
+            tmp_path = '{}_temp'.format(checkpoint_path)
+            feed_dict = dict(zip(self._placeholders, values))
+            feed_dict[self._prefix] = tmp_path
+            self._write_session.run(self._save_op, feed_dict=feed_dict)
+            # the index is renamed last, a checkpoint is only readable after it
+            tmp_files = sorted(tf.gfile.Glob(tmp_path + '.*'), key=lambda filename : filename.endswith('.index'))
+            for tmp_file in tmp_files:
+                tf.gfile.Rename(tmp_file, checkpoint_path + tmp_file[len(tmp_path):], overwrite=True)
+
+            if checkpoint_path in self._checkpoints:
+                self._checkpoints.remove(checkpoint_path)
+            self._checkpoints.append(checkpoint_path)
+            # keep all of them if max_to_keep is 0 or None, as tf.train.Saver
+            if self._max_to_keep:
+                for old_path in self._checkpoints[:-self._max_to_keep]:
+                    for old_file in tf.gfile.Glob(old_path + '.*'):
+                        tf.gfile.Remove(old_file)
+                self._checkpoints = self._checkpoints[-self._max_to_keep:]
+            tf.train.update_checkpoint_state(self._model_dir, checkpoint_path, all_model_checkpoint_paths=self._checkpoints)
+            tf.logging.info('Saved checkpoint %s in %.2f secs.', checkpoint_path, time.time() - start_time)
+        except Exception as e:
+            tf.logging.error('Failed to write the checkpoint of step %d: %s', global_step, e)
+            self._error = e
@@ -0,0 +1,207 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import os
+import sys
+import json
+import time
+import subprocess
+
+import numpy as np
+import tensorflow as tf
+
+# keys of the streaming tp/fp metrics returned by the eval scripts are 'tp_fp_<class name>_<nobjects|ndetections|tp|fp|scores>'
+TP_FP_PREFIX = 'tp_fp_'
+
+def save_tp_fp_results(filename, eval_results):
+    '''Save the raw streaming tp/fp arrays returned by Estimator.evaluate into a .npz file,
+    these can be merged with the results of other shards before computing AP.
+    '''
+    to_save = {'global_step': np.array(eval_results.get('global_step', -1))}
+    for k, v in eval_results.items():
+        if k.startswith(TP_FP_PREFIX):
+            to_save[k] = np.array(v)
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    np.savez(filename, **to_save)
+
+def merge_tp_fp_results(filenames):
+    '''Merge the .npz files of all shards.
+
+    Return:
+        global_step, dict class name -> (num_gbboxes, tp, fp, scores)
+    '''
+    merged = {}
+    global_step = -1
+    for filename in filenames:
+        shard = np.load(filename)
+        global_step = max(global_step, int(shard['global_step']))
+        for k in shard.files:
+            if not k.startswith(TP_FP_PREFIX):
+                continue
+            class_name, metric = k[len(TP_FP_PREFIX):].rsplit('_', 1)
+            merged.setdefault(class_name, {}).setdefault(metric, []).append(shard[k])
+    results = {}
+    for class_name, metric_dict in merged.items():
+        results[class_name] = (int(np.sum(metric_dict['nobjects'])),
+                                np.concatenate([np.reshape(_, [-1]) for _ in metric_dict['tp']]).astype(bool),
+                                np.concatenate([np.reshape(_, [-1]) for _ in metric_dict['fp']]).astype(bool),
+                                np.concatenate([np.reshape(_, [-1]) for _ in metric_dict['scores']]))
+    return global_step, results
+
+def np_precision_recall(num_gbboxes, tp, fp, scores):
+    '''Numpy version of metrics.precision_recall.'''
+    order = np.argsort(-scores, kind='mergesort')
+    tp = np.cumsum(tp[order].astype(np.float64))
+    fp = np.cumsum(fp[order].astype(np.float64))
+    recall = tp / num_gbboxes if num_gbboxes > 0 else np.zeros_like(tp)
+    precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1e-12), 0.)
+    return precision, recall
+
+def np_average_precision_voc07(precision, recall):
+    '''Numpy version of metrics.average_precision_voc07.'''
+    precision = np.concatenate([precision, [0.]])
+    recall = np.concatenate([recall, [np.inf]])
+    ap = 0.
+    for t in np.arange(0., 1.1, 0.1):
+        ap += np.max(precision[recall >= t]) / 11.
+    return ap
+
+def np_average_precision_voc12(precision, recall):
+    '''Numpy version of metrics.average_precision_voc12.'''
+    precision = np.concatenate([[0.], precision, [0.]])
+    recall = np.concatenate([[0.], recall, [1.]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return np.sum(precision[1:] * (recall[1:] - recall[:-1]))
+
+def np_bboxes_jaccard(bbox_ref, bboxes):
+    '''Numpy version of eval_helper.bboxes_jaccard.'''
+    int_ymin = np.maximum(bboxes[:, 0], bbox_ref[0])
+    int_xmin = np.maximum(bboxes[:, 1], bbox_ref[1])
+    int_ymax = np.minimum(bboxes[:, 2], bbox_ref[2])
+    int_xmax = np.minimum(bboxes[:, 3], bbox_ref[3])
+    inter_vol = np.maximum(int_ymax - int_ymin, 0.) * np.maximum(int_xmax - int_xmin, 0.)
+    union_vol = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1]) + \
+                (bbox_ref[2] - bbox_ref[0]) * (bbox_ref[3] - bbox_ref[1]) - inter_vol
+    return np.where(union_vol > 0., inter_vol / np.maximum(union_vol, 1e-12), 0.)
+
+def np_bboxes_matching(label, scores, bboxes, glabels, gbboxes, gdifficults, matching_threshold=0.5):
+    '''Numpy version of eval_helper.bboxes_matching for one image and one class,
+    detections must be sorted by score.
+
+    Return:
+        number of not difficult groundtruth boxes of `label`, tp (N,) and fp (N,) bool arrays.
+    '''
+    gdifficults = gdifficults.astype(bool)
+    n_gbboxes = int(np.sum(np.logical_and(glabels == label, np.logical_not(gdifficults))))
+    tp = np.zeros(len(scores), dtype=bool)
+    fp = np.zeros(len(scores), dtype=bool)
+    gmatch = np.zeros(len(glabels), dtype=bool)
+    if len(glabels) == 0:
+        fp[:] = True
+        return n_gbboxes, tp, fp
+    for i in range(len(scores)):
+        jaccard = np_bboxes_jaccard(bboxes[i], gbboxes) * (glabels == label)
+        idxmax = int(np.argmax(jaccard))
+        match = jaccard[idxmax] > matching_threshold
+        # difficult ones are neither tp nor fp
+        if gdifficults[idxmax]:
+            continue
+        tp[i] = match and not gmatch[idxmax]
+        fp[i] = not tp[i]
+        if match:
+            gmatch[idxmax] = True
+    return n_gbboxes, tp, fp
+
+def compute_average_precisions(tp_fp_results):
+    '''Return the dicts of VOC07 and VOC12 AP of each class.'''
+    aps_voc07 = {}
+    aps_voc12 = {}
+    for class_name, (num_gbboxes, tp, fp, scores) in tp_fp_results.items():
+        precision, recall = np_precision_recall(num_gbboxes, tp, fp, scores)
+        aps_voc07[class_name] = float(np_average_precision_voc07(precision, recall))
+        aps_voc12[class_name] = float(np_average_precision_voc12(precision, recall))
+    return aps_voc07, aps_voc12
+
+class EvalIndex(object):
+    '''A json file mapping checkpoint names to their evaluation results.'''
+    def __init__(self, filename):
+        self._filename = filename
+        self._results = {}
+        if tf.gfile.Exists(filename):
+            with tf.gfile.GFile(filename, 'r') as f:
+                self._results = json.load(f)
+
+    def __contains__(self, checkpoint_path):
+        return os.path.basename(checkpoint_path) in self._results
+
+    def get(self, checkpoint_path):
+        return self._results.get(os.path.basename(checkpoint_path))
+
+    def add(self, checkpoint_path, result):
+        self._results[os.path.basename(checkpoint_path)] = result
+        # write to a temp file first so an interrupted write never corrupts the index
+        tmp_filename = self._filename + '.tmp'
+        with tf.gfile.GFile(tmp_filename, 'w') as f:
+            json.dump(self._results, f, indent=2, sort_keys=True)
+        tf.gfile.Rename(tmp_filename, self._filename, overwrite=True)
+
+def evaluate_checkpoint(eval_script, checkpoint_path, result_dir, num_shards = 1, shard_gpus = None, extra_args = None):
+    '''Evaluate one checkpoint by running `eval_script` on each shard of the test set
+    in its own process, then merge the tp/fp arrays of all shards.
+
+    Return:
+        a json serializable dict of results, None if any shard failed.
+    '''
+    name = os.path.basename(checkpoint_path)
+    start_time = time.time()
+    processes = []
+    for shard_index in range(num_shards):
+        result_file = os.path.join(result_dir, '{}_shard{}_of_{}.npz'.format(name, shard_index, num_shards))
+        # visualization is off by default, the shards would overwrite each other's images
+        cmd = [sys.executable, eval_script,
+                '--checkpoint_to_evaluate={}'.format(checkpoint_path),
+                '--num_shards={}'.format(num_shards),
+                '--shard_index={}'.format(shard_index),
+                '--eval_result_file={}'.format(result_file),
+                '--vis_every_n_images=0'] + list(extra_args or [])
+        env = dict(os.environ)
+        if shard_gpus:
+            env['CUDA_VISIBLE_DEVICES'] = shard_gpus[shard_index % len(shard_gpus)]
+        tf.logging.info('Shard %d: %s', shard_index, ' '.join(cmd))
+        processes.append((result_file, time.time(), subprocess.Popen(cmd, env=env)))
+
+    shard_secs = []
+    failed = False
+    for shard_index, (result_file, shard_start, process) in enumerate(processes):
+        return_code = process.wait()
+        shard_secs.append(time.time() - shard_start)
+        if return_code != 0 or not os.path.exists(result_file):
+            tf.logging.error('Shard %d of %s failed with exit code %d.', shard_index, name, return_code)
+            failed = True
+    if failed:
+        return None
+
+    global_step, tp_fp_results = merge_tp_fp_results([_[0] for _ in processes])
+    aps_voc07, aps_voc12 = compute_average_precisions(tp_fp_results)
+    return {'global_step': global_step,
+            'mAP_VOC07': float(np.mean(list(aps_voc07.values()))),
+            'mAP_VOC12': float(np.mean(list(aps_voc12.values()))),
+            'AP_VOC07': aps_voc07,
+            'AP_VOC12': aps_voc12,
+            'num_shards': num_shards,
+            'shard_secs': shard_secs,
+            'eval_secs': time.time() - start_time,
+            'finished_at': time.strftime('%Y-%m-%d %H:%M:%S')}
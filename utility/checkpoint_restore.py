@@ -0,0 +1,118 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import hashlib
+import json
+import time
+
+import tensorflow as tf
+from tensorflow.python.ops import gen_io_ops
+
+def _mapping_key(checkpoint_path, variables, settings):
+    '''Identify the graph variables, the restore settings and the checkpoint the mapping was resolved for.'''
+    # V1 checkpoints have no index file
+    index_file = checkpoint_path + '.index' if tf.gfile.Exists(checkpoint_path + '.index') else checkpoint_path
+    index_stat = tf.gfile.Stat(index_file)
+    content = json.dumps({'variables': [[var.op.name, var.get_shape().as_list(), var.dtype.base_dtype.name] for var in variables],
+                        'settings': settings,
+                        'index': [index_stat.length, index_stat.mtime_nsec]}, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def _load_cached_mapping(cache_file, key):
+    if not tf.gfile.Exists(cache_file):
+        return None
+    try:
+        with tf.gfile.GFile(cache_file, 'r') as f:
+            cached = json.load(f)
+    except (ValueError, tf.errors.OpError):
+        return None
+    return cached['mapping'] if cached.get('key') == key else None
+
+def _save_cached_mapping(cache_file, key, mapping):
+    try:
+        with tf.gfile.GFile(cache_file + '.tmp', 'w') as f:
+            json.dump({'key': key, 'mapping': mapping}, f)
+        tf.gfile.Rename(cache_file + '.tmp', cache_file, overwrite=True)
+    except tf.errors.OpError as e:
+        # e.g. the directory of a pretrained model is read only
+        tf.logging.warning('Failed to cache the restore mapping into %s: %s', cache_file, e)
+
+def resolve_mapping(checkpoint_path, variables, model_scope, checkpoint_model_scope, ignore_missing_vars):
+    '''Return dict graph variable name -> checkpoint tensor name, reading the checkpoint index once.
+
+    The graph names are renamed from model_scope to checkpoint_model_scope (an empty
+    checkpoint_model_scope strips "model_scope/"), None keeps them. Missing tensors and shape or
+    dtype mismatches are skipped with a warning when ignore_missing_vars is set, or all raised at once.
+    '''
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    shape_map = reader.get_variable_to_shape_map()
+    dtype_map = reader.get_variable_to_dtype_map()
+
+    mapping = {}
+    problems = []
+    for var in variables:
+        name = var.op.name
+        if checkpoint_model_scope is not None:
+            if checkpoint_model_scope.strip() == '':
+                name = name.replace(model_scope + '/', checkpoint_model_scope)
+            else:
+                name = name.replace(model_scope, checkpoint_model_scope)
+        if name not in shape_map:
+            problems.append('Variable {} missing in checkpoint {}'.format(name, checkpoint_path))
+        elif shape_map[name] != var.get_shape().as_list():
+            problems.append('Variable {} has shape {} in the graph but {} in the checkpoint'.format(var.op.name, var.get_shape().as_list(), shape_map[name]))
+        elif dtype_map[name] != var.dtype.base_dtype:
+            problems.append('Variable {} has dtype {} in the graph but {} in the checkpoint'.format(var.op.name, var.dtype.base_dtype.name, dtype_map[name].name))
+        else:
+            mapping[var.op.name] = name
+    if problems and not ignore_missing_vars:
+        raise ValueError('Can not restore from {}:\n{}'.format(checkpoint_path, '\n'.join(problems)))
+    for problem in problems:
+        tf.logging.warning(problem)
+    return mapping
+
+def build_restore_fn(checkpoint_path, variables, model_scope, checkpoint_model_scope, ignore_missing_vars):
+    '''Return the init_fn of a Scaffold which restores `variables` from checkpoint_path by one
+    grouped op, None if none of them is in the checkpoint.
+
+    The resolved mapping is cached in "checkpoint_path.restore_map.json", a later job with
+    the same variables and settings skips reading the checkpoint index.
+    '''
+    start_time = time.time()
+    settings = {'model_scope': model_scope, 'checkpoint_model_scope': checkpoint_model_scope, 'ignore_missing_vars': ignore_missing_vars}
+    key = _mapping_key(checkpoint_path, variables, settings)
+    cache_file = checkpoint_path + '.restore_map.json'
+    mapping = _load_cached_mapping(cache_file, key)
+    if mapping is None:
+        mapping = resolve_mapping(checkpoint_path, variables, model_scope, checkpoint_model_scope, ignore_missing_vars)
+        _save_cached_mapping(cache_file, key, mapping)
+    else:
+        tf.logging.info('Use the cached restore mapping %s.', cache_file)
+
+    restore_vars = [var for var in variables if var.op.name in mapping]
+    if not restore_vars:
+        return None
+    with tf.name_scope('restore_checkpoint'), tf.device('/device:CPU:0'):
+        tensors = gen_io_ops.restore_v2(checkpoint_path,
+                                        [mapping[var.op.name] for var in restore_vars],
+                                        [''] * len(restore_vars),
+                                        [var.dtype.base_dtype for var in restore_vars])
+    restore_op = tf.group(*[tf.assign(var, tensor) for var, tensor in zip(restore_vars, tensors)], name='restore_checkpoint')
+    tf.logging.info('Resolved %d of %d variables to restore in %.2f secs.', len(restore_vars), len(variables), time.time() - start_time)
+
+    def callback(scaffold, session):
+        start_time = time.time()
+        session.run(restore_op)
+        tf.logging.info('Restored %d variables from %s in %.2f secs.', len(restore_vars), checkpoint_path, time.time() - start_time)
+    return callback
@@ -0,0 +1,94 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Shared entry point of the scripts.
+
+The scripts define their flags with `cli.flags` (absl, the same flags behind tf.app.flags)
+and import TensorFlow and the heavy modules with `cli.lazy_import`, so `--help` and flag
+errors return before anything heavy is loaded:
+
+    from utility import cli
+    tf = cli.lazy_import('tensorflow')
+    cli.flags.DEFINE_integer('batch_size', 16, 'The batch size.')
+    ...
+    if __name__ == '__main__':
+        cli.run(main)
+
+The time spent in each startup phase is recorded with `mark`, see train_helper.StartupTimerHook.
+'''
+import time
+import importlib
+
+try:
+    from absl import app as _absl_app
+    from absl import flags
+except ImportError:
+    # old TensorFlow without absl
+    _absl_app = None
+    flags = importlib.import_module('tensorflow').app.flags
+
+# close enough to the start of the process, this module is imported first by the scripts
+_start_time = time.time()
+_marks = []
+_import_secs = {}
+
+def mark(phase):
+    '''Record the end of a startup phase.'''
+    _marks.append((phase, time.time()))
+
+def startup_report():
+    '''Return (secs since start, [(phase, secs of this phase)], {module: secs to import}).'''
+    phases = []
+    last_time = _start_time
+    for phase, mark_time in _marks:
+        phases.append((phase, mark_time - last_time))
+        last_time = mark_time
+    return last_time - _start_time, phases, dict(_import_secs)
+
+class LazyModule(object):
+    '''Import the module on first attribute access.'''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            start_time = time.time()
+            self._module = importlib.import_module(self._name)
+            _import_secs[self._name] = time.time() - start_time
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return '<lazy module {}{}>'.format(self._name, '' if self._module is None else ' (loaded)')
+
+def lazy_import(name):
+    return LazyModule(name)
+
+def run(main, argv=None):
+    '''Parse the flags (handling --help without importing TensorFlow), then call main(argv).'''
+    def _main(argv):
+        mark('flags')
+        tf = importlib.import_module('tensorflow')
+        tf.logging.set_verbosity(tf.logging.INFO)
+        mark('tensorflow')
+        return main(argv)
+    if _absl_app is not None:
+        _absl_app.run(_main, argv=argv)
+    else:
+        importlib.import_module('tensorflow').app.run(main=_main, argv=argv)
@@ -1,5 +1,7 @@
 import tensorflow as tf
 
+from utility import stage_profiler
+
 def tf_bboxes_nms(scores, labels, bboxes, nms_threshold = 0.5, select_threshold = 0., keep_top_k = 200, mode = 'min', scope=None):
     with tf.name_scope(scope, 'tf_bboxes_nms', [scores, labels, bboxes]):
         # get the cls_score for the most-likely class
@@ -285,7 +287,7 @@ def filter_boxes(scores, bboxes, min_size_ratio, image_shape, net_input_shape, k
             d_scores = {}
             d_bboxes = {}
             for c in scores.keys():
-                s, b = filter_boxes(scores[c], bboxes[c], min_size_ratio, image_shape, net_input_shape)
+                s, b = filter_boxes(scores[c], bboxes[c], min_size_ratio, image_shape, net_input_shape, keep_top_k = keep_top_k)
                 d_scores[c] = s
                 d_bboxes[c] = b
             return d_scores, d_bboxes
@@ -558,7 +560,7 @@ def tf_bboxes_select_layer(predictions_layer, localizations_layer,
                            num_classes=21,
                            scope=None):
     """Extract classes, scores and bounding boxes from features in one layer.
-    Batch-compatible: inputs are supposed to have batch-type shapes.
+    Batch-compatible: inputs may be N x ... or Batch x N x ... shaped.
 
     Args:
       predictions_layer: prediction layer;
@@ -567,7 +569,7 @@ def tf_bboxes_select_layer(predictions_layer, localizations_layer,
         under the threshold are set to 'zero'. If None, no threshold applied.
     Return:
       d_scores, d_bboxes: Dictionary of scores and bboxes Tensors of
-        size N x 1 | 4. Each key corresponding to a class.
+        size [Batch x] N x 1 | 4. Each key corresponding to a class.
     """
     select_threshold = 0.0 if select_threshold is None else select_threshold
     with tf.name_scope(scope, 'bboxes_select_layer',
@@ -576,7 +578,7 @@ def tf_bboxes_select_layer(predictions_layer, localizations_layer,
         d_bboxes = {}
         for c in range(1, num_classes):
             # Remove boxes under the threshold.
-            scores = predictions_layer[:, c]
+            scores = predictions_layer[..., c]
             fmask = tf.cast(tf.greater(scores, select_threshold), scores.dtype)
             scores = scores * fmask
             bboxes = localizations_layer * tf.expand_dims(fmask, axis=-1)
@@ -624,6 +626,55 @@ def tf_bboxes_select(predictions, localizations,
             d_bboxes[c] = tf.concat(lb, axis=1)
         return d_scores, d_bboxes
 
+def bboxes_post_process_batch(cls_pred_prob, bboxes_pred, bbox_img, image_shape, num_classes,
+                            select_threshold, nms_threshold, nms_topk, min_size_ratio, net_input_shape,
+                            parallel_iterations=10, scope=None):
+    """Select, clip, filter, resize, sort and NMS detections of a whole batch.
+    Select and clip run on the batched Tensors directly, the data-dependent
+    steps run per image and are zero padded to `nms_topk`, so the batch
+    dimension is kept from input to output.
+
+    Args:
+      cls_pred_prob: Batch x N x num_classes Tensor of class probabilities.
+      bboxes_pred: Batch x N x 4 Tensor of decoded bounding boxes.
+      bbox_img: Batch x 4 Tensor, the region of the original image in the network input.
+      image_shape: Batch x 3 Tensor, shape of the original images.
+      nms_topk: Number of boxes of each class to keep for each image.
+    Return:
+      d_scores, d_bboxes: Dictionary of scores and bboxes Tensors of
+        size Batch x nms_topk x 1 | 4. Each key corresponding to a class.
+    """
+    with tf.name_scope(scope, 'bboxes_post_process_batch',
+                       [cls_pred_prob, bboxes_pred, bbox_img, image_shape]):
+        with stage_profiler.stage('select'):
+            d_scores, d_bboxes = tf_bboxes_select([cls_pred_prob], [bboxes_pred], select_threshold, num_classes)
+            # bbox_img broadcasts along the boxes of each image
+            d_bboxes = bboxes_clip(bbox_img, d_bboxes)
+
+        classes = sorted(d_scores.keys())
+        def single_image_proc(scores_bboxes):
+            scores, bboxes, _bbox_img, _image_shape = scores_bboxes
+            scores, bboxes = dict(zip(classes, scores)), dict(zip(classes, bboxes))
+
+            with stage_profiler.stage('select'):
+                scores, bboxes = filter_boxes(scores, bboxes, min_size_ratio, _image_shape, net_input_shape, keep_top_k = nms_topk * 2)
+                # Resize bboxes to original image shape.
+                bboxes = bboxes_resize(_bbox_img, bboxes)
+                scores, bboxes = bboxes_sort(scores, bboxes, top_k = nms_topk * 2)
+            with stage_profiler.stage('nms'):
+                scores, bboxes = bboxes_nms_batch(scores, bboxes, nms_threshold = nms_threshold, keep_top_k = nms_topk)
+
+            return [scores[c] for c in classes], [bboxes[c] for c in classes]
+
+        scores, bboxes = tf.map_fn(single_image_proc,
+                                ([d_scores[c] for c in classes], [d_bboxes[c] for c in classes], bbox_img, image_shape),
+                                dtype=([tf.float32] * len(classes), [tf.float32] * len(classes)),
+                                parallel_iterations=parallel_iterations,
+                                back_prop=False,
+                                infer_shape=True)
+
+        return dict(zip(classes, scores)), dict(zip(classes, bboxes))
+
 # all input are flaten
 def xdet_predict(bbox_img, cls_pred_prob, bboxes_pred, input_image_size, train_image_size, nms_threshold, select_threshold, nms_topk, num_classes, nms_mode='union'):
     # remove bboxes that are not foreground
@@ -795,8 +846,9 @@ def bboxes_matching_batch(labels, scores, bboxes,
 
     Args:
       rclasses, rscores, rbboxes: BxN(x4) Tensors. Detected objects, sorted by score;
-      glabels, gbboxes: Groundtruth bounding boxes. May be zero padded, hence
+      glabels, gbboxes: BxM(x4) Groundtruth bounding boxes. May be zero padded, hence
         zero-class objects are ignored.
+      gdifficults: BxM Tensor, zero padded in the same way as glabels.
       matching_threshold: Threshold for a positive match.
     Return: Tuple or Dictionaries with:
        n_gbboxes: Scalar Tensor with number of groundtruth boxes (may difer from
@@ -821,11 +873,11 @@ def bboxes_matching_batch(labels, scores, bboxes,
 
     with tf.name_scope(scope, 'bboxes_matching_batch',
                        [scores, bboxes, glabels, gbboxes]):
-        r = tf.map_fn(lambda x: bboxes_matching(tf.expand_dims(labels, axis=0), x[0], x[1],
+        r = tf.map_fn(lambda x: bboxes_matching(labels, x[0], x[1],
                                                 x[2], x[3], x[4],
                                                 matching_threshold),
 
-                      (tf.expand_dims(scores, axis=0), tf.expand_dims(bboxes, axis=0), tf.expand_dims(glabels, axis=0), tf.expand_dims(gbboxes, axis=0), tf.expand_dims(gdifficults, axis=0)),
+                      (scores, bboxes, glabels, gbboxes, gdifficults),
                       dtype=(tf.int64, tf.bool, tf.bool),
                       parallel_iterations=10,
                       back_prop=False,
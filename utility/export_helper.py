@@ -0,0 +1,86 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import tensorflow as tf
+
+from preprocessing import preprocessing_factory
+
+def decode_and_preprocess_jpeg(encoded_image, preprocessing_name, image_size, data_format):
+    '''Decode one JPEG string and run the eval preprocessing on it.
+
+    Return:
+        image, shape of the decoded image (int32) and bbox_img.
+    '''
+    image = tf.image.decode_jpeg(encoded_image, channels=3)
+    image_shape = tf.shape(image)
+    image, _, _, bbox_img = preprocessing_factory.get_preprocessing(preprocessing_name, is_training=False)(image, None, None, out_shape=[image_size] * 2,
+                                                                data_format=('NCHW' if data_format=='channels_first' else 'NHWC'))
+    return image, image_shape, bbox_img
+
+def jpeg_serving_input_receiver_fn(preprocessing_name, image_size, data_format, parallel_iterations=8):
+    '''Build a serving_input_receiver_fn which takes a batch of encoded JPEG strings.
+
+    The features passed to the model_fn (and the inputs of the alternative
+    'preprocessed' signatures) are a dict of:
+        image: the preprocessed batch, Batch x image_size x image_size x 3 (or NCHW).
+        image_shape: Batch x 3 int32, shape of the decoded images.
+        bbox_img: Batch x 4, the region of the original image in the network input.
+    '''
+    def serving_input_receiver_fn():
+        encoded_images = tf.placeholder(tf.string, shape=[None], name='encoded_images')
+        images, image_shapes, bbox_imgs = tf.map_fn(lambda encoded_image : decode_and_preprocess_jpeg(encoded_image, preprocessing_name, image_size, data_format),
+                                                    encoded_images,
+                                                    dtype=(tf.float32, tf.int32, tf.float32),
+                                                    parallel_iterations=parallel_iterations,
+                                                    back_prop=False)
+        if data_format == 'channels_first':
+            images.set_shape([None, 3, image_size, image_size])
+        else:
+            images.set_shape([None, image_size, image_size, 3])
+
+        features = {'image': images, 'image_shape': image_shapes, 'bbox_img': bbox_imgs}
+        # the 'preprocessed' signatures feed these tensors directly, so a server can decode and batch images itself
+        return tf.estimator.export.ServingInputReceiver(features, {'encoded_images': encoded_images},
+                                                        receiver_tensors_alternatives={'preprocessed': features})
+    return serving_input_receiver_fn
+
+def flatten_detections(d_scores, d_bboxes, keep_top_k, scope=None):
+    '''Merge the per-class outputs of eval_helper.bboxes_post_process_batch into
+    the `keep_top_k` best detections of each image.
+
+    Args:
+      d_scores, d_bboxes: dicts class -> Batch x N | Batch x N x 4, zero padded.
+    Return:
+      dict of scores (Batch x K), labels (Batch x K), bboxes (Batch x K x 4, ymin, xmin,
+      ymax, xmax relative to the original image) and num_detections (Batch), padded
+      entries have zero score and label.
+    '''
+    with tf.name_scope(scope, 'flatten_detections', [d_scores, d_bboxes]):
+        classes = sorted(d_scores.keys())
+        scores = tf.concat([d_scores[c] for c in classes], axis=1)
+        bboxes = tf.concat([d_bboxes[c] for c in classes], axis=1)
+        labels = tf.concat([tf.ones_like(d_scores[c], tf.int64) * c for c in classes], axis=1)
+
+        scores, indices = tf.nn.top_k(scores, k=tf.minimum(keep_top_k, tf.shape(scores)[1]), sorted=True)
+        batch_indices = tf.tile(tf.expand_dims(tf.range(tf.shape(indices)[0]), axis=1), [1, tf.shape(indices)[1]])
+        gather_indices = tf.stack([batch_indices, indices], axis=-1)
+        labels = tf.gather_nd(labels, gather_indices)
+        bboxes = tf.gather_nd(bboxes, gather_indices)
+
+        valid_mask = scores > 0.
+        labels = tf.where(valid_mask, labels, tf.zeros_like(labels))
+        return {'scores': scores,
+                'labels': labels,
+                'bboxes': bboxes,
+                'num_detections': tf.count_nonzero(valid_mask, axis=1)}
@@ -0,0 +1,434 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import copy
+import json
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2
+from tensorflow.core.framework import graph_pb2
+from tensorflow.python.framework import tensor_util
+
+# these are never evaluated while freezing, even if all their inputs are constant
+_CONTROL_FLOW_OPS = set(['Enter', 'Exit', 'Switch', 'Merge', 'RefSwitch', 'RefMerge', 'NextIteration', 'LoopCond',
+                        'ControlTrigger', 'NoOp'])
+_SUMMARY_OPS = set(['ImageSummary', 'ScalarSummary', 'HistogramSummary', 'TensorSummary', 'TensorSummaryV2',
+                    'AudioSummaryV2', 'MergeSummary', 'Print', 'Assert'])
+_WEIGHT_OPS = set(['Conv2D', 'DepthwiseConv2dNative', 'MatMul'])
+# newer TF emits FusedBatchNormV3 by default, its extra output is only used in training
+_FOLDABLE_BN_OPS = set(['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3'])
+_BN_OPS = _FOLDABLE_BN_OPS | set(['BatchNormWithGlobalNormalization'])
+
+def _node_name(input_name):
+    return input_name.lstrip('^').split(':')[0]
+
+def _consumers(graph_def):
+    '''Return dict node name -> list of nodes reading it (data or control).'''
+    consumers = {}
+    for node in graph_def.node:
+        for input_name in node.input:
+            consumers.setdefault(_node_name(input_name), []).append(node)
+    return consumers
+
+def freeze_saved_model(saved_model_dir, signature_key = None):
+    '''Load a SavedModel and convert its variables into constants, keeping only the
+    ops needed by the outputs of `signature_key`, so training only parts (OHEM duplicate
+    head, image summaries, ...) never reach the frozen graph.
+
+    Return:
+        frozen GraphDef, dict input key -> tensor name, dict output key -> tensor name.
+    '''
+    with tf.Graph().as_default() as graph:
+        with tf.Session(graph = graph, config = tf.ConfigProto(device_count = {'GPU': 0})) as sess:
+            meta_graph = tf.saved_model.loader.load(sess, [tf.saved_model.tag_constants.SERVING], saved_model_dir)
+            if signature_key is None:
+                signature_key = [k for k, v in meta_graph.signature_def.items() if 'image' in v.inputs][0]
+            signature = meta_graph.signature_def[signature_key]
+            inputs = dict((k, v.name) for k, v in signature.inputs.items())
+            outputs = dict((k, v.name) for k, v in signature.outputs.items())
+            graph_def = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(),
+                                                                    sorted(set(_node_name(_) for _ in outputs.values())))
+    return graph_def, inputs, outputs
+
+def strip_summaries(graph_def):
+    '''Replace summary, Print and Assert ops by their first input (or drop them if nothing
+    reads their output), these are debug only at inference.'''
+    removed = dict((node.name, node.input[0] if node.input else None) for node in graph_def.node if node.op in _SUMMARY_OPS)
+    def resolve(input_name):
+        prefix = '^' if input_name.startswith('^') else ''
+        while _node_name(input_name) in removed:
+            input_name = removed[_node_name(input_name)]
+            if input_name is None:
+                return None
+        return prefix + _node_name(input_name) if prefix else input_name
+    output_graph_def = graph_pb2.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if node.name in removed:
+            continue
+        new_node = output_graph_def.node.add()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        for input_name in node.input:
+            input_name = resolve(input_name)
+            if input_name is not None and input_name not in new_node.input:
+                new_node.input.append(input_name)
+    return output_graph_def, len(removed)
+
+def _const_value(nodes, consumers, input_name):
+    '''Follow Identity ops from an input to its Const node.
+
+    Return:
+        (Const node, numpy value, True if no other node reads the Const or the Identity ops),
+        (None, None, False) if the input is not a constant.
+    '''
+    node = nodes.get(_node_name(input_name))
+    exclusive = True
+    while node is not None and node.op == 'Identity':
+        exclusive = exclusive and len(consumers.get(node.name, [])) == 1
+        node = nodes.get(_node_name(node.input[0]))
+    if node is None or node.op != 'Const':
+        return None, None, False
+    exclusive = exclusive and len(consumers.get(node.name, [])) == 1
+    return node, tensor_util.MakeNdarray(node.attr['value'].tensor), exclusive
+
+def _set_const(node, value):
+    node.attr['value'].CopyFrom(attr_value_pb2.AttrValue(tensor=tensor_util.make_tensor_proto(value, dtype=value.dtype, shape=value.shape)))
+
+def fold_batch_norms(graph_def):
+    '''Fold inference mode FusedBatchNorm (V2, V3) into the weights of the preceding Conv2D,
+    separable conv (its pointwise Conv2D), DepthwiseConv2dNative or MatMul, the BN is
+    replaced by a BiasAdd of the folded shift. Dilated convs built as SpaceToBatchND ->
+    Conv2D -> BatchToSpaceND and convs followed by a BiasAdd are handled too.
+
+    Pre-activation BNs (v2 ResNet units, BN after a residual add) have no preceding
+    weight layer and are left as they are.
+
+    Return:
+        the new GraphDef, number of folded BNs, number of BNs left.
+    '''
+    graph_def = copy.deepcopy(graph_def)
+    nodes = dict((node.name, node) for node in graph_def.node)
+    consumers = _consumers(graph_def)
+    num_folded = 0
+    num_left = 0
+    for bn_node in list(graph_def.node):
+        if bn_node.op not in _BN_OPS:
+            continue
+        if bn_node.op not in _FOLDABLE_BN_OPS or bn_node.attr['is_training'].b:
+            num_left += 1
+            continue
+        # the other outputs (batch mean/variance, reserve space) are only used in training
+        if any(_node_name(_) == bn_node.name and _.lstrip('^') not in (bn_node.name, bn_node.name + ':0')
+                for c in consumers.get(bn_node.name, []) for _ in c.input):
+            num_left += 1
+            continue
+
+        # walk up the BatchToSpaceND and BiasAdd between the BN and the weight layer
+        chain = []
+        producer = nodes.get(_node_name(bn_node.input[0]))
+        while producer is not None and producer.op in ('BatchToSpaceND', 'BiasAdd') and len(consumers.get(producer.name, [])) == 1:
+            chain.append(producer)
+            producer = nodes.get(_node_name(producer.input[0]))
+        if producer is None or producer.op not in _WEIGHT_OPS or len(consumers.get(producer.name, [])) != 1:
+            num_left += 1
+            continue
+        if producer.op == 'MatMul' and producer.attr['transpose_b'].b:
+            num_left += 1
+            continue
+        weight_node, weight, weight_exclusive = _const_value(nodes, consumers, producer.input[1])
+        values = [_const_value(nodes, consumers, _)[1] for _ in bn_node.input[1:5]]
+        bias_adds = [_ for _ in chain if _.op == 'BiasAdd']
+        biases = [_const_value(nodes, consumers, _.input[1]) for _ in bias_adds]
+        # the kernel may be shared with another layer (e.g. the reused dense of OHEM)
+        if not weight_exclusive or any(_ is None for _ in values) or not all(_[2] for _ in biases):
+            num_left += 1
+            continue
+        biases = [_[1] for _ in biases]
+
+        gamma, beta, mean, variance = [_.astype(np.float64) for _ in values]
+        scale = gamma / np.sqrt(variance + bn_node.attr['epsilon'].f)
+        shift = beta - mean * scale
+        for bias in biases:
+            shift = shift + bias.astype(np.float64) * scale
+        if producer.op == 'DepthwiseConv2dNative':
+            new_weight = weight * np.reshape(scale, weight.shape[2:])
+        else:
+            new_weight = weight * scale
+        _set_const(weight_node, new_weight.astype(weight.dtype))
+        # drop the now folded BiasAdds from the chain
+        for bias_add in bias_adds:
+            bias_add.op = 'Identity'
+            del bias_add.input[1:]
+            for attr_name in list(bias_add.attr.keys()):
+                if attr_name != 'T':
+                    del bias_add.attr[attr_name]
+
+        shift_node = graph_def.node.add()
+        shift_node.name = bn_node.name + '/folded_shift'
+        shift_node.op = 'Const'
+        shift_node.attr['dtype'].CopyFrom(attr_value_pb2.AttrValue(type=bn_node.attr['T'].type))
+        _set_const(shift_node, shift.astype(weight.dtype))
+
+        data_format = bn_node.attr['data_format'].s
+        bn_input = bn_node.input[0]
+        bn_node.op = 'BiasAdd'
+        del bn_node.input[:]
+        bn_node.input.extend([bn_input, shift_node.name])
+        for attr_name in list(bn_node.attr.keys()):
+            if attr_name not in ('T',):
+                del bn_node.attr[attr_name]
+        bn_node.attr['data_format'].CopyFrom(attr_value_pb2.AttrValue(s=data_format or b'NHWC'))
+        num_folded += 1
+    return graph_def, num_folded, num_left
+
+def fold_constants(graph_def, output_names):
+    '''Evaluate every subgraph whose inputs are all constant (e.g. the anchors built with
+    tf.meshgrid) once and replace it by a Const node. Ops in control flow frames, stateful
+    ops and ops with control inputs are never folded.
+
+    Return:
+        the new GraphDef, number of nodes replaced by constants.
+    '''
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+    nodes = dict((node.name, node) for node in graph_def.node)
+    foldable = {}
+    def can_fold_alone(node):
+        if node.op in _CONTROL_FLOW_OPS or node.op in _SUMMARY_OPS or graph.get_operation_by_name(node.name).op_def.is_stateful:
+            return False
+        if any(_.startswith('^') for _ in node.input):
+            return False
+        return node.op == 'Const' or len(node.input) > 0
+    # iterative depth first search, the backbones are too deep for recursion
+    for root in graph_def.node:
+        stack = [root.name]
+        while stack:
+            name = stack[-1]
+            if name in foldable:
+                stack.pop()
+                continue
+            node = nodes[name]
+            if not can_fold_alone(node):
+                foldable[name] = False
+                stack.pop()
+                continue
+            pending = [_node_name(_) for _ in node.input if _node_name(_) not in foldable]
+            if pending:
+                # a cycle (only possible through NextIteration) is never foldable
+                if any(_ in stack for _ in pending):
+                    foldable[name] = False
+                    stack.pop()
+                else:
+                    stack.extend(pending)
+                continue
+            foldable[name] = all(foldable[_node_name(_)] for _ in node.input)
+            stack.pop()
+    is_foldable = lambda name: foldable[name]
+
+    consumers = _consumers(graph_def)
+    protected = set(_node_name(_) for _ in output_names)
+    to_fold = []
+    for node in graph_def.node:
+        if node.op == 'Const' or not is_foldable(node.name):
+            continue
+        # only the frontier of a constant subgraph needs to be evaluated
+        if node.name in protected or any(not is_foldable(c.name) for c in consumers.get(node.name, [])):
+            to_fold.append(node.name)
+    if not to_fold:
+        return graph_def, 0
+
+    # only fold the nodes with a single output, the others are rare (e.g. Unpack) and kept
+    to_fold = [name for name in to_fold if len(graph.get_operation_by_name(name).outputs) == 1]
+    with tf.Session(graph = graph, config = tf.ConfigProto(device_count = {'GPU': 0})) as sess:
+        values = sess.run([graph.get_operation_by_name(name).outputs[0] for name in to_fold])
+
+    output_graph_def = graph_pb2.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    folded = dict(zip(to_fold, values))
+    for node in graph_def.node:
+        new_node = output_graph_def.node.add()
+        if node.name in folded:
+            value = folded[node.name]
+            new_node.name = node.name
+            new_node.op = 'Const'
+            new_node.device = node.device
+            new_node.attr['dtype'].CopyFrom(attr_value_pb2.AttrValue(type=tf.as_dtype(value.dtype).as_datatype_enum))
+            _set_const(new_node, value)
+        else:
+            new_node.CopyFrom(node)
+    return output_graph_def, len(folded)
+
+def optimize_for_inference(graph_def, output_names):
+    '''strip summaries -> fold BN -> fold constants -> drop the unused nodes.'''
+    output_nodes = sorted(set(_node_name(_) for _ in output_names))
+    graph_def, num_summaries = strip_summaries(graph_def)
+    graph_def, num_folded_bn, num_left_bn = fold_batch_norms(graph_def)
+    graph_def, num_folded_const = fold_constants(graph_def, output_names)
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, output_nodes)
+    stats = {'num_summaries_stripped': num_summaries,
+            'num_bn_folded': num_folded_bn,
+            'num_bn_left': num_left_bn,
+            'num_constants_folded': num_folded_const,
+            'num_nodes': len(graph_def.node)}
+    return graph_def, stats
+
+def save_frozen_graph(filename, graph_def, inputs, outputs):
+    '''Write the GraphDef and a "<filename>.json" of its input/output tensor names.'''
+    with tf.gfile.GFile(filename, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with tf.gfile.GFile(filename + '.json', 'w') as f:
+        json.dump({'inputs': inputs, 'outputs': outputs}, f, indent=2, sort_keys=True)
+
+def load_frozen_graph(filename):
+    '''Return the GraphDef, dict of input names and dict of output names saved by save_frozen_graph.'''
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(filename, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    with tf.gfile.GFile(filename + '.json', 'r') as f:
+        io_names = json.load(f)
+    return graph_def, io_names['inputs'], io_names['outputs']
+
+class FrozenGraphSession(object):
+    '''Run a frozen GraphDef on CPU with feeds and fetches given by key.'''
+    def __init__(self, graph_def, inputs, outputs, num_cpu_threads = 0):
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self._inputs = dict((k, self._graph.get_tensor_by_name(v)) for k, v in inputs.items())
+        self._outputs = dict((k, self._graph.get_tensor_by_name(v)) for k, v in outputs.items())
+        self._sess = tf.Session(graph = self._graph, config = tf.ConfigProto(device_count = {'GPU': 0},
+                                                                            intra_op_parallelism_threads = num_cpu_threads,
+                                                                            inter_op_parallelism_threads = num_cpu_threads))
+
+    def input_shape(self, key):
+        return self._inputs[key].get_shape().as_list()
+
+    def run(self, feeds):
+        return self._sess.run(self._outputs, feed_dict = dict((self._inputs[k], v) for k, v in feeds.items()))
+
+    def close(self):
+        self._sess.close()
+
+def compare_outputs(reference, optimized, atol = 1e-3, max_mismatch = 0.02):
+    '''Compare two dicts of detections (see export_helper.flatten_detections).
+
+    Folded weights are rounded differently, so detections right at the select threshold
+    or nearly tied in score may change, up to `max_mismatch` of the valid detections
+    are allowed to differ by more than `atol`.
+
+    Return:
+        list of error messages, empty if the outputs match.
+    '''
+    errors = []
+    for key in sorted(reference.keys()):
+        if np.shape(reference[key]) != np.shape(optimized[key]):
+            errors.append('%s: shape %s vs %s' % (key, np.shape(reference[key]), np.shape(optimized[key])))
+    if errors:
+        return errors
+    valid_mask = np.logical_or(reference['scores'] > 0., optimized['scores'] > 0.)
+    num_valid = max(np.sum(valid_mask), 1)
+    for key in ('scores', 'labels', 'bboxes'):
+        diff = np.abs(np.asarray(reference[key], np.float64) - np.asarray(optimized[key], np.float64))
+        if diff.ndim > valid_mask.ndim:
+            diff = np.max(diff, axis=-1)
+        mismatch = np.sum(np.logical_and(diff > atol, valid_mask)) / float(num_valid)
+        if mismatch > max_mismatch:
+            errors.append('%s: %.2f%% of the detections differ, max abs diff %g' % (key, mismatch * 100., np.max(diff)))
+    num_diff = np.abs(np.asarray(reference['num_detections'], np.float64) - np.asarray(optimized['num_detections'], np.float64))
+    if np.sum(num_diff) / float(num_valid) > max_mismatch:
+        errors.append('num_detections: %d of %d detections differ' % (np.sum(num_diff), num_valid))
+    return errors
+
+def quantize_graph(graph_def, inputs, outputs):
+    '''Convert a frozen (and BN folded) GraphDef to eight bit with the graph_transforms
+    tool: weights are stored as uint8 and the supported ops (conv, matmul, relu, pooling,
+    concat, ...) run on quantized tensors, the others stay float behind Dequantize ops.
+
+    The activation ranges are computed at run time (RequantizationRange) until they are
+    frozen by freeze_requantization_ranges.
+    '''
+    from tensorflow.tools.graph_transforms import TransformGraph
+    input_nodes = sorted(set(_node_name(_) for _ in inputs.values()))
+    output_nodes = sorted(set(_node_name(_) for _ in outputs.values()))
+    return TransformGraph(graph_def, input_nodes, output_nodes,
+                        ['add_default_attributes',
+                        'quantize_weights',
+                        'quantize_nodes',
+                        'strip_unused_nodes',
+                        'sort_by_execution_order'])
+
+def get_requantization_ranges(graph_def):
+    '''Return the names of the RequantizationRange nodes, each gives the range of one
+    int32 accumulator before it is requantized to eight bit.'''
+    return [node.name for node in graph_def.node if node.op == 'RequantizationRange']
+
+class RangeCollector(object):
+    '''Run calibration batches through a quantized graph and keep the min/max seen by
+    each RequantizationRange node.'''
+    def __init__(self, graph_def, inputs, num_cpu_threads = 0):
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self._inputs = dict((k, self._graph.get_tensor_by_name(v)) for k, v in inputs.items())
+        self._range_names = get_requantization_ranges(graph_def)
+        self._fetches = [(self._graph.get_tensor_by_name(name + ':0'), self._graph.get_tensor_by_name(name + ':1')) for name in self._range_names]
+        self._sess = tf.Session(graph = self._graph, config = tf.ConfigProto(device_count = {'GPU': 0},
+                                                                            intra_op_parallelism_threads = num_cpu_threads,
+                                                                            inter_op_parallelism_threads = num_cpu_threads))
+        self.ranges = {}
+
+    def update(self, feeds):
+        values = self._sess.run(self._fetches, feed_dict = dict((self._inputs[k], v) for k, v in feeds.items()))
+        for name, (range_min, range_max) in zip(self._range_names, values):
+            if name in self.ranges:
+                self.ranges[name] = (min(self.ranges[name][0], float(range_min)), max(self.ranges[name][1], float(range_max)))
+            else:
+                self.ranges[name] = (float(range_min), float(range_max))
+
+    def close(self):
+        self._sess.close()
+
+def freeze_requantization_ranges(graph_def, ranges, output_names):
+    '''Feed the calibrated ranges to the Requantize nodes as constants, the
+    RequantizationRange nodes are then dropped, so the accumulators are not scanned
+    twice at run time. Nodes without a calibrated range keep the dynamic one.
+
+    Return:
+        the new GraphDef, number of frozen ranges.
+    '''
+    graph_def = copy.deepcopy(graph_def)
+    num_frozen = 0
+    new_nodes = []
+    for node in graph_def.node:
+        if node.op != 'Requantize':
+            continue
+        range_name = _node_name(node.input[3])
+        if range_name != _node_name(node.input[4]) or range_name not in ranges:
+            continue
+        for index, value in ((3, ranges[range_name][0]), (4, ranges[range_name][1])):
+            const_node = tf.NodeDef()
+            const_node.name = '%s/frozen_range_%s' % (node.name, 'min' if index == 3 else 'max')
+            const_node.op = 'Const'
+            const_node.attr['dtype'].CopyFrom(attr_value_pb2.AttrValue(type=tf.float32.as_datatype_enum))
+            _set_const(const_node, np.array(value, dtype=np.float32))
+            new_nodes.append(const_node)
+            node.input[index] = const_node.name
+        num_frozen += 1
+    graph_def.node.extend(new_nodes)
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, sorted(set(_node_name(_) for _ in output_names)))
+    return graph_def, num_frozen
@@ -0,0 +1,277 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import json
+import time
+import threading
+from concurrent import futures
+
+try:
+    import queue
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    import Queue as queue
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import numpy as np
+import tensorflow as tf
+
+from utility import export_helper
+
+def cpu_session_config(num_cpu_threads = 0):
+    return tf.ConfigProto(device_count = {'GPU': 0}, allow_soft_placement = True,
+                        intra_op_parallelism_threads = num_cpu_threads, inter_op_parallelism_threads = num_cpu_threads)
+
+class DetectorSession(object):
+    '''Load a SavedModel exported with export_helper.jpeg_serving_input_receiver_fn and
+    run its 'preprocessed' signature, which takes already preprocessed image batches.
+    '''
+    def __init__(self, saved_model_dir, num_cpu_threads = 0):
+        self._graph = tf.Graph()
+        self._sess = tf.Session(graph = self._graph, config = cpu_session_config(num_cpu_threads))
+        meta_graph = tf.saved_model.loader.load(self._sess, [tf.saved_model.tag_constants.SERVING], saved_model_dir)
+
+        signature = None
+        for name, signature_def in meta_graph.signature_def.items():
+            if 'image' in signature_def.inputs:
+                signature = signature_def
+                tf.logging.info('Using signature %s.', name)
+                break
+        if signature is None:
+            raise ValueError('No signature takes preprocessed images in %s, export it again with the current export_helper.' % saved_model_dir)
+        self._inputs = dict((k, self._graph.get_tensor_by_name(v.name)) for k, v in signature.inputs.items())
+        self._outputs = dict((k, self._graph.get_tensor_by_name(v.name)) for k, v in signature.outputs.items())
+
+        image_shape = self._inputs['image'].get_shape().as_list()
+        self.data_format = 'channels_first' if image_shape[1] == 3 else 'channels_last'
+        self.image_size = image_shape[2] if self.data_format == 'channels_first' else image_shape[1]
+
+    def run(self, images, image_shapes, bbox_imgs):
+        return self._sess.run(self._outputs, feed_dict = {self._inputs['image']: images,
+                                                        self._inputs['image_shape']: image_shapes,
+                                                        self._inputs['bbox_img']: bbox_imgs})
+
+    def close(self):
+        self._sess.close()
+
+class JpegPreprocessor(object):
+    '''Decode and preprocess one JPEG in a small graph of its own, session.run is thread
+    safe and releases the GIL, so it can be called from several threads at once.
+    '''
+    def __init__(self, preprocessing_name, image_size, data_format, num_cpu_threads = 0):
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._encoded_image = tf.placeholder(tf.string, shape=[], name='encoded_image')
+            self._outputs = export_helper.decode_and_preprocess_jpeg(self._encoded_image, preprocessing_name, image_size, data_format)
+        self._sess = tf.Session(graph = self._graph, config = cpu_session_config(num_cpu_threads))
+
+    def __call__(self, encoded_image):
+        return self._sess.run(self._outputs, feed_dict = {self._encoded_image: encoded_image})
+
+    def close(self):
+        self._sess.close()
+
+class LatencyStats(object):
+    '''Thread safe recorder of latency samples (ms), keeps the last `max_samples` of each name.'''
+    def __init__(self, max_samples = 10000):
+        self._max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value):
+        with self._lock:
+            samples = self._samples.setdefault(name, [])
+            samples.append(value)
+            if len(samples) > self._max_samples:
+                del samples[:len(samples) - self._max_samples]
+
+    def summary(self):
+        with self._lock:
+            samples = dict((k, list(v)) for k, v in self._samples.items())
+        result = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            result[name] = {'mean': float(np.mean(values)),
+                            'p50': float(np.percentile(values, 50)),
+                            'p95': float(np.percentile(values, 95)),
+                            'p99': float(np.percentile(values, 99))}
+        return result
+
+class DynamicBatcher(object):
+    '''In-process detection API with dynamic batching.
+
+    `submit` preprocesses the image on a thread pool then queues it, a single batching
+    thread takes up to `max_batch_size` queued images, waiting at most `max_wait_ms`
+    after the first one, and runs the detector once per batch. Returns futures whose
+    result is the dict of detections of that image (see export_helper.flatten_detections).
+    '''
+    def __init__(self, detector, preprocessor, max_batch_size = 8, max_wait_ms = 10., num_preprocess_threads = 4, max_queue_size = 1024):
+        self._detector = detector
+        self._preprocessor = preprocessor
+        self._max_batch_size = max_batch_size
+        self._max_wait_secs = max_wait_ms / 1000.
+        self._preprocess_pool = futures.ThreadPoolExecutor(max_workers = num_preprocess_threads)
+        self._queue = queue.Queue(maxsize = max_queue_size)
+        self._stats = LatencyStats()
+        self._lock = threading.Lock()
+        self._num_images = 0
+        self._num_batches = 0
+        self._num_errors = 0
+        self._start_time = time.time()
+        self._stopped = False
+        self._thread = threading.Thread(target = self._batch_loop, name = 'dynamic_batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, encoded_image):
+        result = futures.Future()
+        submit_time = time.time()
+        def preprocess():
+            try:
+                preprocessed = self._preprocessor(encoded_image)
+            except Exception as e:
+                with self._lock:
+                    self._num_errors += 1
+                result.set_exception(e)
+                return
+            self._stats.add('preprocess_ms', (time.time() - submit_time) * 1000.)
+            self._queue.put((preprocessed, submit_time, time.time(), result))
+        self._preprocess_pool.submit(preprocess)
+        return result
+
+    def detect(self, encoded_image, timeout = None):
+        return self.submit(encoded_image).result(timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self._max_wait_secs
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout = remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch[0] is None:
+                break
+            # a stop marker may be picked up in the middle of a batch
+            stop = any(item is None for item in batch)
+            batch = [item for item in batch if item is not None]
+
+            run_start = time.time()
+            try:
+                outputs = self._detector.run(np.stack([item[0][0] for item in batch]),
+                                            np.stack([item[0][1] for item in batch]),
+                                            np.stack([item[0][2] for item in batch]))
+            except Exception as e:
+                with self._lock:
+                    self._num_errors += len(batch)
+                for item in batch:
+                    item[3].set_exception(e)
+            else:
+                run_end = time.time()
+
+                self._stats.add('inference_ms', (run_end - run_start) * 1000.)
+                self._stats.add('batch_size', len(batch))
+                with self._lock:
+                    self._num_batches += 1
+                    self._num_images += len(batch)
+                for index, (_, submit_time, enqueue_time, result) in enumerate(batch):
+                    self._stats.add('queue_ms', (run_start - enqueue_time) * 1000.)
+                    self._stats.add('total_ms', (run_end - submit_time) * 1000.)
+                    result.set_result(dict((k, v[index]) for k, v in outputs.items()))
+            if stop:
+                break
+
+    def metrics(self):
+        with self._lock:
+            elapsed = time.time() - self._start_time
+            result = {'num_images': self._num_images,
+                    'num_batches': self._num_batches,
+                    'num_errors': self._num_errors,
+                    'images_per_sec': self._num_images / elapsed if elapsed > 0 else 0.,
+                    'max_batch_size': self._max_batch_size,
+                    'max_wait_ms': self._max_wait_secs * 1000.}
+        result.update(self._stats.summary())
+        return result
+
+    def close(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._preprocess_pool.shutdown(wait = True)
+        self._queue.put(None)
+        self._thread.join()
+
+def detections_to_json(detections, label2name_table = None):
+    '''Keep the valid detections of one image as a json serializable dict.'''
+    num_detections = int(detections['num_detections'])
+    results = []
+    for index in range(num_detections):
+        label = int(detections['labels'][index])
+        results.append({'label': label,
+                        'name': label2name_table.get(label, str(label)) if label2name_table else str(label),
+                        'score': float(detections['scores'][index]),
+                        'bbox': [float(_) for _ in detections['bboxes'][index]]})
+    return {'num_detections': num_detections, 'detections': results}
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def make_http_server(batcher, port, host = '0.0.0.0', label2name_table = None, timeout = 60.):
+    '''HTTP front end of a DynamicBatcher:
+        POST /detect with the raw JPEG bytes as body, returns the detections as json.
+        GET /metrics returns the batcher metrics as json.
+    '''
+    class DetectionHandler(BaseHTTPRequestHandler):
+        def _reply(self, code, result):
+            body = json.dumps(result).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/metrics':
+                self._reply(200, batcher.metrics())
+            else:
+                self._reply(404, {'error': 'unknown path %s' % self.path})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/detect':
+                self._reply(404, {'error': 'unknown path %s' % self.path})
+                return
+            encoded_image = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                detections = batcher.detect(encoded_image, timeout)
+            except Exception as e:
+                self._reply(500, {'error': str(e)})
+                return
+            self._reply(200, detections_to_json(detections, label2name_table))
+
+        def log_message(self, format, *args):
+            # one line per request is too much under load
+            pass
+
+    return _ThreadingHTTPServer((host, port), DetectionHandler)
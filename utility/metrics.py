@@ -48,13 +48,20 @@ def cummax(x, reverse=False, name=None):
     """
     with ops.name_scope(name, "Cummax", [x]) as name:
         x = ops.convert_to_tensor(x, name="x")
-        # Not very optimal: should directly integrate reverse into tf.scan.
         if reverse:
             x = tf.reverse(x, axis=[0])
-        # 'Accumlating' maximum: ensure it is always increasing.
-        cmax = tf.scan(lambda a, y: tf.maximum(a, y), x,
-                       initializer=None, parallel_iterations=1,
-                       back_prop=False, swap_memory=False)
+        # Log-step scan: before the step with shift k every element holds the maximum
+        # of the k elements ending at it, so ceil(log2(n)) vectorized steps are enough.
+        size = tf.shape(x)[0]
+        def _body(shift, cmax):
+            # the first `shift` elements already hold their prefix maximum, pad with cmax[0] <= them
+            shifted = tf.concat([tf.fill([shift], cmax[0]), cmax[:size - shift]], axis=0)
+            return shift * 2, tf.maximum(cmax, shifted)
+        _, cmax = tf.while_loop(lambda shift, cmax: shift < size, _body,
+                                [tf.constant(1, dtype=size.dtype), x],
+                                shape_invariants=[tf.TensorShape([]), tf.TensorShape([None])],
+                                back_prop=False)
+        cmax.set_shape(x.get_shape())
         if reverse:
             cmax = tf.reverse(cmax, axis=[0])
         return cmax
@@ -244,18 +251,31 @@ def average_precision_voc07(precision, recall, name=None):
     See also: https://sanchom.wordpress.com/tag/average-precision/
     """
     with tf.name_scope(name, 'average_precision_voc07', [precision, recall]):
-        # Convert to float64 to decrease error on cumulated sums.
-        precision = tf.cast(precision, dtype=tf.float64)
-        recall = tf.cast(recall, dtype=tf.float64)
-        # Add zero-limit value to avoid any boundary problem...
-        precision = tf.concat([precision, [0.]], axis=0)
-        recall = tf.concat([recall, [np.inf]], axis=0)
-
         # Split the integral into 10 bins.
-        l_aps = []
-        for t in np.arange(0., 1.1, 0.1):
-            mask = tf.greater_equal(recall, t)
-            v = tf.reduce_max(tf.boolean_mask(precision, mask))
-            l_aps.append(v / 11.)
-        ap = tf.add_n(l_aps)
-        return ap
+        return _average_interpolated_precision(precision, recall, np.arange(0., 1.1, 0.1))
+
+
+def average_precision_n_points(precision, recall, num_points=101, name=None):
+    """Compute N-point interpolated average precision from precision and recall
+    Tensors, recall thresholds are evenly spaced in [0, 1] (COCO uses 101 points).
+    """
+    with tf.name_scope(name, 'average_precision_%d_points' % num_points, [precision, recall]):
+        return _average_interpolated_precision(precision, recall, np.linspace(0., 1., num_points))
+
+
+def _average_interpolated_precision(precision, recall, thresholds):
+    """Mean over `thresholds` of the maximum precision at recall >= threshold.
+    """
+    # Convert to float64 to decrease error on cumulated sums.
+    precision = tf.cast(precision, dtype=tf.float64)
+    recall = tf.cast(recall, dtype=tf.float64)
+    # Interpolated precision: the maximum of all the points on its right,
+    # the trailing zero is used by thresholds above the largest recall.
+    precision = cummax(tf.concat([precision, [0.]], axis=0), reverse=True)
+    # recall is non-decreasing, so the first point with recall >= t is found by binary search
+    thresholds = tf.constant(thresholds, dtype=tf.float64)
+    if hasattr(tf, 'searchsorted'):
+        indices = tf.searchsorted(recall, thresholds, side='left')
+    else:
+        indices = tf.reduce_sum(tf.cast(tf.less(tf.expand_dims(recall, 0), tf.expand_dims(thresholds, 1)), tf.int32), axis=1)
+    return tf.reduce_mean(tf.gather(precision, indices))
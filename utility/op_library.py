@@ -0,0 +1,150 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+'''Build the custom op libraries in cpp/ once and reuse them.
+
+A library is cached as "lib<name>-<hash>.so" in a per-user directory, the hash covers
+the sources, the TensorFlow version and the compile flags, so it is rebuilt (with the
+CMakeLists.txt of the sources) only when one of them changes. Builds are guarded by a
+file lock so concurrent jobs on one machine build only once.
+
+    op_module = op_library.LazyOpLibrary('ps_roi_align')
+    op_module.ps_roi_align(...)  # built or loaded here
+'''
+import os
+import sys
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import contextlib
+
+import tensorflow as tf
+
+SOURCE_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'cpp')
+# the directory of the sources of each library
+SOURCE_DIRS = {'ps_roi_align': os.path.join(SOURCE_ROOT, 'PSROIPooling')}
+
+_SOURCE_EXTENSIONS = ('.h', '.cc', '.cu', '.txt')
+_loaded_libraries = {}
+
+def default_cache_dir():
+    '''$XDET_OP_CACHE_DIR, or ~/.cache/x_detector/ops, or a per-user directory in the temp dir.'''
+    if os.environ.get('XDET_OP_CACHE_DIR'):
+        return os.environ['XDET_OP_CACHE_DIR']
+    home = os.path.expanduser('~')
+    if os.path.isdir(home) and os.access(home, os.W_OK):
+        return os.path.join(home, '.cache', 'x_detector', 'ops')
+    return os.path.join(tempfile.gettempdir(), 'x_detector_ops_{}'.format(os.getuid()))
+
+def library_hash(source_dir):
+    '''Hash of the sources (including CMakeLists.txt and its compile flags), the TensorFlow version and the toolchain.'''
+    sha = hashlib.sha1()
+    for filename in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, filename)
+        if not os.path.isfile(path) or not filename.endswith(_SOURCE_EXTENSIONS):
+            continue
+        sha.update(filename.encode('utf-8'))
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    sysconfig = [tf.__version__, tf.sysconfig.get_include(), tf.sysconfig.get_lib()]
+    if hasattr(tf.sysconfig, 'get_compile_flags'):
+        sysconfig += tf.sysconfig.get_compile_flags() + tf.sysconfig.get_link_flags()
+    sysconfig += [os.environ.get(_, '') for _ in ['CXX', 'CXXFLAGS', 'CUDA_HOME']] + [sys.platform]
+    sha.update('\n'.join(sysconfig).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+@contextlib.contextmanager
+def _file_lock(filename):
+    with open(filename, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _copy_atomic(src, dst):
+    # copy next to the destination then rename, so no one can load a partial library
+    tmp_dst = '{}.tmp{}'.format(dst, os.getpid())
+    tf.gfile.Copy(src, tmp_dst, overwrite=True)
+    tf.gfile.Rename(tmp_dst, dst, overwrite=True)
+
+def _build(lib_name, source_dir, build_dir):
+    for cmd in [['cmake', source_dir], ['make']]:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=build_dir)
+        output, _ = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError('Failed to build lib{}.so, "{}" exited with {}:\n{}'.format(
+                                lib_name, ' '.join(cmd), process.returncode, output.decode('utf-8', 'replace')[-4000:]))
+    return os.path.join(build_dir, 'lib{}.so'.format(lib_name))
+
+def build_op_library(lib_name, source_dir=None, cache_dir=None, remote_dir=None, build=True):
+    '''Return the path of the cached library, building it on a cache miss.
+
+    Args:
+        remote_dir: optional shared (e.g. GCS) directory, a library missing from the local cache
+            is copied from here first, and a newly built one is uploaded here.
+        build: if False, raise IOError instead of building.
+    '''
+    source_dir = source_dir or SOURCE_DIRS[lib_name]
+    cache_dir = cache_dir or default_cache_dir()
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    lib_filename = 'lib{}-{}.so'.format(lib_name, library_hash(source_dir))
+    lib_path = os.path.join(cache_dir, lib_filename)
+    if os.path.exists(lib_path):
+        return lib_path
+
+    with _file_lock(lib_path + '.lock'):
+        # someone else may have built it while we were waiting
+        if os.path.exists(lib_path):
+            return lib_path
+        remote_path = os.path.join(remote_dir, lib_filename) if remote_dir else None
+        if remote_path and tf.gfile.Exists(remote_path):
+            tf.logging.info('Copying %s from %s.', lib_filename, remote_dir)
+            _copy_atomic(remote_path, lib_path)
+            return lib_path
+        if not build:
+            raise IOError('{} is not in {}.'.format(lib_filename, cache_dir))
+
+        tf.logging.info('Building %s from %s.', lib_filename, source_dir)
+        start_time = time.time()
+        build_dir = tempfile.mkdtemp(prefix='build_{}_'.format(lib_name), dir=cache_dir)
+        try:
+            _copy_atomic(_build(lib_name, source_dir, build_dir), lib_path)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        tf.logging.info('Built %s in %.1f secs.', lib_filename, time.time() - start_time)
+        if remote_path:
+            _copy_atomic(lib_path, remote_path)
+    return lib_path
+
+def load_op_library(lib_name, **kwargs):
+    '''Build (if needed) and load the library, only once for each process.'''
+    if lib_name not in _loaded_libraries:
+        _loaded_libraries[lib_name] = tf.load_op_library(build_op_library(lib_name, **kwargs))
+    return _loaded_libraries[lib_name]
+
+class LazyOpLibrary(object):
+    '''The module returned by tf.load_op_library, built and loaded on the first attribute access.'''
+    def __init__(self, lib_name, **kwargs):
+        self._lib_name = lib_name
+        self._kwargs = kwargs
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(load_op_library(self._lib_name, **self._kwargs), name)
@@ -0,0 +1,229 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import os
+import json
+import resource
+import contextlib
+import weakref
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+# graph -> list of (stage name, [op names]) pairs, not a graph collection since
+# tuples can not be serialized into the meta graph of the checkpoints and exports
+_graph_stages = weakref.WeakKeyDictionary()
+
+_stage_stack = []
+
+@contextlib.contextmanager
+def stage(name):
+    '''Put all ops created inside into a named scope and record them as one stage,
+    ops of a nested stage are only counted for the innermost one. The same name
+    can be used several times, e.g. in the body of a tf.map_fn.
+    '''
+    graph = tf.get_default_graph()
+    start = len(graph.get_operations())
+    claimed = set()
+    _stage_stack.append(claimed)
+    try:
+        with tf.name_scope(name):
+            yield
+    finally:
+        _stage_stack.pop()
+        new_ops = [op.name for op in graph.get_operations()[start:]]
+        _graph_stages.setdefault(graph, []).append((name, [op_name for op_name in new_ops if op_name not in claimed]))
+        if _stage_stack:
+            _stage_stack[-1].update(new_ops)
+
+def get_stage_ops(graph=None):
+    '''Return dict stage name -> set of op names.'''
+    graph = graph or tf.get_default_graph()
+    stage_ops = {}
+    for name, op_names in _graph_stages.get(graph, []):
+        stage_ops.setdefault(name, set()).update(op_names)
+    return stage_ops
+
+class StageLatencyHook(tf.train.SessionRunHook):
+    '''Trace every n-th step and attribute the executed ops to the stages.
+
+    For each stage this reports the wall time from its first op start to its last op
+    end (ms), the summed op time (ms) and the number of executed ops (loop bodies count
+    once per iteration). p50/p95/p99 are dumped as json and TensorBoard summaries
+    into `output_dir` when the session ends. A Chrome trace of the step is also
+    saved every `trace_every_n_steps` steps.
+    '''
+    def __init__(self, output_dir, every_n_steps = 10, trace_every_n_steps = 0):
+        self._output_dir = output_dir
+        self._every_n_steps = every_n_steps
+        self._trace_every_n_steps = trace_every_n_steps
+
+    def begin(self):
+        self._step = 0
+        self._traced = False
+        self._global_step_tensor = tf.train.get_global_step()
+        self._stage_ops = get_stage_ops()
+        self._op_to_stage = {}
+        for name, op_names in self._stage_ops.items():
+            for op_name in op_names:
+                self._op_to_stage[op_name] = name
+        self._records = dict((name, {'wall_ms': [], 'op_ms': [], 'op_count': []}) for name in self._stage_ops.keys())
+        if not tf.gfile.Exists(self._output_dir):
+            tf.gfile.MakeDirs(self._output_dir)
+
+    def _dump_trace(self):
+        return self._trace_every_n_steps > 0 and self._step % self._trace_every_n_steps == 0
+
+    def before_run(self, run_context):
+        self._traced = (self._every_n_steps > 0 and self._step % self._every_n_steps == 0) or self._dump_trace()
+        if not self._traced:
+            return None
+        trace_level = tf.RunOptions.FULL_TRACE if self._dump_trace() else tf.RunOptions.SOFTWARE_TRACE
+        return tf.train.SessionRunArgs(fetches=None, options=tf.RunOptions(trace_level=trace_level))
+
+    def after_run(self, run_context, run_values):
+        if self._traced and run_values.run_metadata is not None:
+            step_stats = run_values.run_metadata.step_stats
+            self._record(step_stats)
+            if self._dump_trace():
+                trace = timeline.Timeline(step_stats).generate_chrome_trace_format()
+                with tf.gfile.GFile(os.path.join(self._output_dir, 'timeline_step_%d.json' % self._step), 'w') as f:
+                    f.write(trace)
+        self._step += 1
+
+    def _record(self, step_stats):
+        starts = {}
+        ends = {}
+        op_micros = {}
+        op_count = {}
+        for dev_stats in step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                name = self._op_to_stage.get(node_stats.node_name.split(':')[0])
+                if name is None:
+                    continue
+                start = node_stats.all_start_micros
+                end = start + node_stats.all_end_rel_micros
+                starts[name] = min(starts.get(name, start), start)
+                ends[name] = max(ends.get(name, end), end)
+                op_micros[name] = op_micros.get(name, 0) + node_stats.all_end_rel_micros
+                op_count[name] = op_count.get(name, 0) + 1
+        for name in starts.keys():
+            self._records[name]['wall_ms'].append((ends[name] - starts[name]) / 1000.)
+            self._records[name]['op_ms'].append(op_micros[name] / 1000.)
+            self._records[name]['op_count'].append(op_count[name])
+
+    def end(self, session):
+        report = {}
+        summary = tf.Summary()
+        for name, records in self._records.items():
+            if not records['wall_ms']:
+                continue
+            report[name] = {'num_steps': len(records['wall_ms']),
+                            'num_graph_ops': len(self._stage_ops[name])}
+            for key, values in records.items():
+                for percentile in (50, 95, 99):
+                    value = float(np.percentile(values, percentile))
+                    report[name]['%s_p%d' % (key, percentile)] = value
+                    summary.value.add(tag='stage_latency/%s/%s_p%d' % (name, key, percentile), simple_value=value)
+        with tf.gfile.GFile(os.path.join(self._output_dir, 'stage_latency.json'), 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        summary_writer = tf.summary.FileWriterCache.get(self._output_dir)
+        global_step = session.run(self._global_step_tensor) if self._global_step_tensor is not None else self._step
+        summary_writer.add_summary(summary, global_step)
+        summary_writer.flush()
+        for name in sorted(report.keys()):
+            tf.logging.info('Stage %s: wall p50 %.2f ms, p99 %.2f ms, %d ops.', name, report[name]['wall_ms_p50'], report[name]['wall_ms_p99'], report[name]['op_count_p50'])
+
+class ProfileHook(tf.train.SessionRunHook):
+    '''Fully trace every n-th step and write into `output_dir`:
+
+        timeline_step_N.json: Chrome trace, with the memory of each allocator.
+        ops_step_N.tsv: time and memory of every executed op, the slowest first.
+        memory_step_N.json: peak bytes of each allocator, peak resident memory of this
+            process and the largest tensors produced in the step.
+
+    N is the global step. The peak memory is also written as TensorBoard summaries.
+    '''
+    def __init__(self, output_dir, every_n_steps, num_largest_tensors = 20):
+        self._output_dir = output_dir
+        self._every_n_steps = every_n_steps
+        self._num_largest_tensors = num_largest_tensors
+
+    def begin(self):
+        self._step = 0
+        self._global_step_tensor = tf.train.get_global_step()
+        if not tf.gfile.Exists(self._output_dir):
+            tf.gfile.MakeDirs(self._output_dir)
+
+    def before_run(self, run_context):
+        # the first step is left out, it includes the startup
+        self._traced = self._step > 0 and self._step % self._every_n_steps == 0
+        if not self._traced:
+            return None
+        fetches = self._global_step_tensor if self._global_step_tensor is not None else []
+        return tf.train.SessionRunArgs(fetches=fetches, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+
+    def after_run(self, run_context, run_values):
+        if self._traced and run_values.run_metadata is not None:
+            global_step = run_values.results if self._global_step_tensor is not None else self._step
+            self._write(global_step, run_values.run_metadata.step_stats)
+        self._step += 1
+
+    def _write(self, global_step, step_stats):
+        trace = timeline.Timeline(step_stats).generate_chrome_trace_format(show_memory=True)
+        with tf.gfile.GFile(os.path.join(self._output_dir, 'timeline_step_%d.json' % global_step), 'w') as f:
+            f.write(trace)
+
+        ops = []
+        tensors = []
+        allocator_peaks = {}
+        for dev_stats in step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                output_bytes = 0
+                for output in node_stats.output:
+                    num_bytes = output.tensor_description.allocation_description.requested_bytes
+                    output_bytes += num_bytes
+                    shape = [dim.size for dim in output.tensor_description.shape.dim]
+                    tensors.append((num_bytes, '%s:%d' % (node_stats.node_name, output.slot), shape))
+                peak_bytes = 0
+                for memory in node_stats.memory:
+                    peak_bytes = max(peak_bytes, memory.peak_bytes)
+                    allocator_peaks[memory.allocator_name] = max(allocator_peaks.get(memory.allocator_name, 0), memory.peak_bytes)
+                ops.append((node_stats.all_end_rel_micros, node_stats.node_name, node_stats.timeline_label.split(' = ')[-1].split('(')[0], dev_stats.device, output_bytes, peak_bytes))
+
+        with tf.gfile.GFile(os.path.join(self._output_dir, 'ops_step_%d.tsv' % global_step), 'w') as f:
+            f.write('time_ms\top\ttype\tdevice\toutput_bytes\tallocator_peak_bytes\n')
+            for micros, name, op_type, device, output_bytes, peak_bytes in sorted(ops, reverse=True):
+                f.write('%.3f\t%s\t%s\t%s\t%d\t%d\n' % (micros / 1000., name, op_type, device, output_bytes, peak_bytes))
+
+        # ru_maxrss is in kilobytes on Linux
+        peak_host_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        largest = sorted(tensors, reverse=True)[:self._num_largest_tensors]
+        report = {'global_step': int(global_step),
+                'peak_host_memory_mb': peak_host_mb,
+                'allocator_peak_mb': dict((name, peak / 1024. / 1024.) for name, peak in allocator_peaks.items()),
+                'largest_tensors': [{'tensor': name, 'shape': shape, 'mb': num_bytes / 1024. / 1024.} for num_bytes, name, shape in largest]}
+        with tf.gfile.GFile(os.path.join(self._output_dir, 'memory_step_%d.json' % global_step), 'w') as f:
+            json.dump(report, f, indent=2)
+
+        summary = tf.Summary()
+        summary.value.add(tag='profile/peak_host_memory_mb', simple_value=peak_host_mb)
+        for name, peak_mb in report['allocator_peak_mb'].items():
+            summary.value.add(tag='profile/allocator_peak_mb/%s' % name, simple_value=peak_mb)
+        summary_writer = tf.summary.FileWriterCache.get(self._output_dir)
+        summary_writer.add_summary(summary, global_step)
+        summary_writer.flush()
+        tf.logging.info('Profiled step %d: peak host memory %.1f MB, %s.', global_step, peak_host_mb,
+                        ', '.join('%s %.1f MB' % (name, peak_mb) for name, peak_mb in sorted(report['allocator_peak_mb'].items())) or 'no allocator stats')
@@ -1,6 +1,13 @@
+import json
 import os
+import re
+import time
 
 import tensorflow as tf
+from tensorflow.python.ops import gen_data_flow_ops
+
+from utility import cli
+from utility import checkpoint_restore
 
 def get_init_fn_for_scaffold(flags):
     flags_checkpoint_path = flags.checkpoint_path
@@ -10,25 +17,10 @@ def get_init_fn_for_scaffold(flags):
     if tf.train.latest_checkpoint(flags.model_dir):
         tf.logging.info('Ignoring --checkpoint_path because a checkpoint already exists in %s' % flags.model_dir)
         return None
-    exclusions = []
+    exclusions = ()
     if flags.checkpoint_exclude_scopes:
-        exclusions = [scope.strip() for scope in flags.checkpoint_exclude_scopes.split(',')]
-    variables_to_restore = []
-    for var in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES):
-        excluded = False
-        #print(var.op.name)
-        for exclusion in exclusions:
-            if var.op.name.startswith(exclusion):
-                excluded = True
-                break
-        if not excluded:
-            variables_to_restore.append(var)
-    if flags.checkpoint_model_scope is not None:
-        if flags.checkpoint_model_scope.strip() == '':
-            variables_to_restore = {var.op.name.replace(flags.model_scope + '/', flags.checkpoint_model_scope): var for var in variables_to_restore}
-        else:
-            variables_to_restore = {var.op.name.replace(flags.model_scope, flags.checkpoint_model_scope): var for var in variables_to_restore}
-
+        exclusions = tuple(scope.strip() for scope in flags.checkpoint_exclude_scopes.split(','))
+    variables_to_restore = [var for var in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES) if not (exclusions and var.op.name.startswith(exclusions))]
     if tf.gfile.IsDirectory(flags_checkpoint_path):
         checkpoint_path = tf.train.latest_checkpoint(flags_checkpoint_path)
     else:
@@ -36,42 +28,18 @@ def get_init_fn_for_scaffold(flags):
 
     tf.logging.info('Fine-tuning from %s. Ignoring missing vars: %s' % (checkpoint_path, flags.ignore_missing_vars))
 
-    # For DEBUG #
-    # reader = tf.train.NewCheckpointReader(checkpoint_path)
-    # variables = reader.get_variable_to_shape_map()
-    # print('######################## variables in checkpoint ########################')
-    # for ele in variables:
-    #     print(ele)
-    # print('######################### variables_to_restore #########################')
-    # for ele in variables_to_restore:
-    #     print(ele)
-    # For DEBUG #
     if not variables_to_restore:
         raise ValueError('variables_to_restore cannot be empty')
-    if flags.ignore_missing_vars:
-        reader = tf.train.NewCheckpointReader(checkpoint_path)
-        if isinstance(variables_to_restore, dict):
-            var_dict = variables_to_restore
-        else:
-            var_dict = {var.op.name: var for var in variables_to_restore}
-        available_vars = {}
-        for var in var_dict:
-            if reader.has_tensor(var):
-                available_vars[var] = var_dict[var]
-            else:
-                tf.logging.warning('Variable %s missing in checkpoint %s', var, checkpoint_path)
-        variables_to_restore = available_vars
-    if variables_to_restore:
-        saver = tf.train.Saver(variables_to_restore, reshape=False)
-        saver.build()
-        def callback(scaffold, session):
-            saver.restore(session, checkpoint_path)
-        return callback
-    else:
+    # the scope remapping, missing and mismatched variables are resolved from one read of the checkpoint index and cached
+    init_fn = checkpoint_restore.build_restore_fn(checkpoint_path, variables_to_restore, flags.model_scope, flags.checkpoint_model_scope, flags.ignore_missing_vars)
+    if init_fn is None:
         tf.logging.warning('No Variables to restore')
-        return None
+    return init_fn
 
 def get_latest_checkpoint_for_evaluate(flags):
+    # an explicit checkpoint, e.g. one picked by eval_watcher.py
+    if getattr(flags, 'checkpoint_to_evaluate', None):
+        return flags.checkpoint_to_evaluate
     flags_checkpoint_path = flags.checkpoint_path
     if flags.run_on_cloud:
         flags_checkpoint_path = flags.model_dir
@@ -89,3 +57,186 @@ def get_latest_checkpoint_for_evaluate(flags):
 
     return checkpoint_path
 
+
+def accumulate_gradients(optimizer, loss, global_step, accumulate_steps):
+    '''Return a train op summing the gradients of accumulate_steps runs into non-trainable accumulators,
+    the last run applies their mean with optimizer and resets them. So global_step and the learning rate
+    schedule only advance once every accumulate_steps runs.
+    '''
+    grads_and_vars = [(grad, var) for grad, var in optimizer.compute_gradients(loss) if grad is not None]
+    # local variables are neither trained nor saved into the checkpoints
+    with tf.variable_scope('gradient_accumulation'):
+        accumulators = [tf.get_local_variable(var.op.name, shape=var.get_shape(), dtype=var.dtype.base_dtype,
+                                            initializer=tf.zeros_initializer(), trainable=False) for _, var in grads_and_vars]
+        num_accumulated = tf.get_local_variable('num_accumulated', shape=[], dtype=tf.int32,
+                                            initializer=tf.zeros_initializer(), trainable=False)
+
+    # sparse gradients are made dense
+    accumulate_ops = [accumulator.assign_add(tf.convert_to_tensor(grad)) for accumulator, (grad, _) in zip(accumulators, grads_and_vars)]
+    with tf.control_dependencies(accumulate_ops):
+        num_accumulated = num_accumulated.assign_add(1)
+
+    def apply_and_reset():
+        # read_value() inside the branch, so the accumulators are read after this run's gradients were added
+        apply_op = optimizer.apply_gradients([(accumulator.read_value() / accumulate_steps, var) for accumulator, (_, var) in zip(accumulators, grads_and_vars)],
+                                            global_step)
+        with tf.control_dependencies([apply_op]):
+            return tf.group(*[accumulator.assign(tf.zeros_like(accumulator)) for accumulator in accumulators])
+
+    return tf.cond(tf.equal(num_accumulated % accumulate_steps, 0), apply_and_reset, tf.no_op)
+
+
+class StartupTimerHook(tf.train.SessionRunHook):
+    '''Log the time from the start of the process to the end of the first step, split into
+    the phases recorded by utility/cli.py (flags, imports, graph, session and the first step).
+    '''
+    def __init__(self):
+        self._first_step_done = False
+
+    def begin(self):
+        cli.mark('graph')
+
+    def after_create_session(self, session, coord):
+        cli.mark('session')
+
+    def after_run(self, run_context, run_values):
+        if self._first_step_done:
+            return
+        self._first_step_done = True
+        cli.mark('first_step')
+        total_secs, phases, import_secs = cli.startup_report()
+        tf.logging.info('Time to first step: %.2f secs (%s).', total_secs,
+                        ', '.join('{} {:.2f}'.format(phase, secs) for phase, secs in phases))
+        if import_secs:
+            tf.logging.info('Lazy imports: %s.', ', '.join('{} {:.2f}'.format(name, secs) for name, secs in sorted(import_secs.items(), key=lambda _: -_[1])))
+
+def start_std_server(run_config, session_config):
+    '''Start the server of this task in the cluster of TF_CONFIG.'''
+    return tf.train.Server(run_config.cluster_spec,
+                            job_name=run_config.task_type,
+                            task_index=run_config.task_id,
+                            config=session_config,
+                            start=True)
+
+def get_worker_shard(run_config):
+    '''Return (the number of workers, the index of this one), the chief is the first worker.'''
+    if run_config.task_type == 'chief':
+        return run_config.num_worker_replicas, 0
+    # the index of the workers is counted without the chief
+    num_chief = len(run_config.cluster_spec.as_dict().get('chief', []))
+    return run_config.num_worker_replicas, run_config.task_id + num_chief
+
+
+class ThroughputHook(tf.train.SessionRunHook):
+    '''Measure the images per second of this process after warmup_steps steps, and rewrite them
+    into a json file every write_every_n_steps steps, so a worker killed at the end of training
+    still leaves its result.
+    '''
+    def __init__(self, batch_size, filename, warmup_steps = 5, write_every_n_steps = 10):
+        self._batch_size = batch_size
+        self._filename = filename
+        self._warmup_steps = warmup_steps
+        self._write_every_n_steps = write_every_n_steps
+        self._step = 0
+        self._start_time = None
+
+    def after_run(self, run_context, run_values):
+        self._step += 1
+        if self._step == self._warmup_steps:
+            self._start_time = time.time()
+        elif self._step > self._warmup_steps and (self._step - self._warmup_steps) % self._write_every_n_steps == 0:
+            self._write()
+
+    def end(self, session):
+        if self._start_time is not None and self._step > self._warmup_steps:
+            self._write()
+
+    def _write(self):
+        steps = self._step - self._warmup_steps
+        secs = time.time() - self._start_time
+        result = {'steps': steps,
+                'images': steps * self._batch_size,
+                'secs': secs,
+                'images_per_sec': steps * self._batch_size / secs}
+        tmp_filename = self._filename + '.tmp'
+        with tf.gfile.GFile(tmp_filename, 'w') as f:
+            json.dump(result, f)
+        tf.gfile.Rename(tmp_filename, self._filename, overwrite=True)
+
+# the ops which block session.run until the input pipeline delivers a batch
+_INPUT_OP_TYPES = ('QueueDequeueManyV2', 'QueueDequeueUpToV2', 'QueueDequeueV2', 'IteratorGetNext')
+_DEQUEUE_OP_TYPES = ('QueueDequeueManyV2', 'QueueDequeueUpToV2', 'QueueDequeueV2')
+_QUEUE_OP_TYPES = ('FIFOQueueV2', 'PaddingFIFOQueueV2', 'RandomShuffleQueueV2', 'PriorityQueueV2')
+
+class StepTimeHook(tf.train.SessionRunHook):
+    '''Split the time of each step into the wait for the input, the rest of session.run and the
+    host overhead between two session.run calls (the other hooks, logging), and log their means
+    over the last every_n_steps steps together with the fill levels of the input queues.
+
+    The input wait is how long the dequeue ops of the batch queues under input_scopes (the ones of
+    tf.train.batch in dataset_factory.get_dataset) or the dataset iterators block, read from a software
+    trace of every trace_every_n_steps-th step. Other dequeues like the token queue of
+    SyncReplicasOptimizer are not input. A warning is logged when it is more than warning_fraction
+    of session.run, i.e. the input pipeline needs more readers or preprocessing threads.
+    '''
+    def __init__(self, every_n_steps = 100, trace_every_n_steps = 10, warning_fraction = 0.2, input_scopes = ('batch', 'prefetch_queue')):
+        self._every_n_steps = every_n_steps
+        # the scopes may be uniquified as batch_1 by a second input pipeline
+        self._input_scope_re = re.compile(r'^({})(_\d+)?(/|$)'.format('|'.join(re.escape(scope) for scope in input_scopes)))
+        self._trace_every_n_steps = trace_every_n_steps
+        self._warning_fraction = warning_fraction
+
+    def begin(self):
+        self._step = 0
+        self._last_end = None
+        self._run_secs, self._host_secs, self._wait_fractions = [], [], []
+        graph = tf.get_default_graph()
+        self._input_ops = set(op.name for op in graph.get_operations() if op.type in _INPUT_OP_TYPES and
+                                (op.type not in _DEQUEUE_OP_TYPES or self._input_scope_re.match(op.name)))
+        # the queue runners fill the queues in their own threads, their sizes are read in the train step
+        self._queues = []
+        with tf.name_scope('step_time_hook'):
+            for op in graph.get_operations():
+                if op.type in _QUEUE_OP_TYPES:
+                    with tf.device(op.device):
+                        self._queues.append((op.name, op.get_attr('capacity'), gen_data_flow_ops.queue_size_v2(op.outputs[0])))
+
+    def before_run(self, run_context):
+        self._run_start = time.time()
+        if self._last_end is not None:
+            self._host_secs.append(self._run_start - self._last_end)
+        # the first step is left out, it includes the startup
+        self._traced = self._step > 0 and self._trace_every_n_steps > 0 and self._step % self._trace_every_n_steps == 0
+        self._log = self._step > 0 and self._step % self._every_n_steps == 0
+        fetches = [size for _, _, size in self._queues] if self._log else None
+        options = tf.RunOptions(trace_level=tf.RunOptions.SOFTWARE_TRACE) if self._traced else None
+        return tf.train.SessionRunArgs(fetches=fetches, options=options)
+
+    def after_run(self, run_context, run_values):
+        run_secs = time.time() - self._run_start
+        if self._step > 0:
+            self._run_secs.append(run_secs)
+        if self._traced and run_values.run_metadata is not None:
+            wait_micros = 0
+            for dev_stats in run_values.run_metadata.step_stats.dev_stats:
+                for node_stats in dev_stats.node_stats:
+                    if node_stats.node_name.split(':')[0] in self._input_ops:
+                        # the dequeues run in parallel
+                        wait_micros = max(wait_micros, node_stats.all_end_rel_micros)
+            self._wait_fractions.append(min(wait_micros / 1e6 / run_secs, 1.))
+        if self._log:
+            self._report(run_values.results)
+        self._step += 1
+        self._last_end = time.time()
+
+    def _report(self, queue_sizes):
+        run_ms = 1000. * sum(self._run_secs) / max(len(self._run_secs), 1)
+        host_ms = 1000. * sum(self._host_secs) / max(len(self._host_secs), 1)
+        wait_fraction = sum(self._wait_fractions) / len(self._wait_fractions) if self._wait_fractions else 0.
+        queue_fill = ', '.join('{} {}/{}'.format(name, size, capacity) for (name, capacity, _), size in zip(self._queues, queue_sizes))
+        tf.logging.info('Step time %.1f ms: input wait %.1f ms (%.0f%%), compute %.1f ms, host overhead %.1f ms; queues: %s.',
+                        run_ms + host_ms, wait_fraction * run_ms, 100. * wait_fraction, (1. - wait_fraction) * run_ms, host_ms, queue_fill or 'none')
+        if self._wait_fractions and wait_fraction > self._warning_fraction:
+            tf.logging.warning('The input pipeline is the bottleneck: %.0f%% of session.run waits for the input, '
+                                'consider more --num_preprocessing_threads or --num_readers.', 100. * wait_fraction)
+        self._run_secs, self._host_secs, self._wait_fractions = [], [], []
@@ -0,0 +1,128 @@
+# Copyright 2018 Changan Wang
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+import tensorflow as tf
+
+class AsyncImageWriter(object):
+    '''Draw detections and write them as JPEG files on background threads.
+
+    `submit` is meant to be called from a `tf.py_func`, it only crops and copies
+    the sampled images into a bounded queue so the session run never waits on
+    OpenCV drawing or disk writes. When the queue is full new images are dropped
+    (or the caller waits if `block` is set).
+
+    every_n: only the every n-th evaluated image is considered, 0 disables drawing.
+    only_failures: only images with failures (see `submit`) are saved.
+    '''
+    def __init__(self, output_dir, every_n = 1, only_failures = False, max_queue_size = 64, num_threads = 1, block = False):
+        super(AsyncImageWriter, self).__init__()
+        self._output_dir = output_dir
+        self._every_n = every_n
+        self._only_failures = only_failures
+        self._block = block
+        self._counter = 0
+        self._num_dropped = 0
+        self._num_written = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize = max_queue_size)
+        self._threads = []
+        self._closed = False
+        if self._every_n > 0:
+            if not os.path.exists(self._output_dir):
+                os.makedirs(self._output_dir)
+            for index in range(max(1, num_threads)):
+                thread = threading.Thread(target = self._worker, name = 'vis_writer_%d' % index)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def num_dropped(self):
+        return self._num_dropped
+
+    @property
+    def num_written(self):
+        return self._num_written
+
+    def submit(self, images, shapes, labels, scores, bboxes, failures = None):
+        '''All inputs are batched numpy arrays, images are zero padded to the largest
+        one in the batch and cropped back with `shapes`. `failures` is the number of
+        missed ground truth and confident false positives of each image.
+        Returns the number of images seen so far.
+        '''
+        for index in range(images.shape[0]):
+            with self._lock:
+                self._counter += 1
+                counter = self._counter
+            if self._every_n < 1 or counter % self._every_n != 0:
+                continue
+            if self._only_failures and failures is not None and failures[index] < 1:
+                continue
+            height, width = int(shapes[index][0]), int(shapes[index][1])
+            # the buffers of py_func inputs may be reused after we return, so copy them
+            item = (counter, np.copy(images[index][:height, :width, :]), np.copy(labels[index]), np.copy(scores[index]), np.copy(bboxes[index]))
+            try:
+                self._queue.put(item, block = self._block)
+            except queue.Full:
+                with self._lock:
+                    self._num_dropped += 1
+        return np.int64(self._counter)
+
+    def _worker(self):
+        # import here so the eval graph can be built without OpenCV
+        import cv2
+        from utility import draw_toolbox
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            counter, image, labels, scores, bboxes = item
+            try:
+                img_to_draw = draw_toolbox.bboxes_draw_on_img(image, labels, scores, bboxes, thickness=2)
+                cv2.imwrite(os.path.join(self._output_dir, '{}.jpg'.format(counter)), img_to_draw[:, :, ::-1])
+                with self._lock:
+                    self._num_written += 1
+            except Exception as e:
+                tf.logging.warning('Failed to write image %d: %s', counter, e)
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        '''Wait for all queued images to be written and stop the threads.'''
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        tf.logging.info('Visualization writer: %d images written, %d dropped.', self._num_written, self._num_dropped)
+
+class AsyncImageWriterHook(tf.train.SessionRunHook):
+    '''Flush the pending images of an AsyncImageWriter when the session ends.'''
+    def __init__(self, writer):
+        self._writer = writer
+
+    def end(self, session):
+        self._writer.close()